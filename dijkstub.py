@@ -0,0 +1,61 @@
+#!/usr/bin/python
+
+""" The stuffs related to the stub of the dijkstra program.
+Same input and output as the dijk2 program, searching with graphsearch:
+    dijkstub.py <edges file>: text edge list in, JSON result out
+    dijkstub.py --binary: binary edge stream in on stdin, binary result out (see graphsearch)
+"""
+import json
+import math
+import sys
+import numpy as np
+import graphsearch
+
+def search_text(filepath):
+    """ Search the graph of a text edge list written for the dijk2 program
+    Args:
+        filepath: path of the edge list, 'number of vertexes, target' on the first line and
+                  'vertex, vertex, weight' on the others
+    Returns:
+        result_dict: dictionary of the result as given by the dijk2 program
+    Raises:
+        Native exceptions.
+    """
+    with open(filepath) as the_file:
+        num_vertex, target = [int(elem) for elem in the_file.readline().split(',')]
+        edges = np.loadtxt(the_file, delimiter=',', ndmin=2)
+    indptr, indices, weights = graphsearch.get_csr(edges[:, 0].astype(np.int64)
+                                                   , edges[:, 1].astype(np.int64)
+                                                   , edges[:, 2], num_vertex)
+    dists, prevs = graphsearch.dijkstra_csr(indptr, indices, weights, 0)
+    return graphsearch.get_result_dict(range(num_vertex), dists, prevs, target)
+
+def search_binary(data):
+    """ Search the graph of a binary edge stream
+    Args:
+        data: bytes of the stream given by graphsearch.pack_edges
+    Returns:
+        data: bytes of the result given by graphsearch.pack_result
+    Raises:
+        Native exceptions.
+    """
+    num_vertex, target, idx_src, idx_dst, weights = graphsearch.unpack_edges(data)
+    indptr, indices, weights = graphsearch.get_csr(idx_src.astype(np.int64)
+                                                   , idx_dst.astype(np.int64)
+                                                   , weights.astype(np.float64), num_vertex)
+    dists, prevs = graphsearch.dijkstra_csr(indptr, indices, weights, 0)
+    return graphsearch.pack_result(graphsearch.get_path(prevs, target)
+                                   , [dists.get(num, math.inf) for num in range(num_vertex)])
+
+
+def main():
+    """ run the stub
+    """
+    if sys.argv[1:] == ['--binary']:
+        sys.stdout.buffer.write(search_binary(sys.stdin.buffer.read()))
+    else:
+        print(json.dumps(search_text(sys.argv[1])))
+
+
+if __name__ == '__main__':
+    main()
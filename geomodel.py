@@ -2,7 +2,34 @@
 
 """ The stuffs related to building geo model.
 """
+import atexit
 import bisect
+import hashlib
+import os
+import struct
+import tempfile
+import time
+import unittest
+from multiprocessing import shared_memory
+import numpy as np
+
+# Binary model: 64 bytes header (magic, lon/lat/dep dims, sha256 of the data), then the
+# lon, lat, dep axes and the lon x lat x dep velocities, all little endian float64
+_BINARY_MAGIC = b'GEOMODL1'
+_BINARY_HEADER = struct.Struct('<8s3I32s')
+_BINARY_HEADER_SIZE = 64
+# Bytes of a binary model read at once to check its checksum
+_BINARY_CHUNK_SIZE = 1 << 22
+
+# Relative tolerance on the axis steps to detect uniform and piecewise-uniform axes, and the
+# largest lookup table built for an axis
+_LOOKUP_TOL = 1e-9
+_LOOKUP_TABLE_MAX = 1 << 20
+
+# Process-wide read-only models keyed by (absolute path, mtime), and the shared memory
+# blocks of this process, with the model key for the published ones (None if attached)
+_MODEL_CACHE = {}
+_SHARED_MEMORY = {}
 
 #是否有private class的可能（在下面新增的時候？）
 class GeoSpeed(object):
@@ -114,19 +141,160 @@ class GeoSpeed(object):
         return self._speed
 
 
+class _AxisLookup(object):
+    """ Cell lookup along one model axis
+    Gives the same index as bisect_right(scale, val) - 1 with one of the strategies
+        uniform: arithmetic on the constant step
+        piecewise: lookup table on the lattice of the smallest step, which all the nodes lie on
+        table: lookup table on buckets of the smallest step, at most one node per bucket
+        bisect: binary search (decreasing axis, table too large, or forced)
+    Values within a tolerance of a step or bucket bound, and out of the axis, are bisected.
+    The strategies serve the batch lookups; for a single value bisect_right (in C) is faster
+    than any arithmetic done in Python on axes of this size.
+    """
+    def __init__(self, scale, lookup='auto'):
+        self._axis = np.array(scale, dtype=np.float64)
+        self._strategy = 'bisect'
+        self._origin = 0.0
+        self._inv = 0.0
+        self._num = 0
+        self._eps = 0.0
+        self._table = None
+        if lookup == 'auto' and len(self._axis) >= 2:
+            self._set_strategy()
+
+    def _set_strategy(self):
+        steps = np.diff(self._axis)
+        step_min = steps.min()
+        if not step_min > 0:
+            return
+        span = self._axis[-1] - self._axis[0]
+        ratios = steps / step_min
+        if np.all(np.abs(ratios - 1) <= _LOOKUP_TOL):
+            strategy = 'uniform'
+            self._num = len(self._axis) - 1
+            self._inv = self._num / span
+        else:
+            if np.all(np.abs(ratios - np.round(ratios)) <= _LOOKUP_TOL * ratios):
+                strategy = 'piecewise'
+                self._num = int(round(span / step_min))
+                nodes = np.round((self._axis - self._axis[0]) / step_min)
+                buckets = np.arange(self._num)
+            else:
+                strategy = 'table'
+                self._num = int(np.ceil(span / step_min))
+                step_min = span / self._num
+                nodes = self._axis - self._axis[0]
+                buckets = np.arange(self._num) * step_min
+            if self._num > _LOOKUP_TABLE_MAX:
+                return
+            self._inv = 1 / step_min
+            self._table = np.searchsorted(nodes, buckets, side='right') - 1
+        # the nodes drift from the step bounds by at most the accumulated step tolerance
+        self._eps = 4 * (self._num + 1) * _LOOKUP_TOL
+        self._origin = self._axis[0]
+        self._strategy = strategy
+
+    def get_strategy(self):
+        """ Return the lookup strategy
+        Args:
+        Returns:
+            strategy: 'uniform', 'piecewise', 'table' or 'bisect'
+        Raises:
+            Native exceptions.
+        """
+        return self._strategy
+
+    def get_idxs(self, vals):
+        """ Return the indexes of the cells of an array of values
+        Args:
+            vals: array of coordinates along the axis
+        Returns:
+            idxs: array of bisect_right(scale, val) - 1
+        Raises:
+            Native exceptions.
+        """
+        if self._strategy == 'bisect':
+            return np.searchsorted(self._axis, vals, side='right') - 1
+        pos = (vals - self._origin) * self._inv
+        bases = np.floor(pos)
+        with np.errstate(invalid='ignore'):
+            fracs = pos - bases
+        suspects = np.flatnonzero(~((fracs > self._eps) & (fracs < 1 - self._eps)
+                                    & (bases >= 0) & (bases < self._num)))
+        idxs = np.clip(np.nan_to_num(bases), 0, self._num - 1).astype(np.int64)
+        if self._table is not None:
+            idxs = self._table[idxs]
+        if self._strategy == 'table':
+            idxs += self._axis[idxs + 1] <= vals
+        idxs[suspects] = np.searchsorted(self._axis, vals[suspects], side='right') - 1
+        return idxs
+
+
 class GeoModel(object):
     """ Look up the speed in velocity modeel
+    The velocities are kept in one contiguous lon x lat x dep array, and the cells of batch
+    lookups are found by arithmetic or lookup tables on the axes (see get_lookup_strategy)
     Public Methods:
         get_speed: get the speed of the location
+        get_geo_speed: get the GeoSpeed of a model node
+        get_info: get the size and loading time of the model
+        set_lookup: select automatic cell lookup or plain bisect
+        get_lookup_strategy: get the cell lookup strategy of each axis
     """
-    def __init__(self, filepath=None):
+    def __init__(self, filepath=None, dtype=np.float64, convert=False, data=None
+                 , verify=False):
+        """ Load the model
+        A binary model file, or a binary sidecar (filepath + '.bin') not older than the text
+        model, is memory mapped after checking its size, and its checksum when verify is
+        True; otherwise the text model is parsed, and converted into the sidecar when convert
+        is True.
+        Args:
+            filepath: path of the text or binary model
+            dtype: float type of the velocities
+            convert: write the binary sidecar after parsing the text model (see also
+                     convert_model)
+            data: [scales, speeds, checksum] of a loaded model to use instead of the file
+            verify: check the data of a binary model against the checksum of its header,
+                    which reads the whole file
+        """
         if filepath is None:
             self._filepath = "./_input/MOD_H13"
         else:
             self._filepath = filepath
         self._scales = []
-        self._geo_speeds = []
-        self._read_model()
+        self._axes = []
+        self._speeds = None
+        self._dtype = dtype
+        self._checksum = None
+        self._info = {}
+        self._lookups = []
+        time_start = time.time()
+        filepath_binary = get_binary_path(self._filepath)
+        if data is not None:
+            self._scales = data[0]
+            self._axes = [np.array(scale) for scale in self._scales]
+            self._speeds = data[1]
+            self._checksum = data[2]
+            self._info['format'] = 'shared'
+        elif _is_binary_model(self._filepath):
+            loaded = self._read_binary(self._filepath, verify)
+            assert loaded, 'Error in binary model %s' % self._filepath
+        elif (os.path.isfile(filepath_binary)
+              and os.path.getmtime(filepath_binary) >= os.path.getmtime(self._filepath)
+              and _is_binary_model(filepath_binary)
+              and self._read_binary(filepath_binary, verify)):
+            pass
+        else:
+            self._read_model()
+            self._info['format'] = 'text'
+            if convert:
+                try:
+                    self.write_binary(filepath_binary)
+                except OSError:
+                    print("Cannot write binary model %s" % filepath_binary)
+        self.set_lookup('auto')
+        self._info['load_time'] = time.time() - time_start
 
     def _read_scales(self, nums_line, lons_line, lats_line, deps_line):
         nums = [float(elem) for elem in nums_line.split()]
@@ -146,6 +314,7 @@ class GeoModel(object):
             print("Dimension error in reading depth index")
         else:
             self._scales.append(deps)
+        self._axes = [np.array(scale) for scale in self._scales]
 
     def _read_model(self):
         with open(self._filepath, 'r') as file_model:
@@ -154,6 +323,7 @@ class GeoModel(object):
                               , file_model.readline()
                               , file_model.readline())
 
+            self._speeds = np.zeros([len(scale) for scale in self._scales], dtype=self._dtype)
             for dep_idx in range(len(self._scales[2])):
                 for lat_idx in range(len(self._scales[1])):
                     velocities_line = file_model.readline()
@@ -163,17 +333,111 @@ class GeoModel(object):
                         print("Dimension error in reading velocity(longitude)")
                         break
                     else:
-                        for lon_idx in range(len(self._scales[0])):
-                            if len(self._geo_speeds) < (lon_idx + 1):
-                                self._geo_speeds.append([])
-                            if len(self._geo_speeds[lon_idx]) < (lat_idx + 1):
-                                self._geo_speeds[lon_idx].append([])
-                            if len(self._geo_speeds[lon_idx][lat_idx]) < (dep_idx + 1):
-                                geo_speed = GeoSpeed(self._scales[0][lon_idx]
-                                                     , self._scales[1][lat_idx]
-                                                     , self._scales[2][dep_idx]
-                                                     , velocities[lon_idx])
-                                self._geo_speeds[lon_idx][lat_idx].append(geo_speed)
+                        self._speeds[:, lat_idx, dep_idx] = velocities
+
+    def _read_binary(self, filepath, verify=False):
+        """ Memory map a binary model
+        The file size has to match the dims of the header, and when verify is True the
+        data the checksum of the header, or the model is left unloaded.
+        Args:
+            filepath: path of the binary model
+            verify: check the checksum
+        Returns:
+            loaded: True if the model is loaded
+        Raises:
+            Native exceptions.
+        """
+        with open(filepath, 'rb') as file_model:
+            header = _BINARY_HEADER.unpack(file_model.read(_BINARY_HEADER.size))
+        dims = list(header[1:4])
+        size = _BINARY_HEADER_SIZE + 8 * (sum(dims) + int(np.prod(dims)))
+        if os.path.getsize(filepath) != size:
+            print("Size error in binary model %s" % filepath)
+            return False
+        if verify and _hash_binary(filepath).digest() != header[4]:
+            print("Checksum error in binary model %s" % filepath)
+            return False
+        axes = np.memmap(filepath, dtype='<f8', mode='r', offset=_BINARY_HEADER_SIZE
+                         , shape=(sum(dims),))
+        self._scales = [axes[:dims[0]].tolist(), axes[dims[0]:dims[0]+dims[1]].tolist()
+                        , axes[dims[0]+dims[1]:].tolist()]
+        self._axes = [np.array(scale) for scale in self._scales]
+        self._speeds = np.memmap(filepath, dtype='<f8', mode='r'
+                                 , offset=_BINARY_HEADER_SIZE + 8 * sum(dims), shape=tuple(dims))
+        if np.dtype(self._dtype) != self._speeds.dtype:
+            self._speeds = self._speeds.astype(self._dtype)
+        self._checksum = header[4].hex()
+        self._info['format'] = 'binary'
+        return True
+
+    def _hash_data(self):
+        sha = hashlib.sha256()
+        for axis in self._axes:
+            sha.update(axis.astype('<f8').tobytes())
+        sha.update(np.ascontiguousarray(self._speeds, dtype='<f8').tobytes())
+        return sha
+
+    def write_binary(self, filepath):
+        """ Write the model in the binary format
+        The file is written aside, checked against its checksum and then renamed, so readers
+        never see a partial model.
+        Args:
+            filepath: path of the binary model
+        Returns:
+            written: True if the model is written
+        Raises:
+            Native exceptions.
+        """
+        sha = self._hash_data()
+        header = _BINARY_HEADER.pack(_BINARY_MAGIC, *self._speeds.shape, sha.digest())
+        filepath_tmp = '%s.%d.tmp' % (filepath, os.getpid())
+        with open(filepath_tmp, 'wb') as file_model:
+            file_model.write(header.ljust(_BINARY_HEADER_SIZE, b'\0'))
+            for axis in self._axes:
+                file_model.write(axis.astype('<f8').tobytes())
+            file_model.write(np.ascontiguousarray(self._speeds, dtype='<f8').tobytes())
+        if _hash_binary(filepath_tmp).digest() != sha.digest():
+            print("Checksum error in written binary model %s" % filepath)
+            os.remove(filepath_tmp)
+            return False
+        os.replace(filepath_tmp, filepath)
+        self._checksum = sha.hexdigest()
+        return True
+
+    def get_checksum(self):
+        """ Return the checksum of the model data
+        Args:
+        Returns:
+            checksum: sha256 hex digest of the axes and velocities
+        Raises:
+            Native exceptions.
+        """
+        if self._checksum is None:
+            self._checksum = self._hash_data().hexdigest()
+        return self._checksum
+
+    def set_lookup(self, lookup):
+        """ Select how the cells of batch locations are found
+        Args:
+            lookup: 'auto' (strategy detected per axis) or 'bisect'
+        Returns:
+        Raises:
+            Native exceptions.
+        """
+        if lookup not in ('auto', 'bisect'):
+            print("Unknown lookup %s" % lookup)
+            return
+        self._lookups = [_AxisLookup(scale, lookup) for scale in self._scales]
+
+    def get_lookup_strategy(self):
+        """ Return the cell lookup strategy of each axis
+        Args:
+        Returns:
+            strategies: [lon, lat, dep] strategy, 'uniform', 'piecewise', 'table' or 'bisect'
+        Raises:
+            Native exceptions.
+        """
+        return [lookup.get_strategy() for lookup in self._lookups]
 
     def _nearest_idx(self, loc):
         #這個真是正確的解嗎？
@@ -214,18 +478,343 @@ class GeoModel(object):
             else:
                 diff_dep = abs(loc[2] - self._scales[2][near_idx[2]+1])
             velocity = (velocity
-                        + (self._geo_speeds
-                           [near_idx[0]+inc[0]][near_idx[1]+inc[1]][near_idx[2]+inc[2]]
-                           .get_speed())
+                        + float(self._speeds
+                                [near_idx[0]+inc[0], near_idx[1]+inc[1], near_idx[2]+inc[2]])
                         * diff_lon * diff_lat * diff_dep
                         / (dist_lon * dist_lat * dist_dep))
 
         return velocity
 
+    def get_speeds(self, locs):
+        """ Return the speeds of an array of locations
+        Same interpolation as get_speed, with the same numerical results
+        Args:
+            locs: array of locations, shape (n, 3)
+        Returns:
+            velocities: array of speeds
+        Raises:
+            Native exceptions.
+        """
+        locs = np.asarray(locs, dtype=np.float64).reshape(-1, 3)
+        near_idx = [self._lookups[axis].get_idxs(locs[:, axis]) for axis in range(3)]
+        dists = [self._axes[axis][near_idx[axis]+1] - self._axes[axis][near_idx[axis]]
+                 for axis in range(3)]
+        diffs = [[np.abs(locs[:, axis] - self._axes[axis][near_idx[axis]+1])
+                  , np.abs(self._axes[axis][near_idx[axis]] - locs[:, axis])] for axis in range(3)]
+        velocities = np.zeros(len(locs))
+        incs = [[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1], [1, 1, 0],
+                [1, 0, 1], [0, 1, 1], [1, 1, 1]]
+        for inc in incs:
+            velocities = (velocities
+                          + self._speeds[near_idx[0]+inc[0], near_idx[1]+inc[1], near_idx[2]+inc[2]]
+                          .astype(np.float64)
+                          * diffs[0][inc[0]] * diffs[1][inc[1]] * diffs[2][inc[2]]
+                          / (dists[0] * dists[1] * dists[2]))
+        return velocities
+
+    def get_max_speed(self):
+        """ Return the largest speed of the model nodes
+        The interpolated speeds inside the model are not above it.
+        Args:
+        Returns:
+            velocity: largest speed
+        Raises:
+            Native exceptions.
+        """
+        if 'max_speed' not in self._info:
+            self._info['max_speed'] = float(np.max(self._speeds))
+        return self._info['max_speed']
+
+    def get_geo_speed(self, lon_idx, lat_idx, dep_idx):
+        """ Return the model node as GeoSpeed
+        Args:
+            lon_idx, lat_idx, dep_idx: indexes of the node along each axis
+        Returns:
+            geo_speed: GeoSpeed of the node
+        Raises:
+            Native exceptions.
+        """
+        return GeoSpeed(self._scales[0][lon_idx], self._scales[1][lat_idx]
+                        , self._scales[2][dep_idx]
+                        , float(self._speeds[lon_idx, lat_idx, dep_idx]))
+
+    def get_info(self):
+        """ Return the size and loading time of the model
+        Args:
+        Returns:
+            info: dictionary of dims, dtype, nbytes (velocity and axes), format ('text',
+                  'binary' or 'shared') and load_time (sec)
+        Raises:
+            Native exceptions.
+        """
+        info = dict(self._info)
+        info['dims'] = list(self._speeds.shape)
+        info['dtype'] = str(self._speeds.dtype)
+        info['nbytes'] = self._speeds.nbytes + 8 * sum(len(scale) for scale in self._scales)
+        return info
+
+def get_binary_path(filepath):
+    """ Return the path of the binary sidecar of a text model
+    Args:
+        filepath: path of the text model
+    Returns:
+        path of the binary model
+    Raises:
+        Native exceptions.
+    """
+    return filepath + '.bin'
+
+def _is_binary_model(filepath):
+    with open(filepath, 'rb') as file_model:
+        return file_model.read(len(_BINARY_MAGIC)) == _BINARY_MAGIC
+
+def _hash_binary(filepath):
+    """ Return the checksum of the data of a binary model, read by chunks
+    Args:
+        filepath: path of the binary model
+    Returns:
+        sha: sha256 of the axes and velocities
+    Raises:
+        Native exceptions.
+    """
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as file_model:
+        file_model.seek(_BINARY_HEADER_SIZE)
+        for chunk in iter(lambda: file_model.read(_BINARY_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha
+
+def convert_model(filepath, filepath_binary=None):
+    """ Convert a text model into the binary format
+    Args:
+        filepath: path of the text model
+        filepath_binary: path of the binary model, the sidecar path if None
+    Returns:
+        filepath_binary: path of the binary model, None if not written
+    Raises:
+        Native exceptions.
+    """
+    if filepath_binary is None:
+        filepath_binary = get_binary_path(filepath)
+    if not GeoModel(filepath, convert=False).write_binary(filepath_binary):
+        return None
+    return filepath_binary
+
+def _get_model_key(filepath):
+    if filepath is None:
+        filepath = "./_input/MOD_H13"
+    return (os.path.abspath(filepath), os.path.getmtime(filepath))
+
+def get_shared_model(filepath=None):
+    """ Return the process-wide read-only model of a file
+    The model is loaded once per path and modification time, later calls (from every
+    GraphBuilder of the process) get the same instance.
+    Args:
+        filepath: path of the model, the default model if None
+    Returns:
+        geo_model: shared GeoModel
+    Raises:
+        Native exceptions.
+    """
+    key = _get_model_key(filepath)
+    if key not in _MODEL_CACHE:
+        for key_old in [elem for elem in _MODEL_CACHE if elem[0] == key[0]]:
+            del _MODEL_CACHE[key_old]
+        geo_model = GeoModel(key[0])
+        geo_model._speeds.setflags(write=False)
+        _MODEL_CACHE[key] = geo_model
+    return _MODEL_CACHE[key]
+
+def _release_shared_memory():
+    for name, (shm, key) in list(_SHARED_MEMORY.items()):
+        shm.close()
+        if key is not None:
+            shm.unlink()
+        del _SHARED_MEMORY[name]
+
+atexit.register(_release_shared_memory)
+
+def publish_shared_model(filepath=None):
+    """ Publish the shared model of a file through shared memory
+    The velocities are copied once into a shared memory block that worker processes map
+    with attach_shared_model(), so N workers do not hold N copies. The block lives until
+    the publishing process exits.
+    Args:
+        filepath: path of the model, the default model if None
+    Returns:
+        handle: picklable description of the block to give to the workers
+    Raises:
+        Native exceptions.
+    """
+    key = _get_model_key(filepath)
+    geo_model = get_shared_model(filepath)
+    for shm, key_shm in _SHARED_MEMORY.values():
+        if key_shm == key:
+            break
+    else:
+        shm = shared_memory.SharedMemory(create=True, size=max(geo_model._speeds.nbytes, 1))
+        np.ndarray(geo_model._speeds.shape, dtype=geo_model._speeds.dtype
+                   , buffer=shm.buf)[...] = geo_model._speeds
+        _SHARED_MEMORY[shm.name] = (shm, key)
+    return {'name':shm.name, 'key':key, 'scales':geo_model._scales
+            , 'shape':geo_model._speeds.shape, 'dtype':str(geo_model._speeds.dtype)
+            , 'checksum':geo_model.get_checksum()}
+
+def attach_shared_model(handle):
+    """ Register a published model as the shared model of the current process
+    Args:
+        handle: description returned by publish_shared_model()
+    Returns:
+        geo_model: shared GeoModel backed by the shared memory block
+    Raises:
+        Native exceptions.
+    """
+    key = tuple(handle['key'])
+    if key not in _MODEL_CACHE:
+        if handle['name'] in _SHARED_MEMORY:
+            shm = _SHARED_MEMORY[handle['name']][0]
+        else:
+            shm = shared_memory.SharedMemory(name=handle['name'])
+            _SHARED_MEMORY[shm.name] = (shm, None)
+        speeds = np.ndarray(handle['shape'], dtype=handle['dtype'], buffer=shm.buf)
+        speeds.setflags(write=False)
+        _MODEL_CACHE[key] = GeoModel(key[0], data=[handle['scales'], speeds, handle['checksum']])
+    return _MODEL_CACHE[key]
+
+def _test_mod_write_model(filepath, scales, speed):
+    with open(filepath, 'w') as file_model:
+        file_model.write('0 0 %d %d %d\n' % tuple(len(scale) for scale in scales))
+        for scale in scales:
+            file_model.write('%s\n' % ' '.join(str(elem) for elem in scale))
+        for dep in scales[2]:
+            for lat in scales[1]:
+                file_model.write('%s\n' % ' '.join(str(speed(lon, lat, dep))
+                                                   for lon in scales[0]))
+
+
+class GeoModelTest(unittest.TestCase):
+    """ Test with velocity lookup of the model
+    """
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._filepath = os.path.join(self._dir.name, 'MOD_TEST')
+        self._scales = [[119.0, 120.0, 120.5, 121.0, 121.25, 122.0], [21.0, 22.5, 23.0, 24.0, 26.0]
+                        , [-10.0, 0.0, 2.0, 6.0, 13.0, 30.0, 70.0]]
+        _test_mod_write_model(self._filepath, self._scales
+                              , lambda lon, lat, dep: round(3 + (lon - 119) * 0.3
+                                                            + (lat - 21) * 0.11 + dep * 0.04, 2))
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_mod_with_node_speed(self):
+        """ Test if speeds on the model nodes are the node velocities
+        """
+        geo_model = GeoModel(self._filepath)
+        geo_speed = geo_model.get_geo_speed(2, 3, 4)
+        self.assertEqual([geo_speed.get_lon(), geo_speed.get_lat(), geo_speed.get_dep()]
+                         , [120.5, 24.0, 13.0])
+        self.assertAlmostEqual(geo_model.get_speed([120.5, 24.0, 13.0]), geo_speed.get_speed())
+        self.assertEqual(geo_model.get_info()['dims'], [6, 5, 7])
+
+    def test_mod_with_binary_model(self):
+        """ Test if the binary sidecar is written, preferred and gives the same speeds
+        """
+        geo_text = GeoModel(self._filepath)
+        self.assertEqual(geo_text.get_info()['format'], 'text')
+        self.assertFalse(os.path.isfile(get_binary_path(self._filepath)))
+        GeoModel(self._filepath, convert=True)
+        self.assertTrue(os.path.isfile(get_binary_path(self._filepath)))
+        geo_binary = GeoModel(self._filepath)
+        self.assertEqual(geo_binary.get_info()['format'], 'binary')
+        self.assertEqual(geo_binary.get_checksum(), geo_text.get_checksum())
+        locs = [[120.123, 22.77, 0.5], [121.1, 24.001, 29.9], [119.7, 21.3, 13.0]]
+        self.assertEqual([geo_binary.get_speed(loc) for loc in locs]
+                         , [geo_text.get_speed(loc) for loc in locs])
+        self.assertEqual(GeoModel(get_binary_path(self._filepath)).get_info()['format'], 'binary')
+        os.utime(self._filepath, (time.time() + 10, time.time() + 10))
+        self.assertEqual(GeoModel(self._filepath).get_info()['format'], 'text')
+
+    def test_mod_with_corrupt_binary(self):
+        """ Test if a truncated sidecar, or an altered one when verified, is not used and a bad
+        binary model rejected
+        """
+        filepath_binary = convert_model(self._filepath)
+        with open(filepath_binary, 'rb') as file_model:
+            data = file_model.read()
+        for data_bad, verify in [[data[:-8], False], [data[:-1] + bytes([data[-1] ^ 1]), True]]:
+            with open(filepath_binary, 'wb') as file_model:
+                file_model.write(data_bad)
+            geo_model = GeoModel(self._filepath, verify=verify)
+            self.assertEqual(geo_model.get_info()['format'], 'text')
+            self.assertEqual(geo_model.get_speed([120.5, 24.0, 13.0])
+                             , GeoModel(self._filepath, verify=verify).get_speed(
+                                 [120.5, 24.0, 13.0]))
+            with self.assertRaises(AssertionError):
+                GeoModel(filepath_binary, verify=verify)
+        self.assertEqual(GeoModel(self._filepath).get_info()['format'], 'binary')
+
+    def test_mod_with_shared_model(self):
+        """ Test if the shared model is loaded once and can be attached through shared memory
+        """
+        geo_model = get_shared_model(self._filepath)
+        self.assertTrue(get_shared_model(self._filepath) is geo_model)
+        handle = publish_shared_model(self._filepath)
+        del _MODEL_CACHE[tuple(handle['key'])]
+        geo_attached = attach_shared_model(handle)
+        self.assertEqual(geo_attached.get_info()['format'], 'shared')
+        self.assertTrue(get_shared_model(self._filepath) is geo_attached)
+        locs = [[120.123, 22.77, 0.5], [121.1, 24.001, 29.9]]
+        self.assertEqual(geo_attached.get_speeds(locs).tolist()
+                         , geo_model.get_speeds(locs).tolist())
+        os.utime(self._filepath, (time.time() + 10, time.time() + 10))
+        self.assertFalse(get_shared_model(self._filepath) is geo_attached)
+
+    def test_mod_with_cell_lookup(self):
+        """ Test if the cell lookup strategies find the bisect cells, and compare their time
+        """
+        scales = [[118.0 + 0.25 * idx for idx in range(9)] + [120.625]
+                  + [120.75 + 0.125 * idx for idx in range(18)] + [123.0, 124.0, 124.5]
+                  , [20.0 + 0.5 * idx for idx in range(15)]
+                  , [-10.0, 0.0, 2.0, 4.0, 6.0, 9.0, 13.0, 17.0, 21.0, 25.0, 30.0, 35.0, 50.0
+                     , 70.0, 90.0, 110.0, 200.0]]
+        _test_mod_write_model(self._filepath, scales, lambda lon, lat, dep: 3 + dep * 0.01)
+        geo_model = GeoModel(self._filepath)
+        self.assertEqual(geo_model.get_lookup_strategy(), ['piecewise', 'uniform', 'table'])
+        geo_bisect = GeoModel(self._filepath)
+        geo_bisect.set_lookup('bisect')
+        self.assertEqual(geo_bisect.get_lookup_strategy(), ['bisect'] * 3)
+        for axis, scale in enumerate(scales):
+            vals = np.concatenate([np.linspace(scale[0] - 1, scale[-1] + 1, 10007), scale
+                                   , np.nextafter(scale, -np.inf), np.nextafter(scale, np.inf)])
+            self.assertEqual(geo_model._lookups[axis].get_idxs(vals).tolist()
+                             , [bisect.bisect_right(scale, val) - 1 for val in vals])
+
+        rand = np.random.RandomState(0)
+        locs = np.column_stack([rand.uniform(scale[0], scale[-1], 1000000) for scale in scales])
+        for geo in [geo_bisect, geo_model]:
+            time_start = time.time()
+            for axis in range(3):
+                geo._lookups[axis].get_idxs(locs[:, axis])
+            print('Lookup %s: %f sec' % (geo.get_lookup_strategy(), time.time() - time_start))
+        self.assertEqual(geo_model.get_speeds(locs[:1000]).tolist()
+                         , geo_bisect.get_speeds(locs[:1000]).tolist())
+
+    def test_mod_with_batch_speed(self):
+        """ Test if batch speeds are the same as get_speed
+        """
+        geo_model = GeoModel(self._filepath)
+        locs = [[119.0, 21.0, -10.0], [121.99, 25.99, 69.9], [120.5, 23.0, 2.0]
+                , [120.123, 22.77, 0.5], [121.1, 24.001, 29.9], [119.7, 21.3, 13.0]]
+        self.assertEqual(geo_model.get_speeds(locs).tolist()
+                         , [geo_model.get_speed(loc) for loc in locs])
+
+
 def main():
     """ unit test
     """
     geo_model = GeoModel()
+    print("The model info is ", geo_model.get_info())
     loc = [122.04, 23.46, 20]
     print("The location is ", loc, ", and the velocity is 6.45")
     print("The computed velocity is ", geo_model.get_speed(loc))
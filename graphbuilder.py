@@ -3,11 +3,34 @@
 """ The stuffs related to building graph.
 """
 import unittest
+import hashlib
 import json
+import math
+import multiprocessing
+import os
+import tempfile
+import time
+import numpy as np
 import normgrid
 import geomodel
+import slownessgrid
+import graphsearch
 import my_util
 
+# Edge length of the tiles of vertexes whose slowness and coordinates are computed at once
+_TILE_SIZE = 8
+# Number of vertexes from which the edges are created at once by build_graph, in whole
+# depth slabs
+_SLAB_SIZE = 1 << 14
+# Number of jobs of depth slabs given to each worker process by build_graph_arrays
+_JOBS_PER_WORKER = 4
+# GraphBuilder of the current worker process of build_graph_arrays
+_SLAB_BUILDER = {}
+# Increments and offsets of the stencils, by stencil name, stage, num_lon and num_lat
+_STENCILS = {}
+# Relative margin of the A* bounds, above the rounding of the edge lengths of DistanceTable
+_HEURISTIC_MARGIN = 1e-4
+
 class Edge(object):
     """ Edge unit of the graph
     """
@@ -66,6 +89,109 @@ class Edge(object):
         return [self._idx_vertex1, self._idx_vertex2, self._weight]
 
 
+def _is_in_boundary_array(bnd, idx_locs, num_lon, num_lat):
+    """ Vectorized _is_in_boundary for the boundary of a cubic
+    Args:
+        bnd: boundary indexes of the cubic
+        idx_locs: array of indexes
+        num_lon: number of longitude indexes
+        num_lat: number of latitude indexes
+    Returns:
+        array of bool
+    Raises:
+        Native exceptions.
+    """
+    idx_plane = idx_locs % (num_lon * num_lat)
+    idx_row = idx_plane % num_lon
+    return ((idx_locs >= bnd['idx_loc_min']) & (idx_locs <= bnd['idx_loc_max'])
+            & (idx_plane >= bnd['idx_loc_min'] % (num_lon * num_lat))
+            & (idx_plane <= bnd['idx_loc_lonlatmax'] % (num_lon * num_lat))
+            & (idx_row >= bnd['idx_loc_min'] % num_lon)
+            & (idx_row <= bnd['idx_loc_lonmax'] % num_lon))
+
+def _is_in_cubic_array(cubic, idx_locs, num_lon, num_lat):
+    coors = [idx_locs % num_lon, idx_locs // num_lon % num_lat, idx_locs // (num_lon * num_lat)]
+    inside = np.ones(np.shape(idx_locs), dtype=bool)
+    for axis in range(3):
+        inside = inside & ((coors[axis] >= cubic['cubic_lower'][axis])
+                           & (coors[axis] <= cubic['cubic_upper'][axis]))
+    return inside
+
+def _is_created_array(cubic, offset, idx_src, idx_dst, num_lon, num_lat):
+    created = np.zeros(np.shape(idx_src), dtype=bool)
+    if offset[0]:
+        created |= (_is_in_cubic_array(cubic, idx_src, num_lon, num_lat)
+                    & _is_in_boundary_array(cubic['bnd'], idx_dst, num_lon, num_lat))
+    if offset[1]:
+        created |= (_is_in_cubic_array(cubic, idx_dst, num_lon, num_lat)
+                    & _is_in_boundary_array(cubic['bnd'], idx_src, num_lon, num_lat))
+    return created
+
+
+def get_stencil_steps(name, stage):
+    """ Return the grid steps of a named stencil
+    The stencils only go down or stay at the same depth, the edges being undirected.
+        'forward': the 3x3x2 star of stage 1 and the 5x5x3 star of stage 2
+        '6', '18' and '26': the face, face and edge, and face, edge and corner neighbours
+        'radius<N>': the steps of at most N grid points along each axis, but the multiples
+                     of a shorter step in the same direction
+    Args:
+        name: name of the stencil
+        stage: designated stage
+    Returns:
+        steps: list of [diff_lon, diff_lat, diff_dep], None for an unknown name
+    Raises:
+        Native exceptions.
+    """
+    if name == 'forward':
+        reach = {1:1, 2:2}.get(stage)
+    elif name in ['6', '18', '26']:
+        reach = 1
+    elif name.startswith('radius') and name[len('radius'):].isdigit():
+        reach = int(name[len('radius'):])
+    else:
+        reach = None
+    if not reach:
+        print("Unknown stencil %s" % name)
+        return None
+    norm_max = {'6':1, '18':2}.get(name, 3*reach)
+    steps = []
+    for diff_dep in range(0, reach+1):
+        for diff_lat in range(-reach, reach+1):
+            for diff_lon in range(-reach, reach+1):
+                diffs = [abs(diff_lon), abs(diff_lat), diff_dep]
+                if sum(diffs) == 0 or sum(diffs) > norm_max:
+                    continue
+                if (name.startswith('radius')
+                        and math.gcd(math.gcd(diffs[0], diffs[1]), diffs[2]) > 1):
+                    continue
+                steps.append([diff_lon, diff_lat, diff_dep])
+    return steps
+
+def _split_incs(incs, num_lon, num_lat):
+    """ Split the positive increments into lon, lat and dep grid steps
+    Args:
+        incs: increments
+        num_lon: number of longitude indexes
+        num_lat: number of latitude indexes
+    Returns:
+        offsets: list of [forward, backward, [diff_lon, diff_lat, diff_dep]] for each
+                 positive increment, where forward and backward tell if the increment
+                 and its opposite are in the increments
+    Raises:
+        Native exceptions.
+    """
+    incs = set(incs)
+    offsets = []
+    for inc in sorted(set(abs(elem) for elem in incs)):
+        diff_dep = (inc + num_lon * num_lat // 2) // (num_lon * num_lat)
+        diff_lat = (inc - diff_dep * num_lon * num_lat + num_lon // 2) // num_lon
+        offsets.append([inc in incs, -inc in incs
+                        , [inc - diff_dep * num_lon * num_lat - diff_lat * num_lon
+                           , diff_lat, diff_dep]])
+    return offsets
+
+
 class GraphBuilder(object):
     """ Build the edge of the graph
     """
@@ -74,14 +200,32 @@ class GraphBuilder(object):
             self._extra_range = [0.02, 0.02, 20]
             self._ranges = [0.05, 0.05, 2]
             path_model = None
+            rounding = None
+            self._slowness_region = None
+            self._path_slowness = None
         else:
             self._extra_range = settings['extra_range']
             self._ranges = settings['ranges']
             path_model = settings['path_model']
+            rounding = settings.get('norm_rounding')
+            self._slowness_region = settings.get('slowness_region')
+            self._path_slowness = settings.get('path_slowness')
+        self._settings = settings
+        self._num_workers = 1 if settings is None else settings.get('num_workers', 1)
+        self._pool = None
+        self._stencils = (['forward', 'forward'] if settings is None
+                          else settings.get('stencils', ['forward', 'forward']))
         self._norm = normgrid.NormGrid()
-        self._geo = geomodel.GeoModel(path_model)
+        # the NormGrid is shared by the process, so it is only switched when asked for
+        if rounding is not None:
+            self._norm.set_rounding(rounding)
+        self._geo = geomodel.get_shared_model(path_model)
         self._bnd = {}
         self._incs = []
+        self._stencil_key = None
+        self._distance_table = None
+        self._slowness_grids = {}
+        self._mask_info = {}
 
     def _set_boundary(self, sta_loc, sou_loc, stage):
         loc_min = []
@@ -124,66 +268,32 @@ class GraphBuilder(object):
 
         return True
 
-    def _create_edge(self, edges, idx, setting):
-        """ Create edge for each vertex
-        Add inc to create edge in different directions
-        then check if the connected vertex exists or the edge is repeated
-        Args:
-            edges: edge list to add
-            idx: index of the current vertex
-        Returns:
-        Raises:
-            Native exceptions.
-        """
-        for inc in self._incs:
-            if self._is_in_boundary(idx + inc, setting['num_lon'], setting['num_lat']):
-                loc = self._norm.recover_norm_loc(idx, setting['stage'])
-                loc_adj = self._norm.recover_norm_loc(idx+inc, setting['stage'])
-                dist = (my_util.get_distance_in_earth(loc, loc_adj, setting['shiftlo']
-                                                      , 6374.7524414062500))
-                edge = Edge(idx, idx+inc, dist*(1/self._geo.get_speed(loc)
-                                                +1/self._geo.get_speed(loc_adj))
-                            *0.5)
-                edge_reverse = Edge(idx+inc, idx
-                                    , dist*(1/self._geo.get_speed(loc)
-                                            +1/self._geo.get_speed(loc_adj))
-                                    *0.5)
-                if edge in edges or edge_reverse in edges:
-                    continue
-                edges.add(edge)
+    def _get_slownesses(self, idx_locs, locs, stage):
+        slowness_grid = self._get_slowness_grid(stage)
+        if slowness_grid is None:
+            return 1 / self._geo.get_speeds(locs)
+        slowness = slowness_grid.get_slownesses(idx_locs)
+        outside = np.isnan(slowness)
+        if outside.any():
+            slowness[outside] = 1 / self._geo.get_speeds(locs[outside])
+        return slowness
 
-    def _divide_and_create(self, edges, stage, setting):
-        """ Divide cubic into vertex and create edge
-        Designate cubic's lon, lat, dep to divide into vertex, then create edge by each vertex
-        Args:
-            edges: edge list to add
-            stage: designated stage
-            setting: formed by variables
-        Returns:
-        Raises:
-            Native exceptions.
-        """
-        shiftlo = my_util.get_shiftlo(self._norm.get_norm_loc(setting['loc_upper'], stage)
-                                      , self._norm.get_norm_loc(setting['loc_lower'], stage))
-        for diff_idx_dep in range(0, self._bnd['idx_loc_max']-self._bnd['idx_loc_lonlatmax']+1
-                                  , setting['num_lon']*setting['num_lat']):
-            for diff_idx_lat in range(0, (self._bnd['idx_loc_lonlatmax']
-                                          -self._bnd['idx_loc_lonmax']+1)
-                                      , setting['num_lon']):
-                for idx in range(self._bnd['idx_loc_min'] + diff_idx_lat + diff_idx_dep
-                                 , self._bnd['idx_loc_lonmax'] + 1 + diff_idx_lat + diff_idx_dep):
-                    self._create_edge(edges, idx
-                                      , {'shiftlo':shiftlo
-                                                   , 'stage':stage
-                                                             , 'num_lon':setting['num_lon']
-                                                                         , 'num_lat':\
-                                                                            setting['num_lat']}
-                                     )
+    def _get_slowness_grid(self, stage):
+        if self._slowness_region is None:
+            return None
+        if stage not in self._slowness_grids:
+            self._slowness_grids[stage] = slownessgrid.SlownessGrid(
+                self._geo, self._slowness_region[0], self._slowness_region[1], stage
+                , self._path_slowness)
+        return self._slowness_grids[stage]
 
     def _build_inc(self, num_lon, num_lat, stage):
         """ Create inc for desinate stage
         Stage 1 and Stage 2 with same code => cubics may be overlapping
         => Create inc in all the directions and then filter repeated ones in other function later
+        The grid steps are the ones of the stencil of the stage in setting 'stencils' (see
+        get_stencil_steps), and the increments and offsets are computed once for each
+        stencil, stage and grid.
         Args:
             num_lon: number of longitude indexes
             num_lat: number of latitude indexes
@@ -191,29 +301,66 @@ class GraphBuilder(object):
         Raises:
             Native exceptions.
         """
-        self._incs = []
+        self._stencil_key = (self._stencils[stage-1], stage, num_lon, num_lat)
+        if self._stencil_key not in _STENCILS:
+            steps = get_stencil_steps(self._stencils[stage-1], stage)
+            incs = [diff_lon+diff_lat*num_lon+diff_dep*num_lon*num_lat
+                    for diff_lon, diff_lat, diff_dep in ([] if steps is None else steps)]
+            _STENCILS[self._stencil_key] = {'incs':incs
+                                            , 'offsets':_split_incs(incs, num_lon, num_lat)}
+        self._incs = list(_STENCILS[self._stencil_key]['incs'])
+
+    def _get_cubics(self, sta_loc, sou_loc, stage, path):
+        assert isinstance(sta_loc, list) and isinstance(sou_loc, list) \
+                , 'Error in station or source location type'
+        assert sta_loc != sou_loc, 'Error in same station and source location'
+        assert stage == 1 or stage == 2, 'Error in stage selection in building graph initialization'
+
         if stage == 1:
-            for diff_dep in range(0, 2*num_lon*num_lat, num_lon*num_lat):
-                for diff_lat in range(-1*num_lon, 2*num_lon, num_lon):
-                    for diff_lon in range(-1, 2, 1):
-                        if diff_lon+diff_lat+diff_dep == 0:
-                            continue
-                        else:
-                            self._incs.append(diff_lon+diff_lat+diff_dep)
+            loc_bound_upper = [sta_loc]
+            loc_bound_lower = [sou_loc]
         elif stage == 2:
-            for diff_dep in range(0, 3*num_lon*num_lat, num_lon*num_lat):
-                for diff_lat in range(-2*num_lon, 3*num_lon, num_lon):
-                    for diff_lon in range(-2, 3, 1):
-                        if diff_lon+diff_lat+diff_dep == 0:
-                            continue
-                        else:
-                            self._incs.append(diff_lon+diff_lat+diff_dep)
+            assert path is not None, 'Error in empty stage 1 path'
+            loc_bound_upper = [[a-b/2 for a, b in zip(sublist, self._ranges)] for sublist in path]
+            loc_bound_lower = [[a+b/2 for a, b in zip(sublist, self._ranges)] for sublist in path]
+        return loc_bound_upper, loc_bound_lower
+
+    def get_graph_key(self, sta_loc, sou_loc, stage, path=None):
+        """ Return the key of the graph build_graph makes
+        The key is the digest of what the edges are made of: the boundary indexes of the
+        cubics, the stage, the increments, the rounding of the normalized grid and the
+        checksum of the velocity model, so the same graph has the same key whatever the
+        station and source it is built for.
+        Args:
+            sta_loc: location of station
+            sou_loc: location of source
+            stage: designated stage
+            path: stage 1 path, for stage 2
+        Returns:
+            key: hex digest naming the graph
+        Raises:
+            Native exceptions.
+        """
+        loc_bound_upper, loc_bound_lower = self._get_cubics(sta_loc, sou_loc, stage, path)
+        self._build_inc(self._norm.get_num_lon_index(stage), self._norm.get_num_lat_index(stage)
+                        , stage)
+        idx_bounds = []
+        for (loc_upper, loc_lower) in zip(loc_bound_upper, loc_bound_lower):
+            self._set_boundary(loc_upper, loc_lower, stage)
+            idx_bounds.append([self._bnd[key] for key in ['idx_loc_min', 'idx_loc_lonmax'
+                                                          , 'idx_loc_lonlatmax', 'idx_loc_max']])
+        sha = hashlib.sha256()
+        sha.update(('%d_%s_%s_' % (stage, self._norm.get_rounding(), self._geo.get_checksum()))
+                   .encode())
+        sha.update(np.array(self._incs, dtype='<i8').tobytes())
+        sha.update(np.array(idx_bounds, dtype='<i8').tobytes())
+        return sha.hexdigest()
 
     def build_graph(self, sta_loc, sou_loc, stage, path=None):
         """ Build the whole graph by edge list
         The graph consists of overlapping or connecting cubics.
         Each cubic is formed by loc_upper(uppermost coordiante) and loc_lower(lowermost coordiante)
-        Divide cubic furthrer into vertex and then create edge
+        The edges are the ones of build_graph_arrays, added in their order.
         Args:
             sta_loc: location of station
             sou_loc: location of source
@@ -224,30 +371,843 @@ class GraphBuilder(object):
             Native exceptions.
         """
         edges = set()
+        idx_src, idx_dst, weights = self.build_graph_arrays(sta_loc, sou_loc, stage, path)
+        for idx, idx_inc, weight in zip(idx_src.tolist(), idx_dst.tolist(), weights.tolist()):
+            edges.add(Edge(idx, idx_inc, weight))
+        return edges
+
+    def build_graph_arrays(self, sta_loc, sou_loc, stage, path=None):
+        """ Build the edges of build_graph by arrays
+        Divide the cubics into depth slabs of vertexes and then create the edges with their
+        weights. The slabs are shared among the worker processes of setting 'num_workers'
+        (1 by default, in this process), kept until close, and the edges come in the order of
+        the slabs, so they are the same for any number of workers.
+        Args:
+            sta_loc: location of station
+            sou_loc: location of source
+            stage: designated stage
+            path: stage 1 path, for stage 2
+        Returns:
+            idx_src, idx_dst: arrays of the indexes of the ends of the edges
+            weights: array of the weights of the edges
+        Raises:
+            Native exceptions.
+        """
         self._bnd = {}
-        assert isinstance(sta_loc, list) and isinstance(sou_loc, list) \
-                , 'Error in station or source location type'
-        assert sta_loc != sou_loc, 'Error in same station and source location'
-        assert stage == 1 or stage == 2, 'Error in stage selection in building graph initialization'
+        loc_bound_upper, loc_bound_lower = self._get_cubics(sta_loc, sou_loc, stage, path)
+        num_lon = self._norm.get_num_lon_index(stage)
+        num_lat = self._norm.get_num_lat_index(stage)
+        self._build_inc(num_lon, num_lat, stage)
+        cubics = []
+        for (loc_upper, loc_lower) in zip(loc_bound_upper, loc_bound_lower):
+            self._set_boundary(loc_upper, loc_lower, stage)
+            cubics.append(self._get_cubic(num_lon, num_lat))
+        self._distance_table = self._get_distance_table(cubics, stage)
+        setting = {'num_lon':num_lon, 'num_lat':num_lat, 'distance_table':self._distance_table}
+        if self._num_workers > 1:
+            # small enough slabs for each worker to get some jobs
+            num_vertex = sum(int(np.prod(np.array(cubic['cubic_upper'])
+                                         - np.array(cubic['cubic_lower']) + 1))
+                             for cubic in cubics)
+            setting['slab_size'] = min(max(num_vertex // (self._num_workers * _JOBS_PER_WORKER)
+                                           , 1), _SLAB_SIZE)
+        slab_edges = SlabEdges(cubics, self._incs, self._get_offsets(num_lon, num_lat), setting)
+        tasks = slab_edges.get_tasks()
+        if self._num_workers > 1 and len(tasks) > 1:
+            num_job = min(self._num_workers * _JOBS_PER_WORKER, len(tasks))
+            jobs = [[slab_edges, stage, self._norm.get_rounding()
+                     , tasks[num * len(tasks) // num_job:(num + 1) * len(tasks) // num_job]]
+                    for num in range(num_job)]
+            slabs = list(self._get_pool().imap(_get_slab_weights, jobs))
+        else:
+            slabs = [self.get_slab_weights(slab_edges, stage, tasks)]
+        return tuple(np.concatenate([slab[col] for slab in slabs]) for col in range(3))
 
-        if stage == 1:
-            loc_bound_upper = [sta_loc]
-            loc_bound_lower = [sou_loc]
-        elif stage == 2:
-            assert path is not None, 'Error in empty stage 1 path'
-            loc_bound_upper = [[a-b/2 for a, b in zip(sublist, self._ranges)] for sublist in path]
-            loc_bound_lower = [[a+b/2 for a, b in zip(sublist, self._ranges)] for sublist in path]
+    def get_slab_weights(self, slab_edges, stage, tasks):
+        """ Return the edges created from some depth slabs with their weights
+        Args:
+            slab_edges: SlabEdges
+            stage: designated stage
+            tasks: list of the tasks of SlabEdges.get_tasks
+        Returns:
+            idx_src, idx_dst: arrays of the indexes of the ends of the edges
+            weights: array of the weights of the edges
+        Raises:
+            Native exceptions.
+        """
+        slabs = [slab_edges.get_edges(task) for task in tasks]
+        idx_src = np.concatenate([slab[0] for slab in slabs] + [np.zeros(0, dtype=np.int64)])
+        idx_dst = np.concatenate([slab[1] for slab in slabs] + [np.zeros(0, dtype=np.int64)])
+        dists = np.concatenate([slab[2] for slab in slabs] + [np.zeros(0)])
+        if not len(dists):
+            return idx_src, idx_dst, dists
+        idx_locs, idx_ends = np.unique(np.concatenate([idx_src, idx_dst]), return_inverse=True)
+        slowness = self._get_slownesses(idx_locs, self._norm.recover_norm_locs(idx_locs, stage)
+                                        , stage)[idx_ends]
+        return idx_src, idx_dst, dists*(slowness[:len(dists)]+slowness[len(dists):])*0.5
+
+    def _get_pool(self):
+        """ Return the worker processes of build_graph_arrays, started at the first call
+        Args:
+        Returns:
+            pool: multiprocessing.Pool
+        Raises:
+            Native exceptions.
+        """
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self._num_workers, _init_slab_worker
+                                              , (self._settings,))
+        return self._pool
+
+    def close(self):
+        """ Stop the worker processes of build_graph_arrays, if started
+        Args:
+        Returns:
+        Raises:
+            Native exceptions.
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def _get_offsets(self, num_lon, num_lat):
+        """ Return the positive increments split into lon, lat and dep grid steps
+        Args:
+            num_lon: number of longitude indexes
+            num_lat: number of latitude indexes
+        Returns:
+            offsets: see _split_incs, for the increments of the last _build_inc
+        Raises:
+            Native exceptions.
+        """
+        if self._stencil_key is None or self._stencil_key[2:] != (num_lon, num_lat):
+            return _split_incs(self._incs, num_lon, num_lat)
+        return _STENCILS[self._stencil_key]['offsets']
+
+    def _get_cubic(self, num_lon, num_lat):
+        """ Describe the current cubic
+        The cubic holds the vertexes iterated by build_graph, and an edge is created
+        from them to the vertexes passing _is_in_boundary. Both sets are the same box, except
+        when the normalized indexes of the boundary are truncated one grid point lower.
+        Args:
+            num_lon: number of longitude indexes
+            num_lat: number of latitude indexes
+        Returns:
+            cubic: dictionary of the boundary (bnd) and the lowermost and uppermost lon, lat
+                   and dep indexes of the cubic box
+        Raises:
+            Native exceptions.
+        """
+        bnd = dict(self._bnd)
+        num_plane = num_lon * num_lat
+        cubic_lower = [bnd['idx_loc_min'] % num_lon, bnd['idx_loc_min'] // num_lon % num_lat
+                       , bnd['idx_loc_min'] // num_plane]
+        cubic_shape = [max(bnd['idx_loc_lonmax'] - bnd['idx_loc_min'] + 1, 0)
+                       , len(range(0, bnd['idx_loc_lonlatmax'] - bnd['idx_loc_lonmax'] + 1, num_lon))
+                       , len(range(0, bnd['idx_loc_max'] - bnd['idx_loc_lonlatmax'] + 1, num_plane))]
+        return {'bnd':bnd, 'cubic_lower':cubic_lower
+                , 'cubic_upper':[lower + num - 1 for lower, num in zip(cubic_lower, cubic_shape)]}
+
+    def _get_cubic_grid(self, num_lon, num_lat, reach):
+        """ Describe the vertexes of the current cubic on a lon x lat x dep grid
+        The grid covers the reach of the increments around the cubic box, and shrinks to
+        the box when _is_in_boundary agrees with it (see _get_cubic).
+        Args:
+            num_lon: number of longitude indexes
+            num_lat: number of latitude indexes
+            reach: largest increment along an axis, in grid points
+        Returns:
+            cubic: dictionary of the boundary, the cubic box and the grid
+        Raises:
+            Native exceptions.
+        """
+        cubic = self._get_cubic(num_lon, num_lat)
+        bnd = cubic['bnd']
+        num_plane = num_lon * num_lat
+        cubic_lower = cubic['cubic_lower']
+        cubic_shape = [upper - lower + 1 for lower, upper in zip(cubic_lower, cubic['cubic_upper'])]
+        lower = [elem - reach for elem in cubic_lower]
+        shape = [num + 2 * reach for num in cubic_shape]
+        idx_locs = ((lower[2] + np.arange(shape[2]))[:, None, None] * num_plane
+                    + (lower[1] + np.arange(shape[1]))[None, :, None] * num_lon
+                    + (lower[0] + np.arange(shape[0]))[None, None, :])
+        in_cubic = _is_in_cubic_array(cubic, idx_locs, num_lon, num_lat)
+        in_bound = _is_in_boundary_array(bnd, idx_locs, num_lon, num_lat)
+        regular = bool((in_bound == in_cubic).all())
+        if regular:
+            # the grid is the cubic itself
+            inner = tuple(slice(reach, reach + num) for num in cubic_shape[::-1])
+            lower = cubic_lower
+            shape = cubic_shape
+            idx_locs = idx_locs[inner]
+            in_cubic = in_cubic[inner]
+            in_bound = in_bound[inner]
+        cubic.update({'lower':lower, 'upper':[elem + num - 1 for elem, num in zip(lower, shape)]
+                      , 'idx':idx_locs, 'in_cubic':in_cubic, 'in_bound':in_bound
+                      , 'regular':regular})
+        return cubic
+
+    def _get_distance_table(self, cubics, stage):
+        """ Tabulate the edge lengths over the boxes of the cubics and the reach of the
+        increments
+        Args:
+            cubics: cubics given by _get_cubic
+            stage: designated stage
+        Returns:
+            distance_table: DistanceTable
+        Raises:
+            Native exceptions.
+        """
+        offsets = self._get_offsets(self._norm.get_num_lon_index(stage)
+                                    , self._norm.get_num_lat_index(stage))
+        reach = max([max(abs(elem) for elem in offset[2]) for offset in offsets] + [0])
+        lower = np.min([cubic['cubic_lower'] for cubic in cubics], axis=0)
+        upper = np.max([cubic['cubic_upper'] for cubic in cubics], axis=0) + reach
+        return DistanceTable(self._norm, sorted(set(abs(inc) for inc in self._incs))
+                             , [lower[0], max(lower[1] - reach, 0), max(lower[2] - reach, 0)]
+                             , upper.tolist(), stage)
+
+    def _create_edge_array(self, cubics, idx_cubic, offset, setting):
+        """ Create the edges of a cubic along one positive increment
+        The pairs (vertex, vertex + increment) of the grid are kept when the cubic creates
+        them in either direction and no earlier cubic does, so every edge is made once.
+        Args:
+            cubics: cubic grids of the graph
+            idx_cubic: index of the current cubic
+            offset: [forward, backward, [diff_lon, diff_lat, diff_dep]] (see _get_offsets)
+            setting: dictionary of num_lon, num_lat, the DistanceTable (distance_table) and
+                     the slowness of the grid
+        Returns:
+            idx_src, idx_dst, weights: arrays of the created edges
+        Raises:
+            Native exceptions.
+        """
+        cubic = cubics[idx_cubic]
+        shape = cubic['idx'].shape
+        slice_src = tuple(slice(max(0, -offset[2][axis]), shape[2-axis] - max(0, offset[2][axis]))
+                          for axis in [2, 1, 0])
+        slice_dst = tuple(slice(max(0, offset[2][axis]), shape[2-axis] - max(0, -offset[2][axis]))
+                          for axis in [2, 1, 0])
+        idx_src = cubic['idx'][slice_src]
+        idx_dst = cubic['idx'][slice_dst]
+        if cubic['regular']:
+            keep = np.ones(idx_src.shape, dtype=bool)
+        else:
+            keep = np.zeros(idx_src.shape, dtype=bool)
+            if offset[0]:
+                keep |= cubic['in_cubic'][slice_src] & cubic['in_bound'][slice_dst]
+            if offset[1]:
+                keep |= cubic['in_cubic'][slice_dst] & cubic['in_bound'][slice_src]
+        for cubic_prev in cubics[:idx_cubic]:
+            if any(cubic_prev['lower'][axis] > cubic['upper'][axis]
+                   or cubic_prev['upper'][axis] < cubic['lower'][axis] for axis in range(3)):
+                continue
+            if not (cubic['regular'] and cubic_prev['regular']):
+                keep &= ~_is_created_array(cubic_prev, offset, idx_src, idx_dst
+                                           , setting['num_lon'], setting['num_lat'])
+                continue
+            # both ends in the earlier box, as grid indexes of the source
+            ranges = [[max(cubic_prev['lower'][axis], cubic_prev['lower'][axis] - offset[2][axis])
+                       - cubic['lower'][axis] - max(0, -offset[2][axis])
+                       , min(cubic_prev['upper'][axis], cubic_prev['upper'][axis] - offset[2][axis])
+                       - cubic['lower'][axis] - max(0, -offset[2][axis]) + 1] for axis in range(3)]
+            keep[tuple(slice(max(ranges[axis][0], 0), max(ranges[axis][1], 0))
+                       for axis in [2, 1, 0])] = False
+        idx_src = idx_src[keep]
+        idx_dst = idx_dst[keep]
+        dists = setting['distance_table'].get_distances(idx_src, idx_dst)
+        weights = dists*(setting['slowness'][slice_src][keep]
+                         + setting['slowness'][slice_dst][keep])*0.5
+        return idx_src, idx_dst, weights
+
+    def build_graph_csr(self, sta_loc, sou_loc, stage, path=None):
+        """ Build the whole graph as compressed sparse rows
+        Same vertexes, edges and weights as build_graph, computed with arrays over the grid
+        of each cubic instead of Edge objects.
+        Args:
+            sta_loc: location of station
+            sou_loc: location of source
+            stage: designated stage
+            path: stage 1 path, for stage 2
+        Returns:
+            indptr: array of the offsets of each vertex in indices and weights (int64)
+            indices: array of the local ids of the neighbours (int32), both directions of
+                     every edge are stored
+            weights: array of the edge weights (float64)
+            idx_vertex: array of the normalized index of each local id, increasing (int64)
+        Raises:
+            Native exceptions.
+        """
+        self._bnd = {}
+        loc_bound_upper, loc_bound_lower = self._get_cubics(sta_loc, sou_loc, stage, path)
         num_lon = self._norm.get_num_lon_index(stage)
         num_lat = self._norm.get_num_lat_index(stage)
         self._build_inc(num_lon, num_lat, stage)
+        offsets = self._get_offsets(num_lon, num_lat)
+        reach = max([max(abs(elem) for elem in offset[2]) for offset in offsets] + [0])
+        cubics = []
         for (loc_upper, loc_lower) in zip(loc_bound_upper, loc_bound_lower):
             self._set_boundary(loc_upper, loc_lower, stage)
-            self._divide_and_create(edges, stage
-                                    , {'loc_upper':loc_upper
-                                                   , 'loc_lower':loc_lower
-                                                                 , 'num_lon':num_lon
-                                                                             , 'num_lat':num_lat})
-        return edges
+            cubics.append(self._get_cubic_grid(num_lon, num_lat, reach))
+        distance_table = self._get_distance_table(cubics, stage)
+
+        idx_locs = np.unique(np.concatenate(
+            [cubic['idx'][cubic['in_cubic'] | cubic['in_bound']] for cubic in cubics]))
+        locs = self._norm.recover_norm_locs(idx_locs, stage)
+        slowness = self._get_slownesses(idx_locs, locs, stage)
+        edges = [[], [], []]
+        for idx_cubic, cubic in enumerate(cubics):
+            pos = np.minimum(np.searchsorted(idx_locs, cubic['idx']), len(idx_locs) - 1)
+            setting = {'num_lon':num_lon, 'num_lat':num_lat, 'slowness':slowness[pos]
+                       , 'distance_table':distance_table}
+            for offset in offsets:
+                for edge, elem in zip(edges, self._create_edge_array(cubics, idx_cubic, offset
+                                                                     , setting)):
+                    edge.append(elem)
+        idx_vertex = np.unique(np.concatenate(edges[0] + edges[1])).astype(np.int64)
+        indptr, indices, weights = graphsearch.get_csr(
+            np.searchsorted(idx_vertex, np.concatenate(edges[0])).astype(np.int32)
+            , np.searchsorted(idx_vertex, np.concatenate(edges[1])).astype(np.int32)
+            , np.concatenate(edges[2]), len(idx_vertex))
+        return indptr, indices, weights, idx_vertex
+
+    def _is_regular(self, cubic, num_lon, num_lat):
+        """ Tell if the boundary of a cubic is the corners of its box
+        Then _is_in_boundary and the vertexes iterated by build_graph are both the box.
+        Args:
+            cubic: cubic given by _get_cubic
+            num_lon: number of longitude indexes
+            num_lat: number of latitude indexes
+        Returns:
+            bool
+        Raises:
+            Native exceptions.
+        """
+        lower = cubic['cubic_lower']
+        upper = cubic['cubic_upper']
+        corners = [[lower[0], lower[1], lower[2]], [upper[0], lower[1], lower[2]]
+                   , [upper[0], upper[1], lower[2]], [upper[0], upper[1], upper[2]]]
+        return (all(low <= up for low, up in zip(lower, upper))
+                and upper[0] < num_lon and upper[1] < num_lat
+                and [corner[0] + corner[1] * num_lon + corner[2] * num_lon * num_lat
+                     for corner in corners]
+                == [cubic['bnd'][key] for key in ['idx_loc_min', 'idx_loc_lonmax'
+                                                  , 'idx_loc_lonlatmax', 'idx_loc_max']])
+
+    def build_graph_mask(self, sta_loc, sou_loc, stage, path=None):
+        """ Build the graph of the union of the cubics as compressed sparse rows
+        The global indexes of the voxels of the cubics are merged into one sorted set first,
+        then each positive increment links the voxels of the set once, the other ends being
+        found by binary search, so the memory and the work follow the volume of the corridor
+        instead of the number of cubics times their volume or the box around them. Unlike
+        build_graph, the voxels of two different cubics are linked as well: the vertexes are
+        the ones of build_graph, which edges and weights are among these.
+        Args:
+            sta_loc: location of station
+            sou_loc: location of source
+            stage: designated stage
+            path: stage 1 path, for stage 2
+        Returns:
+            indptr, indices, weights, idx_vertex: see build_graph_csr
+        Raises:
+            Native exceptions.
+        """
+        time_start = time.time()
+        self._bnd = {}
+        loc_bound_upper, loc_bound_lower = self._get_cubics(sta_loc, sou_loc, stage, path)
+        num_lon = self._norm.get_num_lon_index(stage)
+        num_lat = self._norm.get_num_lat_index(stage)
+        self._build_inc(num_lon, num_lat, stage)
+        offsets = self._get_offsets(num_lon, num_lat)
+        reach = max([max(abs(elem) for elem in offset[2]) for offset in offsets] + [0])
+        cubics = []
+        for (loc_upper, loc_lower) in zip(loc_bound_upper, loc_bound_lower):
+            self._set_boundary(loc_upper, loc_lower, stage)
+            cubic = self._get_cubic(num_lon, num_lat)
+            if self._is_regular(cubic, num_lon, num_lat):
+                cubic.update({'lower':cubic['cubic_lower'], 'upper':cubic['cubic_upper']})
+            else:
+                cubic = self._get_cubic_grid(num_lon, num_lat, reach)
+            cubics.append(cubic)
+
+        idx_cubics = []
+        for cubic in cubics:
+            if 'idx' in cubic:
+                idx_cubics.append(cubic['idx'][cubic['in_cubic'] | cubic['in_bound']])
+            else:
+                idx_bound = [cubic[key][0] + cubic[key][1] * num_lon
+                             + cubic[key][2] * num_lon * num_lat for key in ['lower', 'upper']]
+                idx_cubics.append(normgrid.LocalGrid(None, None, stage, idx_bound)
+                                  .get_global_ids())
+        voxels = np.unique(np.concatenate(idx_cubics))
+        del idx_cubics
+        coors = [voxels % num_lon, voxels // num_lon % num_lat]
+        edges = [[], []]
+        for offset in offsets:
+            diff_lon, diff_lat, diff_dep = offset[2]
+            # the ends off the lon and lat ranges would wrap around to other grid points
+            valid = np.flatnonzero((coors[0] + diff_lon >= 0) & (coors[0] + diff_lon < num_lon)
+                                   & (coors[1] + diff_lat >= 0) & (coors[1] + diff_lat < num_lat))
+            idx_dst = voxels[valid] + diff_lon + diff_lat * num_lon + diff_dep * num_lon * num_lat
+            pos = np.minimum(np.searchsorted(voxels, idx_dst), len(voxels) - 1)
+            linked = voxels[pos] == idx_dst
+            edges[0].append(valid[linked].astype(np.int32))
+            edges[1].append(pos[linked].astype(np.int32))
+        del coors
+        idx_src = np.concatenate(edges[0])
+        idx_dst = np.concatenate(edges[1])
+        del edges
+
+        # the voxels without edges are not vertexes of build_graph
+        degree = np.bincount(idx_src, minlength=len(voxels)) + np.bincount(idx_dst
+                                                                           , minlength=len(voxels))
+        renumber = np.cumsum(degree > 0, dtype=np.int32) - 1
+        idx_vertex = voxels[np.flatnonzero(degree)]
+        slowness = self._get_slownesses(idx_vertex
+                                        , self._norm.recover_norm_locs(idx_vertex, stage), stage)
+        idx_src = renumber[idx_src]
+        idx_dst = renumber[idx_dst]
+        weights = (self._get_distance_table(cubics, stage).get_distances(idx_vertex[idx_src]
+                                                                         , idx_vertex[idx_dst])
+                   * (slowness[idx_src] + slowness[idx_dst]) * 0.5)
+        self._mask_info = {'num_cubic':len(cubics), 'num_voxel':len(voxels)
+                           , 'num_vertex':len(idx_vertex), 'num_edge':len(weights)}
+        indptr, indices, weights = graphsearch.get_csr(idx_src, idx_dst, weights, len(idx_vertex))
+        self._mask_info['build_time'] = time.time() - time_start
+        return indptr, indices, weights, idx_vertex
+
+    def get_mask_info(self):
+        """ Return the sizes of the last graph built by build_graph_mask
+        Args:
+        Returns:
+            info: dictionary of num_cubic, num_voxel (voxels of the cubics),
+                  num_vertex, num_edge and build_time (sec)
+        Raises:
+            Native exceptions.
+        """
+        return dict(self._mask_info)
+
+    def build_graph_region(self, loc_min, loc_max, stage):
+        """ Build the graph of every normalized grid point of a region as arrays
+        The region is one cubic without extra range, whose edges are made as in build_graph
+        and numbered by the local ids of the LocalGrid of the region.
+        Args:
+            loc_min: lowermost coordinate of the region
+            loc_max: uppermost coordinate of the region
+            stage: designated stage
+        Returns:
+            grid: LocalGrid of the region
+            idx_src, idx_dst: arrays of the local ids of the ends of the edges
+            weights: array of the edge weights
+        Raises:
+            Native exceptions.
+        """
+        num_lon = self._norm.get_num_lon_index(stage)
+        num_lat = self._norm.get_num_lat_index(stage)
+        self._build_inc(num_lon, num_lat, stage)
+        grid = normgrid.LocalGrid(loc_min, loc_max, stage)
+        idx_locs = grid.get_global_ids()
+        shape = grid.get_shape()
+        self._bnd = {'idx_loc_min':idx_locs[0], 'idx_loc_lonmax':idx_locs[0] + shape[0] - 1
+                     , 'idx_loc_lonlatmax':idx_locs[0] + shape[0] - 1 + (shape[1] - 1) * num_lon
+                     , 'idx_loc_max':idx_locs[-1]}
+        cubics = [self._get_cubic(num_lon, num_lat)]
+        slab_edges = SlabEdges(cubics, self._incs, self._get_offsets(num_lon, num_lat)
+                               , {'num_lon':num_lon, 'num_lat':num_lat
+                                  , 'distance_table':self._get_distance_table(cubics, stage)})
+        slabs = [slab_edges.get_edges(task) for task in slab_edges.get_tasks()]
+        idx_src = grid.get_local_ids(np.concatenate([slab[0] for slab in slabs]))
+        idx_dst = grid.get_local_ids(np.concatenate([slab[1] for slab in slabs]))
+        slowness = self._get_slownesses(idx_locs, self._norm.recover_norm_locs(idx_locs, stage)
+                                        , stage)
+        weights = (np.concatenate([slab[2] for slab in slabs])
+                   * (slowness[idx_src] + slowness[idx_dst]) * 0.5)
+        return grid, idx_src, idx_dst, weights
+
+    def build_graph_implicit(self, sta_loc, sou_loc, stage, path=None):
+        """ Build the graph of build_graph without creating the edges
+        Only the cubics are set up here, the edges are made by the ImplicitGraph when the
+        search expands their vertexes.
+        Args:
+            sta_loc: location of station
+            sou_loc: location of source
+            stage: designated stage
+            path: stage 1 path, for stage 2
+        Returns:
+            graph: ImplicitGraph
+        Raises:
+            Native exceptions.
+        """
+        self._bnd = {}
+        loc_bound_upper, loc_bound_lower = self._get_cubics(sta_loc, sou_loc, stage, path)
+        num_lon = self._norm.get_num_lon_index(stage)
+        num_lat = self._norm.get_num_lat_index(stage)
+        self._build_inc(num_lon, num_lat, stage)
+        cubics = []
+        for (loc_upper, loc_lower) in zip(loc_bound_upper, loc_bound_lower):
+            self._set_boundary(loc_upper, loc_lower, stage)
+            cubics.append(self._get_cubic(num_lon, num_lat))
+        return ImplicitGraph(self, cubics, stage, self._get_offsets(num_lon, num_lat)
+                             , self._get_distance_table(cubics, stage))
+
+
+class DistanceTable(object):
+    """ Lengths of the edges along the positive increments by lat row and depth
+    Longitude being translation invariant, the length of an edge only depends on its
+    increment and on the lat row and depth of its lower end. The lengths are computed once
+    for the lat rows and depths of a box, then shared by all the vertexes and cubics.
+    Public Methods:
+        get_distance: get the length of an edge
+        get_distances: get the lengths of arrays of edges
+    """
+    def __init__(self, norm, incs, lower, upper, stage):
+        """ Compute the lengths over a box
+        Args:
+            norm: NormGrid
+            incs: sorted positive increments
+            lower: lowermost lon, lat and dep indexes of the box, the lon index is the
+                   one the lengths are computed at
+            upper: uppermost lon, lat and dep indexes of the box
+            stage: designated stage
+        """
+        self._num_lon = norm.get_num_lon_index(stage)
+        self._num_lat = norm.get_num_lat_index(stage)
+        self._lower = [lower[1], lower[2]]
+        self._incs = np.array(incs, dtype=np.int64)
+        self._pos = {inc:pos for pos, inc in enumerate(incs)}
+        idx_src = (lower[0] + np.arange(lower[1], upper[1] + 1)[:, None] * self._num_lon
+                   + np.arange(lower[2], upper[2] + 1)[None, :] * self._num_lon * self._num_lat)
+        locs_src = norm.recover_norm_locs(idx_src.ravel(), stage)
+        locs_dst = norm.recover_norm_locs((idx_src[None, :, :] + self._incs[:, None, None])
+                                          .ravel(), stage)
+        shiftlo = my_util.get_shiftlo(locs_src[0], locs_src[-1])
+        coors_src = my_util.get_cartesians_in_earth(locs_src, shiftlo, 6374.7524414062500)
+        coors_dst = my_util.get_cartesians_in_earth(locs_dst, shiftlo, 6374.7524414062500)
+        self._table = my_util.get_distances_in_earth(
+            coors_src.reshape(idx_src.shape + (3,))[None, :, :]
+            , coors_dst.reshape((len(incs),) + idx_src.shape + (3,)))
+        # lists of the lengths for get_distance, made at its first call
+        self._rows = None
+
+    def get_distance(self, idx_vertex1, idx_vertex2):
+        """ Return the length of an edge
+        Args:
+            idx_vertex1, idx_vertex2: indexes of the ends
+        Returns:
+            distance: length in km
+        Raises:
+            Native exceptions.
+        """
+        if self._rows is None:
+            self._rows = self._table.tolist()
+        idx_low = min(idx_vertex1, idx_vertex2)
+        return (self._rows[self._pos[abs(idx_vertex2 - idx_vertex1)]]
+                [idx_low // self._num_lon % self._num_lat - self._lower[0]]
+                [idx_low // (self._num_lon * self._num_lat) - self._lower[1]])
+
+    def get_distances(self, idx_vertexes1, idx_vertexes2):
+        """ Return the lengths of arrays of edges
+        Args:
+            idx_vertexes1, idx_vertexes2: arrays of indexes of the ends
+        Returns:
+            distances: array of lengths in km
+        Raises:
+            Native exceptions.
+        """
+        idx_low = np.minimum(idx_vertexes1, idx_vertexes2)
+        return self._table[np.searchsorted(self._incs, np.abs(idx_vertexes2 - idx_vertexes1))
+                           , idx_low // self._num_lon % self._num_lat - self._lower[0]
+                           , idx_low // (self._num_lon * self._num_lat) - self._lower[1]]
+
+
+def _init_slab_worker(settings):
+    """ Keep a GraphBuilder of the settings in a worker process of build_graph_arrays
+    Args:
+        settings: settings of the GraphBuilder starting the worker
+    Returns:
+    Raises:
+        Native exceptions.
+    """
+    _SLAB_BUILDER['graph'] = GraphBuilder(dict(settings, num_workers=1))
+
+def _get_slab_weights(job):
+    """ Return the edges created from some depth slabs, in a worker process of
+    build_graph_arrays
+    Args:
+        job: SlabEdges, stage, NormGrid rounding of the graph and tasks of the slabs
+    Returns:
+        idx_src, idx_dst, weights: see GraphBuilder.get_slab_weights
+    Raises:
+        Native exceptions.
+    """
+    slab_edges, stage, rounding, tasks = job
+    norm = normgrid.NormGrid()
+    if norm.get_rounding() != rounding:
+        norm.set_rounding(rounding)
+    return _SLAB_BUILDER['graph'].get_slab_weights(slab_edges, stage, tasks)
+
+
+class SlabEdges(object):
+    """ Edges of build_graph created from the depth slabs of the cubics
+    A vertex of a cubic creates an edge along each increment to the vertexes passing the
+    boundary of the cubic, unless the edge already exists. An edge exists when it was created
+    from its other end, which is tested from the cubic itself and not from the slabs already
+    done, or by an earlier cubic. So the slabs are independent of each other and may be done
+    in any process, and the edges come in the order of the vertex by vertex loop.
+    Public Methods:
+        get_tasks: get the depth slabs to create the edges from
+        get_edges: get the edges created from some depth slabs
+    """
+    def __init__(self, cubics, incs, offsets, setting):
+        """ Keep what the edges are created with
+        Args:
+            cubics: cubics given by _get_cubic, in the order of build_graph
+            incs: increments given by _build_inc
+            offsets: offsets given by _get_offsets
+            setting: dictionary of num_lon, num_lat, the DistanceTable (distance_table) and
+                     optionally the number of vertexes of a task (slab_size, _SLAB_SIZE by
+                     default)
+        """
+        self._cubics = [{key:cubic[key] for key in ['bnd', 'cubic_lower', 'cubic_upper']}
+                        for cubic in cubics]
+        self._incs = np.array(incs, dtype=np.int64)
+        self._num_lon = setting['num_lon']
+        self._num_lat = setting['num_lat']
+        self._distance_table = setting['distance_table']
+        self._slab_size = setting.get('slab_size', _SLAB_SIZE)
+        self._reach = max([max(abs(elem) for elem in offset[2]) for offset in offsets] + [0])
+        # for each increment, if the edge may be created from the lower end and the upper end
+        incs_set = set(incs)
+        self._from_lower = np.array([abs(inc) in incs_set for inc in incs], dtype=bool)
+        self._from_upper = np.array([-abs(inc) in incs_set for inc in incs], dtype=bool)
+
+    def get_tasks(self):
+        """ Return the depth slabs to create the edges from
+        Args:
+        Returns:
+            tasks: list of [index of the cubic, first slab, slab after the last one]
+        Raises:
+            Native exceptions.
+        """
+        tasks = []
+        for idx_cubic, cubic in enumerate(self._cubics):
+            shape = [upper - lower + 1 for lower, upper in zip(cubic['cubic_lower']
+                                                               , cubic['cubic_upper'])]
+            num_slab = max(self._slab_size // max(shape[0] * shape[1], 1), 1)
+            tasks.extend([idx_cubic, start, min(start + num_slab, shape[2])]
+                         for start in range(0, shape[2], num_slab))
+        return tasks
+
+    def _is_created(self, cubic, idx_lower, idx_upper, cols):
+        return ((self._from_lower[cols]
+                 & _is_in_cubic_array(cubic, idx_lower, self._num_lon, self._num_lat)
+                 & _is_in_boundary_array(cubic['bnd'], idx_upper, self._num_lon, self._num_lat))
+                | (self._from_upper[cols]
+                   & _is_in_cubic_array(cubic, idx_upper, self._num_lon, self._num_lat)
+                   & _is_in_boundary_array(cubic['bnd'], idx_lower, self._num_lon
+                                           , self._num_lat)))
+
+    def get_edges(self, task):
+        """ Return the edges created from some depth slabs of a cubic
+        Args:
+            task: [index of the cubic, first slab, slab after the last one]
+        Returns:
+            idx_src, idx_dst: arrays of the indexes of the vertexes creating the edges and of
+                              the vertexes they connect, in the order the edges are created
+            dists: array of the lengths of the edges in km
+        Raises:
+            Native exceptions.
+        """
+        idx_cubic, slab_start, slab_stop = task
+        cubic = self._cubics[idx_cubic]
+        bnd = cubic['bnd']
+        num_plane = self._num_lon * self._num_lat
+        idx_row = np.arange(bnd['idx_loc_min'], bnd['idx_loc_lonmax'] + 1)
+        diff_idx_lats = np.arange(0, bnd['idx_loc_lonlatmax'] - bnd['idx_loc_lonmax'] + 1
+                                  , self._num_lon)
+        diff_idx_deps = np.arange(slab_start, slab_stop) * num_plane
+        idx_slab = (diff_idx_deps[:, None, None] + diff_idx_lats[None, :, None]
+                    + idx_row[None, None, :]).ravel()
+        idx_nb = idx_slab[:, None] + self._incs[None, :]
+        rows, cols = np.nonzero(_is_in_boundary_array(bnd, idx_nb, self._num_lon
+                                                      , self._num_lat))
+        idx_src = idx_slab[rows]
+        idx_dst = idx_nb[rows, cols]
+        idx_lower = np.minimum(idx_src, idx_dst)
+        idx_upper = np.maximum(idx_src, idx_dst)
+        # created before from the lower end by the same cubic
+        keep = ~((idx_dst < idx_src) & self._is_created(cubic, idx_lower, idx_upper, cols))
+        lower = np.array(cubic['cubic_lower']) - self._reach
+        upper = np.array(cubic['cubic_upper']) + self._reach
+        for cubic_prev in self._cubics[:idx_cubic]:
+            # the boundary is at most one grid point off the box
+            if ((np.array(cubic_prev['cubic_lower']) - 1 > upper).any()
+                    or (np.array(cubic_prev['cubic_upper']) + 1 < lower).any()):
+                continue
+            keep &= ~self._is_created(cubic_prev, idx_lower, idx_upper, cols)
+        idx_src = idx_src[keep]
+        idx_dst = idx_dst[keep]
+        return idx_src, idx_dst, self._distance_table.get_distances(idx_src, idx_dst)
+
+
+class ImplicitGraph(object):
+    """ Graph of build_graph whose edges are made when a vertex is expanded
+    The neighbours of a vertex come from the increments of _build_inc, and an edge is kept
+    when a cubic creates it, with its length looked up in the DistanceTable as in build_graph.
+    The slowness is computed for the tiles of the reached vertexes and memoized, so the
+    memory follows the vertexes reached by the search instead of the volume of the cubics.
+    Public Methods:
+        get_neighbours: get the neighbours of a vertex and the weights of the edges
+        get_heuristic: get the lower bounds of the distances to a vertex, for A* search
+        get_num_vertex: get the number of vertexes reached so far
+    """
+    def __init__(self, graphbuild, cubics, stage, offsets, distance_table):
+        self._graphbuild = graphbuild
+        self._distance_table = distance_table
+        self._stage = stage
+        self._num_lon = graphbuild._norm.get_num_lon_index(stage)
+        self._num_lat = graphbuild._norm.get_num_lat_index(stage)
+        reach = max([max(abs(elem) for elem in offset[2]) for offset in offsets] + [0])
+        # the cubics, as columns to test a vertex against all of them at once
+        self._bnd = {key:np.array([[cubic['bnd'][key]] for cubic in cubics], dtype=np.int64)
+                     for key in ['idx_loc_min', 'idx_loc_lonmax', 'idx_loc_lonlatmax'
+                                 , 'idx_loc_max']}
+        self._cubic = {key:np.array([cubic[key] for cubic in cubics], dtype=np.int64).T[:, :, None]
+                       for key in ['cubic_lower', 'cubic_upper']}
+        self._lower = np.array([cubic['cubic_lower'] for cubic in cubics]) - reach
+        self._upper = np.array([cubic['cubic_upper'] for cubic in cubics]) + reach
+        # both directions of each increment, and if the vertex or the neighbour is the end
+        # the increment starts from
+        self._steps = np.array([sign * self._get_inc(offset[2]) for offset in offsets
+                                for sign in [1, -1]], dtype=np.int64)
+        self._from_vertex = np.array([offset[0] if sign == 1 else offset[1]
+                                      for offset in offsets for sign in [1, -1]])
+        self._from_neighbour = np.array([offset[1] if sign == 1 else offset[0]
+                                         for offset in offsets for sign in [1, -1]])
+        box_lower = np.maximum(self._lower.min(axis=0), 0)
+        box_upper = self._upper.max(axis=0)
+        self._box = [box_lower.tolist(), box_upper.tolist()]
+        self._tiles = set()
+        self._slowness = {}
+
+    def _get_inc(self, diffs):
+        return diffs[0] + diffs[1] * self._num_lon + diffs[2] * self._num_lon * self._num_lat
+
+    def _get_tiles(self, idx_locs):
+        idx_locs = np.asarray(idx_locs, dtype=np.int64)
+        coors = np.column_stack([idx_locs % self._num_lon
+                                 , idx_locs // self._num_lon % self._num_lat
+                                 , idx_locs // (self._num_lon * self._num_lat)])
+        return set(map(tuple, (coors // _TILE_SIZE).tolist()))
+
+    def _get_tile_ids(self, tiles):
+        idx_locs = []
+        for tile in tiles:
+            axes = [np.arange(max(elem * _TILE_SIZE, lower)
+                              , min((elem + 1) * _TILE_SIZE, upper + 1))
+                    for elem, lower, upper in zip(tile, self._box[0], self._box[1])]
+            idx_locs.append((axes[0][None, None, :] + axes[1][None, :, None] * self._num_lon
+                             + axes[2][:, None, None] * self._num_lon * self._num_lat).ravel())
+        return np.concatenate(idx_locs)
+
+    def _prepare_vertex(self, idx_locs):
+        idx_new = [idx for idx in idx_locs if idx not in self._slowness]
+        if not idx_new:
+            return
+        tiles = self._get_tiles(idx_new) - self._tiles
+        if not tiles:
+            return
+        self._tiles |= tiles
+        idx_new = self._get_tile_ids(tiles)
+        locs = self._graphbuild._norm.recover_norm_locs(idx_new, self._stage)
+        slowness = self._graphbuild._get_slownesses(idx_new, locs, self._stage)
+        self._slowness.update(zip(idx_new.tolist(), slowness.tolist()))
+
+    def get_neighbours(self, idx, settled=()):
+        """ Return the neighbours of a vertex and the weights of the edges
+        Args:
+            idx: index of the vertex
+            settled: vertexes to leave out
+        Returns:
+            neighbours: list of the indexes of the neighbours
+            weights: list of the weights of the edges
+        Raises:
+            Native exceptions.
+        """
+        coor = np.array([idx % self._num_lon, idx // self._num_lon % self._num_lat
+                         , idx // (self._num_lon * self._num_lat)])
+        cands = np.flatnonzero(((self._lower <= coor) & (coor <= self._upper)).all(axis=1))
+        neighbours = idx + self._steps
+        fresh = np.array([neighbour not in settled for neighbour in neighbours.tolist()]
+                         , dtype=bool)
+        neighbours = neighbours[fresh]
+        if not len(cands) or not len(neighbours):
+            return [], []
+        bnd = {key:val[cands] for key, val in self._bnd.items()}
+        cubic = {key:val[:, cands] for key, val in self._cubic.items()}
+        # cubics x neighbours, True where the cubic creates the edge
+        created = ((self._from_vertex[fresh]
+                    & _is_in_cubic_array(cubic, np.array([[idx]]), self._num_lon, self._num_lat)
+                    & _is_in_boundary_array(bnd, neighbours[None, :], self._num_lon
+                                            , self._num_lat))
+                   | (self._from_neighbour[fresh]
+                      & _is_in_cubic_array(cubic, neighbours[None, :], self._num_lon
+                                           , self._num_lat)
+                      & _is_in_boundary_array(bnd, np.array([[idx]]), self._num_lon
+                                              , self._num_lat)))
+        neighbours = neighbours[created.any(axis=0)]
+        dists = self._distance_table.get_distances(np.full(len(neighbours), idx), neighbours)
+        neighbours = neighbours.tolist()
+        self._prepare_vertex([idx] + neighbours)
+        slowness = np.array([self._slowness[elem] for elem in neighbours])
+        weights = dists*(self._slowness[idx]+slowness)*0.5
+        return neighbours, weights.tolist()
+
+    def get_heuristic(self, idx_target):
+        """ Return the function giving the lower bounds of the distances to a vertex
+        The bound is the straight distance to the target over the largest speed of the model,
+        lowered by _HEURISTIC_MARGIN so that the rounding of the edge lengths cannot make it
+        go over the weight of an edge plus the bound of its other end.
+        Args:
+            idx_target: index of the target vertex
+        Returns:
+            get_heuristics: function(idx_locs) returning the list of the bounds (sec)
+        Raises:
+            Native exceptions.
+        """
+        norm = self._graphbuild._norm
+        loc_target = norm.recover_norm_loc(idx_target, self._stage)
+        shiftlo = my_util.get_shiftlo(loc_target, loc_target)
+        coor_target = my_util.get_cartesians_in_earth([loc_target], shiftlo, 6374.7524414062500)
+        slowness = (1 - _HEURISTIC_MARGIN) / self._graphbuild._geo.get_max_speed()
+        # the bounds are computed for whole tiles, as the slowness
+        tiles_done = set()
+        bounds = {}
+        def get_heuristics(idx_locs):
+            tiles = self._get_tiles([idx for idx in idx_locs if idx not in bounds]) - tiles_done
+            if tiles:
+                tiles_done.update(tiles)
+                idx_new = self._get_tile_ids(tiles)
+                coors = my_util.get_cartesians_in_earth(norm.recover_norm_locs(idx_new
+                                                                               , self._stage)
+                                                        , shiftlo, 6374.7524414062500)
+                bounds.update(zip(idx_new.tolist()
+                                  , (my_util.get_distances_in_earth(coor_target, coors)
+                                     * slowness).tolist()))
+            return [bounds[idx] for idx in idx_locs]
+        return get_heuristics
+
+    def get_num_vertex(self):
+        """ Return the number of vertexes reached so far
+        Args:
+        Returns:
+            number of vertexes whose location and slowness were computed
+        Raises:
+            Native exceptions.
+        """
+        return len(self._slowness)
+
 
 def _test_mod_vertex_que(norm, idx_vertexes):
     num_bnd = 0
@@ -344,6 +1304,285 @@ class GraphTest(unittest.TestCase):
         edges = graphbuild.build_graph(loc_sta, loc_sou, 1)
         self.assertEqual(len(edges), 6)
 
+    def test_mod_with_slab_edges(self):
+        """ Test if the edges created by depth slab are the ones of the vertex by vertex loop,
+        in the same order
+        """
+        settings = {'extra_range':[0.01, 0.01, 1], 'ranges':[0.01, 0.01, 1], 'path_model':None}
+        graphbuild = GraphBuilder(settings)
+        loc_sta = [121.740700, 24.428, -0.113000]
+        loc_sou = [121.760000, 24.45, 1.500000]
+        path = [[121.7407, 24.428, -0.113], [121.7457, 24.433, 0.4], [121.7507, 24.44, 0.9]]
+        for stage, path_stage in [[1, None], [2, path]]:
+            edges = graphbuild.build_graph(loc_sta, loc_sou, stage, path_stage)
+            num_lon = graphbuild._norm.get_num_lon_index(stage)
+            num_plane = num_lon * graphbuild._norm.get_num_lat_index(stage)
+            idx_locs = sorted(set(idx for edge in edges for idx in edge.get_info()[:2]))
+            slowness = dict(zip(idx_locs, graphbuild._get_slownesses(
+                np.array(idx_locs), graphbuild._norm.recover_norm_locs(idx_locs, stage)
+                , stage).tolist()))
+            edges_loop = set()
+            for loc_upper, loc_lower in zip(*graphbuild._get_cubics(loc_sta, loc_sou, stage
+                                                                    , path_stage)):
+                graphbuild._set_boundary(loc_upper, loc_lower, stage)
+                bnd = graphbuild._bnd
+                for idx_dep in range(0, bnd['idx_loc_max'] - bnd['idx_loc_lonlatmax'] + 1
+                                     , num_plane):
+                    for idx_lat in range(0, bnd['idx_loc_lonlatmax'] - bnd['idx_loc_lonmax'] + 1
+                                         , num_lon):
+                        for idx in range(bnd['idx_loc_min'] + idx_lat + idx_dep
+                                         , bnd['idx_loc_lonmax'] + 1 + idx_lat + idx_dep):
+                            for inc in graphbuild._incs:
+                                if not graphbuild._is_in_boundary(idx + inc, num_lon
+                                                                  , num_plane // num_lon):
+                                    continue
+                                weight = (graphbuild._distance_table.get_distance(idx, idx + inc)
+                                          * (slowness[idx] + slowness[idx + inc]) * 0.5)
+                                if (Edge(idx, idx + inc, weight) not in edges_loop
+                                        and Edge(idx + inc, idx, weight) not in edges_loop):
+                                    edges_loop.add(Edge(idx, idx + inc, weight))
+            self.assertEqual([edge.get_info() for edge in edges]
+                             , [edge.get_info() for edge in edges_loop])
+
+    def test_mod_with_parallel(self):
+        """ Test if the edges are the same for any number of workers and depth slabs per task
+        """
+        settings = {'extra_range':[0.01, 0.01, 1], 'ranges':[0.01, 0.01, 1], 'path_model':None}
+        loc_sta = [121.740700, 24.428, -0.113000]
+        loc_sou = [121.760000, 24.45, 1.500000]
+        path = [[121.7407, 24.428, -0.113], [121.7457, 24.433, 0.4], [121.7507, 24.44, 0.9]]
+        graphbuild = GraphBuilder(settings)
+        graphbuild_workers = GraphBuilder(dict(settings, num_workers=2))
+        for stage, path_stage in [[1, None], [2, path]]:
+            edges = [edge.get_info()
+                     for edge in graphbuild.build_graph(loc_sta, loc_sou, stage, path_stage)]
+            self.assertEqual([edge.get_info() for edge in graphbuild_workers.build_graph(
+                loc_sta, loc_sou, stage, path_stage)], edges)
+        num_lon = graphbuild._norm.get_num_lon_index(2)
+        num_lat = graphbuild._norm.get_num_lat_index(2)
+        cubics = []
+        for loc_upper, loc_lower in zip(*graphbuild._get_cubics(loc_sta, loc_sou, 2, path)):
+            graphbuild._set_boundary(loc_upper, loc_lower, 2)
+            cubics.append(graphbuild._get_cubic(num_lon, num_lat))
+        slab_edges = SlabEdges(cubics, graphbuild._incs, graphbuild._get_offsets(num_lon, num_lat)
+                               , {'num_lon':num_lon, 'num_lat':num_lat
+                                  , 'distance_table':graphbuild._distance_table, 'slab_size':1})
+        tasks = slab_edges.get_tasks()
+        self.assertEqual(len(tasks), sum(cubic['cubic_upper'][2] - cubic['cubic_lower'][2] + 1
+                                         for cubic in cubics))
+        idx_src, idx_dst, weights = graphbuild.get_slab_weights(slab_edges, 2, tasks)
+        edges_slab = set()
+        for idx, idx_inc, weight in zip(idx_src.tolist(), idx_dst.tolist(), weights.tolist()):
+            edges_slab.add(Edge(idx, idx_inc, weight))
+        self.assertEqual([edge.get_info() for edge in edges_slab], edges)
+        for arrays, arrays_workers in zip(graphbuild.build_graph_arrays(loc_sta, loc_sou, 2, path)
+                                          , graphbuild_workers.build_graph_arrays(
+                                              loc_sta, loc_sou, 2, path)):
+            self.assertTrue(np.array_equal(arrays, arrays_workers))
+        graphbuild_workers.close()
+
+    def test_mod_with_parallel_scaling(self):
+        """ Benchmark build_graph_arrays with 1 to 16 workers, up to the number of CPUs, the
+        first call starting the worker processes and the second one reusing them
+        """
+        settings = {'extra_range':[0.05, 0.05, 5], 'ranges':[0.02, 0.02, 1], 'path_model':None}
+        loc_sta = [120.8998, 23.883, -1.015]
+        loc_sou = [120.41314, 23.42513, -0.02]
+        print('cpu_count=%s' % os.cpu_count())
+        arrays = None
+        for num_workers in [num for num in [1, 2, 4, 8, 16] if num <= (os.cpu_count() or 1)]:
+            graphbuild = GraphBuilder(dict(settings, num_workers=num_workers))
+            times = []
+            for _ in range(2):
+                time_start = time.time()
+                arrays_workers = graphbuild.build_graph_arrays(loc_sta, loc_sou, 1)
+                times.append(time.time() - time_start)
+            graphbuild.close()
+            print('num_workers=%d, num_edge=%d, first=%.3fs, second=%.3fs'
+                  % (num_workers, len(arrays_workers[2]), times[0], times[1]))
+            if arrays is None:
+                arrays = arrays_workers
+            for array, array_workers in zip(arrays, arrays_workers):
+                self.assertTrue(np.array_equal(array, array_workers))
+
+    def test_mod_with_slowness_region(self):
+        """ Test if the precomputed slowness gives the same edges as the model interpolation
+        """
+        settings = {'extra_range':[0.02, 0.02, 2], 'ranges':[0.05, 0.05, 2], 'path_model':None}
+        loc_sta = [121.740700, 24.428, -0.113000]
+        loc_sou = [121.800000, 24.49, 3.500000]
+        edges = GraphBuilder(settings).build_graph(loc_sta, loc_sou, 1)
+        settings['slowness_region'] = [[121.75, 24.43, 0], [121.9, 24.6, 5]]
+        edges_region = GraphBuilder(settings).build_graph(loc_sta, loc_sou, 1)
+        self.assertEqual(sorted(edge.get_info() for edge in edges_region)
+                         , sorted(edge.get_info() for edge in edges))
+
+    def test_mod_with_norm_rounding(self):
+        """ Test if a builder without setting 'norm_rounding' keeps the rounding of the others
+        """
+        settings = {'extra_range':[0.02, 0.02, 2], 'ranges':[0.05, 0.05, 2], 'path_model':None}
+        GraphBuilder(dict(settings, norm_rounding='lattice'))
+        GraphBuilder(settings)
+        GraphBuilder()
+        self.assertEqual(normgrid.NormGrid().get_rounding(), 'lattice')
+        GraphBuilder(dict(settings, norm_rounding='decimal'))
+        self.assertEqual(normgrid.NormGrid().get_rounding(), 'decimal')
+
+    def test_mod_with_csr(self):
+        """ Test if the compressed sparse rows hold the same edges as build_graph
+        """
+        settings = {'extra_range':[0.01, 0.01, 1], 'ranges':[0.01, 0.01, 1], 'path_model':None}
+        graphbuild = GraphBuilder(settings)
+        loc_sta = [121.740700, 24.428, -0.113000]
+        loc_sou = [121.760000, 24.45, 1.500000]
+        path = [[121.7407, 24.428, -0.113], [121.7457, 24.433, 0.4], [121.7507, 24.44, 0.9]]
+        for stage, path_stage in [[1, None], [2, path]]:
+            edges = {}
+            for edge in graphbuild.build_graph(loc_sta, loc_sou, stage, path_stage):
+                edge_info = edge.get_info()
+                edges[(min(edge_info[:2]), max(edge_info[:2]))] = edge_info[2]
+            indptr, indices, weights, idx_vertex = graphbuild.build_graph_csr(loc_sta, loc_sou
+                                                                              , stage, path_stage)
+            edges_csr = {}
+            for row in range(len(idx_vertex)):
+                for pos in range(indptr[row], indptr[row+1]):
+                    self.assertEqual(weights[pos], edges_csr.setdefault(
+                        tuple(sorted([int(idx_vertex[row]), int(idx_vertex[indices[pos]])]))
+                        , float(weights[pos])))
+            self.assertEqual(edges_csr, edges)
+
+    def test_mod_with_stencil(self):
+        """ Test if the stencils are the legacy stars by default and drop the collinear steps
+        """
+        graphbuild = GraphBuilder()
+        norm = normgrid.NormGrid()
+        for stage, reach in [[1, 1], [2, 2]]:
+            num_lon = norm.get_num_lon_index(stage)
+            num_plane = num_lon * norm.get_num_lat_index(stage)
+            graphbuild._build_inc(num_lon, num_plane // num_lon, stage)
+            self.assertEqual(graphbuild._incs, [diff_lon + diff_lat + diff_dep
+                                                for diff_dep in range(0, (reach+1)*num_plane
+                                                                      , num_plane)
+                                                for diff_lat in range(-reach*num_lon
+                                                                      , (reach+1)*num_lon, num_lon)
+                                                for diff_lon in range(-reach, reach+1)
+                                                if diff_lon + diff_lat + diff_dep != 0])
+        self.assertEqual(get_stencil_steps('26', 2), get_stencil_steps('forward', 1))
+        self.assertEqual([len(get_stencil_steps(name, 1)) for name in ['6', '18', 'radius2']]
+                         , [5, 13, 57])
+        self.assertNotIn([2, 0, 2], get_stencil_steps('radius2', 1))
+        self.assertIn([2, -1, 2], get_stencil_steps('radius2', 1))
+
+    def test_mod_with_stencil_error(self):
+        """ Benchmark the stencils with the straight ray of a uniform model
+        """
+        speed = 5.0
+        loc_sta = [121.0, 24.0, 0.0]
+        loc_sou = [121.07, 24.03, 5.0]
+        norm = normgrid.NormGrid()
+        with tempfile.TemporaryDirectory() as dirpath:
+            filepath = os.path.join(dirpath, 'MOD_UNIFORM')
+            geomodel._test_mod_write_model(filepath, [[120.5, 121.5], [23.5, 24.5], [-10.0, 30.0]]
+                                           , lambda lon, lat, dep: speed)
+            locs = [norm.recover_norm_loc(norm.get_norm_index(loc, 1), 1)
+                    for loc in [loc_sta, loc_sou]]
+            time_ray = my_util.get_distance_in_earth(locs[0], locs[1]
+                                                     , my_util.get_shiftlo(locs[0], locs[1])
+                                                     , 6374.7524414062500) / speed
+            errors = []
+            for name in ['6', '18', '26', 'radius2', 'radius3']:
+                graphbuild = GraphBuilder({'extra_range':[0.01, 0.01, 1], 'ranges':[0.01, 0.01, 1]
+                                           , 'path_model':filepath, 'stencils':[name, name]})
+                time_start = time.time()
+                edges = graphbuild.build_graph(loc_sta, loc_sou, 1)
+                elapsed = time.time() - time_start
+                indptr, indices, weights, idx_vertex = graphbuild.build_graph_csr(loc_sta, loc_sou
+                                                                                  , 1)
+                self.assertEqual(len(indices), 2 * len(edges))
+                num_vertex = {idx:num for num, idx in enumerate(idx_vertex.tolist())}
+                dists, _ = graphsearch.dijkstra(
+                    lambda row, settled: (indices[indptr[row]:indptr[row+1]].tolist()
+                                          , weights[indptr[row]:indptr[row+1]].tolist())
+                    , num_vertex[norm.get_norm_index(loc_sta, 1)]
+                    , num_vertex[norm.get_norm_index(loc_sou, 1)])
+                errors.append(dists[num_vertex[norm.get_norm_index(loc_sou, 1)]] / time_ray - 1)
+                print('stencil=%s, edges=%d, time=%.3fs, travel time error=%.2f%%'
+                      % (name, len(edges), elapsed, errors[-1] * 100))
+        self.assertTrue(all(error > -1e-9 for error in errors))
+        self.assertEqual(errors, sorted(errors, reverse=True))
+
+    def test_mod_with_implicit(self):
+        """ Test if the implicit graph gives the same neighbours and weights as build_graph_csr
+        """
+        settings = {'extra_range':[0.01, 0.01, 1], 'ranges':[0.01, 0.01, 1], 'path_model':None}
+        graphbuild = GraphBuilder(settings)
+        loc_sta = [121.740700, 24.428, -0.113000]
+        loc_sou = [121.760000, 24.45, 1.500000]
+        path = [[121.7407, 24.428, -0.113], [121.7457, 24.433, 0.4], [121.7507, 24.44, 0.9]]
+        for stage, path_stage in [[1, None], [2, path]]:
+            indptr, indices, weights, idx_vertex = graphbuild.build_graph_csr(loc_sta, loc_sou
+                                                                              , stage, path_stage)
+            graph = graphbuild.build_graph_implicit(loc_sta, loc_sou, stage, path_stage)
+            for row in range(0, len(idx_vertex), 7):
+                neighbours, weights_implicit = graph.get_neighbours(int(idx_vertex[row]))
+                self.assertEqual(sorted(zip(neighbours, weights_implicit))
+                                 , sorted(zip(idx_vertex[indices[indptr[row]:indptr[row+1]]]
+                                              .tolist(), weights[indptr[row]:indptr[row+1]]
+                                              .tolist())))
+
+    def test_mod_with_mask(self):
+        """ Test if the voxel mask gives the vertexes of build_graph_csr, its edges and the
+        edges between the voxels of different cubics
+        """
+        settings = {'extra_range':[0.01, 0.01, 1], 'ranges':[0.01, 0.01, 1], 'path_model':None}
+        graphbuild = GraphBuilder(settings)
+        loc_sta = [121.740700, 24.428, -0.113000]
+        loc_sou = [121.760000, 24.45, 1.500000]
+        path = [[121.7407, 24.428, -0.113], [121.7457, 24.433, 0.4], [121.7507, 24.44, 0.9]]
+        for stage, path_stage in [[1, None], [2, path]]:
+            indptr, indices, weights, idx_vertex = graphbuild.build_graph_csr(loc_sta, loc_sou
+                                                                              , stage, path_stage)
+            indptr_mask, indices_mask, weights_mask, idx_vertex_mask = graphbuild.build_graph_mask(
+                loc_sta, loc_sou, stage, path_stage)
+            self.assertEqual(idx_vertex_mask.tolist(), idx_vertex.tolist())
+            edges_mask = {}
+            for row in range(len(idx_vertex)):
+                for pos in range(indptr_mask[row], indptr_mask[row+1]):
+                    edges_mask[(row, int(indices_mask[pos]))] = float(weights_mask[pos])
+            for row in range(len(idx_vertex)):
+                for pos in range(indptr[row], indptr[row+1]):
+                    self.assertEqual(edges_mask[(row, int(indices[pos]))], weights[pos])
+            vertexes = set(idx_vertex.tolist())
+            incs = set(abs(inc) for inc in graphbuild._incs)
+            num_edge = sum(idx + inc in vertexes for idx in vertexes for inc in incs)
+            info = graphbuild.get_mask_info()
+            self.assertEqual([info['num_vertex'], info['num_edge'], len(edges_mask)]
+                             , [len(vertexes), num_edge, 2 * num_edge])
+
+    def test_mod_with_distance_table(self):
+        """ Test if the tabulated edge lengths agree with get_distance_in_earth
+        The recovered latitude of a lat row keeps 12 significant digits, so it varies
+        by about 1e-7 degree along the row and so do the lengths of get_distance_in_earth.
+        """
+        settings = {'extra_range':[0.01, 0.01, 1], 'ranges':[0.01, 0.01, 1], 'path_model':None}
+        graphbuild = GraphBuilder(settings)
+        norm = normgrid.NormGrid()
+        loc_sta = [121.740700, 24.428, -0.113000]
+        loc_sou = [121.760000, 24.45, 1.500000]
+        path = [[121.7407, 24.428, -0.113], [121.7457, 24.433, 0.4], [121.7507, 24.44, 0.9]]
+        for stage, path_stage in [[1, None], [2, path]]:
+            edges = graphbuild.build_graph(loc_sta, loc_sou, stage, path_stage)
+            shiftlo = my_util.get_shiftlo(norm.get_norm_loc(loc_sta, stage)
+                                          , norm.get_norm_loc(loc_sou, stage))
+            for edge in edges:
+                idx_vertex1, idx_vertex2 = edge.get_info()[:2]
+                dist = my_util.get_distance_in_earth(norm.recover_norm_loc(idx_vertex1, stage)
+                                                     , norm.recover_norm_loc(idx_vertex2, stage)
+                                                     , shiftlo, 6374.7524414062500)
+                self.assertLess(abs(graphbuild._distance_table.get_distance(idx_vertex1
+                                                                            , idx_vertex2)
+                                    / dist - 1), 1e-4)
+
     def test_mod_with_edge_direction(self):
         """ Test edge direction by dijkstra
         """
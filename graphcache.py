@@ -0,0 +1,200 @@
+#!/usr/bin/python
+
+""" The stuffs related to the cache of the built graphs.
+"""
+import os
+import tempfile
+import unittest
+import numpy as np
+import graphbuilder
+
+# Edges of a cached graph, in the order of the edge list given by build_graph
+_EDGE_DTYPE = np.dtype([('idx_vertex1', '<i8'), ('idx_vertex2', '<i8'), ('weight', '<f8')])
+
+# Largest total size of the cached graphs by default (bytes)
+_CACHE_SIZE = 1 << 30
+
+def get_edge_array(edges):
+    """ Return the edges as an array
+    Args:
+        edges: edge list given by build_graph
+    Returns:
+        edge_array: structured array of idx_vertex1, idx_vertex2 and weight
+    Raises:
+        Native exceptions.
+    """
+    return np.array([tuple(edge.get_info()) for edge in edges], dtype=_EDGE_DTYPE)
+
+def get_edges(edge_array):
+    """ Return the edges of an array
+    Args:
+        edge_array: structured array given by get_edge_array
+    Returns:
+        edges: list of Edge, in the order of the array
+    Raises:
+        Native exceptions.
+    """
+    return [graphbuilder.Edge(idx_vertex1, idx_vertex2, weight)
+            for idx_vertex1, idx_vertex2, weight in edge_array.tolist()]
+
+
+class GraphCache(object):
+    """ Graphs saved as <dirpath>/graph_<key>.npy, least recently used ones evicted first
+    The edges are kept as one structured array, memory mapped when loaded. A loaded graph
+    becomes the most recently used one, and the oldest graphs are removed when the total
+    size goes over the limit.
+    Public Methods:
+        load: load the edges of a graph
+        save: save the edges of a graph
+        get_info: get the hit and miss counters and the size of the cache
+    """
+    def __init__(self, dirpath, max_size=None):
+        """ Use the graphs of a directory
+        Args:
+            dirpath: directory of the cache, made if missing
+            max_size: largest total size of the graphs (bytes), _CACHE_SIZE if None
+        """
+        self._dirpath = dirpath
+        self._max_size = _CACHE_SIZE if max_size is None else max_size
+        self._info = {'hit':0, 'miss':0, 'evicted':0}
+        os.makedirs(dirpath, exist_ok=True)
+
+    def _get_filepath(self, key):
+        return os.path.join(self._dirpath, 'graph_%s.npy' % key)
+
+    def _list_graphs(self):
+        graphs = []
+        for filename in os.listdir(self._dirpath):
+            if not (filename.startswith('graph_') and filename.endswith('.npy')):
+                continue
+            try:
+                stat = os.stat(os.path.join(self._dirpath, filename))
+            except OSError:
+                continue
+            graphs.append([stat.st_mtime, stat.st_size, filename])
+        return sorted(graphs)
+
+    def load(self, key):
+        """ Load the edges of a graph
+        Args:
+            key: key given by GraphBuilder.get_graph_key
+        Returns:
+            edge_array: memory mapped array of the edges (see get_edge_array), None if the
+                        graph is not cached
+        Raises:
+            Native exceptions.
+        """
+        filepath = self._get_filepath(key)
+        try:
+            edge_array = np.load(filepath, mmap_mode='r')
+            os.utime(filepath)
+        except (OSError, ValueError):
+            self._info['miss'] += 1
+            return None
+        self._info['hit'] += 1
+        return edge_array
+
+    def save(self, key, edges):
+        """ Save the edges of a graph, then evict the least recently used graphs over the size
+        Args:
+            key: key given by GraphBuilder.get_graph_key
+            edges: edge list given by build_graph
+        Returns:
+        Raises:
+            Native exceptions.
+        """
+        filepath = self._get_filepath(key)
+        filepath_tmp = '%s.%d.tmp' % (filepath, os.getpid())
+        try:
+            with open(filepath_tmp, 'wb') as the_file:
+                np.save(the_file, get_edge_array(edges))
+            os.replace(filepath_tmp, filepath)
+        except OSError:
+            print("Cannot write graph %s" % filepath)
+            return
+        graphs = self._list_graphs()
+        size = sum(graph[1] for graph in graphs)
+        for _, size_graph, filename in graphs:
+            if size <= self._max_size:
+                break
+            if filename == os.path.basename(filepath):
+                continue
+            try:
+                os.remove(os.path.join(self._dirpath, filename))
+            except OSError:
+                continue
+            size -= size_graph
+            self._info['evicted'] += 1
+
+    def get_info(self):
+        """ Return the hit and miss counters and the size of the cache
+        Args:
+        Returns:
+            info: dictionary of hit, miss and evicted counts of this instance, and num_graph
+                  and size (bytes) of the cache
+        Raises:
+            Native exceptions.
+        """
+        info = dict(self._info)
+        graphs = self._list_graphs()
+        info['num_graph'] = len(graphs)
+        info['size'] = sum(graph[1] for graph in graphs)
+        return info
+
+
+class GraphCacheTest(unittest.TestCase):
+    """ Test with graphs saved in a temporary directory
+    """
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_mod_with_graph(self):
+        """ Test if the cached edges are the built ones, in the same order
+        """
+        settings = {'extra_range':[0.01, 0.01, 1], 'ranges':[0.01, 0.01, 1], 'path_model':None}
+        graphbuild = graphbuilder.GraphBuilder(settings)
+        loc_sta = [121.740700, 24.428, -0.113000]
+        loc_sou = [121.760000, 24.45, 1.500000]
+        cache = GraphCache(self._dir.name)
+        key = graphbuild.get_graph_key(loc_sta, loc_sou, 1)
+        self.assertEqual(graphbuild.get_graph_key(loc_sou, loc_sta, 1), key)
+        self.assertNotEqual(graphbuild.get_graph_key(loc_sta, [121.76, 24.45, 2.5], 1), key)
+        self.assertIsNone(cache.load(key))
+        edges = graphbuild.build_graph(loc_sta, loc_sou, 1)
+        cache.save(key, edges)
+        self.assertEqual([edge.get_info() for edge in get_edges(cache.load(key))]
+                         , [edge.get_info() for edge in edges])
+        info = cache.get_info()
+        self.assertEqual([info['hit'], info['miss'], info['num_graph']], [1, 1, 1])
+
+    def test_mod_with_eviction(self):
+        """ Test if the least recently used graphs are evicted over the size
+        """
+        edges = [graphbuilder.Edge(idx, idx + 1, 0.5) for idx in range(100)]
+        GraphCache(self._dir.name).save('a', edges)
+        cache = GraphCache(self._dir.name
+                           , 2 * os.path.getsize(os.path.join(self._dir.name, 'graph_a.npy')))
+        cache.save('b', edges)
+        os.utime(os.path.join(self._dir.name, 'graph_a.npy'), (0, 0))
+        os.utime(os.path.join(self._dir.name, 'graph_b.npy'), (1, 1))
+        self.assertIsNotNone(cache.load('a'))
+        cache.save('c', edges)
+        self.assertIsNone(cache.load('b'))
+        self.assertIsNotNone(cache.load('a'))
+        self.assertIsNotNone(cache.load('c'))
+        info = cache.get_info()
+        self.assertEqual([info['hit'], info['miss'], info['evicted'], info['num_graph']]
+                         , [3, 1, 1, 2])
+
+
+def main():
+    """ unit test
+    """
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,374 @@
+#!/usr/bin/python
+
+""" The stuffs related to searching the shortest path in process.
+"""
+import heapq
+import math
+import unittest
+import numpy as np
+
+# Binary stream of the dijkstra program: int32 number of vertexes, number of edges and
+# target vertex, then an int32, int32, float32 record for each edge; the answer is the int32
+# number of vertexes of the shortest path, the int32 path and the float32 distance of each
+# vertex
+_STREAM_HEADER = np.dtype('<i4')
+_STREAM_EDGE = np.dtype([('idx_src', '<i4'), ('idx_dst', '<i4'), ('weight', '<f4')])
+_STREAM_DIST = np.dtype('<f4')
+
+def dijkstra(get_neighbours, source, target=None, get_heuristics=None):
+    """ Search the shortest paths from the source with a binary heap
+    The search stops when the target is settled, so only the vertexes closer than the
+    target are settled. With get_heuristics, the vertexes are settled by distance plus the
+    heuristic (A* search), which has to be consistent, never above the distance of an edge
+    plus the heuristic of its other end, for the distances to be the shortest ones.
+    Args:
+        get_neighbours: function(vertex, settled) returning the lists of neighbours and edge
+                        weights of a vertex, the settled vertexes may be left out
+        source: source vertex
+        target: target vertex, every reachable vertex is settled if None
+        get_heuristics: function(vertexes) returning the list of lower bounds of the
+                        distances from the vertexes to the target
+    Returns:
+        dists: dictionary of settled vertex versus distance, in settling order
+        prevs: dictionary of vertex versus previous vertex on its shortest path
+    Raises:
+        Native exceptions.
+    """
+    dists = {}
+    tentative = {source:0.0}
+    prevs = {source:None}
+    heuristics = {}
+    if get_heuristics is not None:
+        heuristics[source] = get_heuristics([source])[0]
+    heap = [(heuristics.get(source, 0.0), source)]
+    while heap:
+        _, vertex = heapq.heappop(heap)
+        if vertex in dists:
+            continue
+        dist = tentative[vertex]
+        dists[vertex] = dist
+        if vertex == target:
+            break
+        neighbours, weights = get_neighbours(vertex, dists)
+        if get_heuristics is not None:
+            fresh = [neighbour for neighbour in neighbours if neighbour not in heuristics]
+            if fresh:
+                heuristics.update(zip(fresh, get_heuristics(fresh)))
+        for neighbour, weight in zip(neighbours, weights):
+            dist_new = dist + weight
+            if dist_new < tentative.get(neighbour, math.inf):
+                tentative[neighbour] = dist_new
+                prevs[neighbour] = vertex
+                heapq.heappush(heap, (dist_new + heuristics.get(neighbour, 0.0), neighbour))
+    return dists, prevs
+
+def bidirectional_dijkstra(get_neighbours, source, target):
+    """ Search the shortest path of an undirected graph from both ends with binary heaps
+    The side with the smaller heap top is expanded first, and the search stops when the
+    tops of both heaps add up to the shortest distance through a vertex reached by both
+    sides, so each side only settles the vertexes closer than about half the distance.
+    Args:
+        get_neighbours: function(vertex, settled) as for dijkstra, the weights of both
+                        directions of an edge being the same
+        source: source vertex
+        target: target vertex
+    Returns:
+        dists: dictionary of vertex versus distance from the source, for the vertexes
+               settled from the source, in settling order, then the rest of the shortest path
+        prevs: dictionary of vertex versus previous vertex, the shortest path to the target
+               going through the ones settled from the target
+        dists_backward: dictionary of vertex versus distance to the target, for the
+                        vertexes settled from the target
+    Raises:
+        Native exceptions.
+    """
+    sides = [{'dists':{}, 'tentative':{source:0.0}, 'prevs':{source:None}, 'heap':[(0.0, source)]}
+             , {'dists':{}, 'tentative':{target:0.0}, 'prevs':{target:None}
+                , 'heap':[(0.0, target)]}]
+    best = [0.0 if source == target else math.inf, source]
+    while sides[0]['heap'] and sides[1]['heap']:
+        if sides[0]['heap'][0][0] + sides[1]['heap'][0][0] >= best[0]:
+            break
+        side, other = sides if sides[0]['heap'][0][0] <= sides[1]['heap'][0][0] else sides[::-1]
+        dist, vertex = heapq.heappop(side['heap'])
+        if vertex in side['dists']:
+            continue
+        side['dists'][vertex] = dist
+        neighbours, weights = get_neighbours(vertex, side['dists'])
+        for neighbour, weight in zip(neighbours, weights):
+            dist_new = dist + weight
+            if dist_new < side['tentative'].get(neighbour, math.inf):
+                side['tentative'][neighbour] = dist_new
+                side['prevs'][neighbour] = vertex
+                heapq.heappush(side['heap'], (dist_new, neighbour))
+                dist_meet = dist_new + other['tentative'].get(neighbour, math.inf)
+                if dist_meet < best[0]:
+                    best = [dist_meet, neighbour]
+    if best[0] == math.inf:
+        return sides[0]['dists'], sides[0]['prevs'], sides[1]['dists']
+    # the rest of the path, from the meeting vertex to the target
+    dists = sides[0]['dists']
+    prevs = sides[0]['prevs']
+    vertex = best[1]
+    dists.setdefault(vertex, sides[0]['tentative'][vertex])
+    while sides[1]['prevs'][vertex] is not None:
+        prevs[sides[1]['prevs'][vertex]] = vertex
+        vertex = sides[1]['prevs'][vertex]
+        dists.setdefault(vertex, best[0] - sides[1]['tentative'][vertex])
+    return dists, prevs, sides[1]['dists']
+
+def get_csr(idx_src, idx_dst, weights, num_vertex):
+    """ Store both directions of the edges as compressed sparse rows
+    Args:
+        idx_src, idx_dst: arrays of the numbers of the ends of the edges, from 0 to
+                          num_vertex - 1
+        weights: array of the edge weights
+        num_vertex: number of vertexes
+    Returns:
+        indptr: array of the positions of the neighbours of each vertex in indices
+        indices: array of the neighbours, sorted for each vertex
+        weights: array of the weights of the edges to the neighbours
+    Raises:
+        Native exceptions.
+    """
+    rows = np.concatenate([idx_src, idx_dst])
+    indices = np.concatenate([idx_dst, idx_src])
+    weights = np.concatenate([weights, weights])
+    # the pairs are distinct, so one key sorts them by row and then by neighbour
+    order = np.argsort(rows.astype(np.int64) * num_vertex + indices)
+    indptr = np.zeros(num_vertex + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=num_vertex), out=indptr[1:])
+    return indptr, indices[order], weights[order]
+
+def dijkstra_csr(indptr, indices, weights, source, target=None):
+    """ Search the shortest paths from the source over compressed sparse rows
+    Args:
+        indptr, indices, weights: compressed sparse rows given by get_csr
+        source: number of the source vertex
+        target: number of the target vertex, every reachable vertex is settled if None
+    Returns:
+        dists, prevs: see dijkstra
+    Raises:
+        Native exceptions.
+    """
+    return dijkstra(_get_csr_neighbours(indptr, indices, weights), source, target)
+
+def bidirectional_csr(indptr, indices, weights, source, target):
+    """ Search the shortest path from both ends over compressed sparse rows
+    Args:
+        indptr, indices, weights: compressed sparse rows given by get_csr
+        source: number of the source vertex
+        target: number of the target vertex
+    Returns:
+        dists, prevs, dists_backward: see bidirectional_dijkstra
+    Raises:
+        Native exceptions.
+    """
+    return bidirectional_dijkstra(_get_csr_neighbours(indptr, indices, weights), source, target)
+
+def _get_csr_neighbours(indptr, indices, weights):
+    indptr = indptr.tolist()
+    indices = indices.tolist()
+    weights = weights.tolist()
+    return lambda vertex, settled: (indices[indptr[vertex]:indptr[vertex+1]]
+                                    , weights[indptr[vertex]:indptr[vertex+1]])
+
+def get_path(prevs, target):
+    """ Return the shortest path to the target
+    Args:
+        prevs: dictionary of vertex versus previous vertex given by the search
+        target: target vertex
+    Returns:
+        path: list of vertexes from the source to the target
+    Raises:
+        Native exceptions.
+    """
+    path = [target]
+    while prevs[path[-1]] is not None:
+        path.append(prevs[path[-1]])
+    return path[::-1]
+
+def get_result_dict(idx_vertex, dists, prevs, target):
+    """ Return the result in the dictionary given by the dijk2 program
+    Args:
+        idx_vertex: list of vertexes, numbered by their position
+        dists: dictionary of vertex versus distance
+        prevs: dictionary of vertex versus previous vertex
+        target: target vertex
+    Returns:
+        result_dict: dictionary of shortest_weight, shortest_path (vertex numbers) and
+                     total_shortest_vertex_weight (for every vertex of idx_vertex), as strings,
+                     the shortest_weight being 'inf' and the shortest_path empty when the
+                     target is not reached
+    Raises:
+        Native exceptions.
+    """
+    if target not in dists:
+        print("Target %s not reached" % target)
+        return {'shortest_weight':'inf', 'shortest_path':[]
+                , 'total_shortest_vertex_weight':['%g' % dists.get(idx, math.inf)
+                                                  for idx in idx_vertex]}
+    num_vertex = {idx:num for num, idx in enumerate(idx_vertex)}
+    return {'shortest_weight':'%g' % dists[target]
+            , 'shortest_path':[str(num_vertex[idx]) for idx in get_path(prevs, target)]
+            , 'total_shortest_vertex_weight':['%g' % dists.get(idx, math.inf)
+                                              for idx in idx_vertex]}
+
+def pack_edges(num_vertex, target, idx_src, idx_dst, weights):
+    """ Return the binary stream of a graph for the dijkstra program
+    Args:
+        num_vertex: number of vertexes
+        target: number of the target vertex
+        idx_src, idx_dst: arrays of the numbers of the ends of the edges
+        weights: array of the edge weights
+    Returns:
+        data: bytes of the stream
+    Raises:
+        Native exceptions.
+    """
+    records = np.empty(len(weights), dtype=_STREAM_EDGE)
+    records['idx_src'] = idx_src
+    records['idx_dst'] = idx_dst
+    records['weight'] = weights
+    return (np.array([num_vertex, len(records), target], dtype=_STREAM_HEADER).tobytes()
+            + records.tobytes())
+
+def unpack_edges(data):
+    """ Return the graph of a binary stream given by pack_edges
+    Args:
+        data: bytes of the stream
+    Returns:
+        num_vertex, target, idx_src, idx_dst, weights: see pack_edges
+    Raises:
+        Native exceptions.
+    """
+    num_vertex, num_edge, target = np.frombuffer(data, dtype=_STREAM_HEADER, count=3).tolist()
+    records = np.frombuffer(data, dtype=_STREAM_EDGE, count=num_edge
+                            , offset=3 * _STREAM_HEADER.itemsize)
+    return num_vertex, target, records['idx_src'], records['idx_dst'], records['weight']
+
+def pack_result(path, dists):
+    """ Return the binary stream of a result of the dijkstra program
+    Args:
+        path: list of the vertex numbers from the source to the target
+        dists: list of the distance of each vertex, math.inf if not reached
+    Returns:
+        data: bytes of the stream
+    Raises:
+        Native exceptions.
+    """
+    return (np.array([len(path)] + list(path), dtype=_STREAM_HEADER).tobytes()
+            + np.array(dists, dtype=_STREAM_DIST).tobytes())
+
+def unpack_result(data):
+    """ Return the result of a binary stream given by pack_result
+    Args:
+        data: bytes of the stream
+    Returns:
+        result_dict: dictionary of the result as given by the dijk2 program
+    Raises:
+        Native exceptions.
+    """
+    num_path = int(np.frombuffer(data, dtype=_STREAM_HEADER, count=1)[0])
+    path = np.frombuffer(data, dtype=_STREAM_HEADER, count=num_path
+                         , offset=_STREAM_HEADER.itemsize).tolist()
+    dists = np.frombuffer(data, dtype=_STREAM_DIST
+                          , offset=(num_path + 1) * _STREAM_HEADER.itemsize).tolist()
+    return {'shortest_weight':'%g' % dists[path[-1]]
+            , 'shortest_path':[str(num) for num in path]
+            , 'total_shortest_vertex_weight':['%g' % dist for dist in dists]}
+
+
+class GraphSearchTest(unittest.TestCase):
+    """ Test with shortest paths of a small graph
+    """
+    def test_mod_with_dijkstra(self):
+        """ Test if the shortest path and distances are found and formatted as dijk2
+        """
+        edges = {10:[(11, 1.0), (12, 4.0)], 11:[(10, 1.0), (12, 1.5), (13, 5.0)]
+                 , 12:[(10, 4.0), (11, 1.5), (13, 1.0)], 13:[(11, 5.0), (12, 1.0)], 14:[]}
+        get_neighbours = lambda vertex, settled: ([elem[0] for elem in edges[vertex]]
+                                                  , [elem[1] for elem in edges[vertex]])
+        dists, prevs = dijkstra(get_neighbours, 10)
+        self.assertEqual(dists, {10:0.0, 11:1.0, 12:2.5, 13:3.5})
+        self.assertEqual(get_path(prevs, 13), [10, 11, 12, 13])
+        dists, prevs = dijkstra(get_neighbours, 10, 12)
+        self.assertEqual(list(dists), [10, 11, 12])
+        self.assertEqual(get_result_dict([10, 12, 11, 13], dists, prevs, 12)
+                         , {'shortest_weight':'2.5', 'shortest_path':['0', '2', '1']
+                            , 'total_shortest_vertex_weight':['0', '2.5', '1', 'inf']})
+        dists, prevs = dijkstra(get_neighbours, 10, 14)
+        self.assertEqual(get_result_dict([10, 14], dists, prevs, 14)
+                         , {'shortest_weight':'inf', 'shortest_path':[]
+                            , 'total_shortest_vertex_weight':['0', 'inf']})
+
+    def test_mod_with_astar(self):
+        """ Test if the A* search finds the same distance and settles fewer vertexes
+        """
+        # vertexes on a line, 1 apart, a heuristic of the distance to the target
+        edges = {vertex:[(vertex - 1, 1.0), (vertex + 1, 1.0)] for vertex in range(-10, 11)}
+        get_neighbours = lambda vertex, settled: ([elem[0] for elem in edges.get(vertex, [])]
+                                                  , [elem[1] for elem in edges.get(vertex, [])])
+        dists, _ = dijkstra(get_neighbours, 0, 5)
+        dists_astar, prevs = dijkstra(get_neighbours, 0, 5
+                                      , lambda vertexes: [abs(5 - elem) for elem in vertexes])
+        self.assertEqual(dists_astar[5], dists[5])
+        self.assertEqual(get_path(prevs, 5), [0, 1, 2, 3, 4, 5])
+        self.assertEqual(len(dists_astar), 6)
+        self.assertGreater(len(dists), 6)
+
+    def test_mod_with_bidirectional(self):
+        """ Test if the search from both ends finds the path and distances of dijkstra
+        """
+        edges = {10:[(11, 1.0), (12, 4.0)], 11:[(10, 1.0), (12, 1.5), (13, 5.0)]
+                 , 12:[(10, 4.0), (11, 1.5), (13, 1.0)], 13:[(11, 5.0), (12, 1.0)], 14:[]}
+        get_neighbours = lambda vertex, settled: ([elem[0] for elem in edges[vertex]]
+                                                  , [elem[1] for elem in edges[vertex]])
+        dists, prevs, dists_backward = bidirectional_dijkstra(get_neighbours, 10, 13)
+        self.assertEqual(dists[13], 3.5)
+        self.assertEqual(get_path(prevs, 13), [10, 11, 12, 13])
+        self.assertEqual([dists[vertex] for vertex in get_path(prevs, 13)], [0.0, 1.0, 2.5, 3.5])
+        self.assertEqual(dists_backward[13], 0.0)
+        self.assertNotIn(14, dists)
+        self.assertNotIn(13, bidirectional_dijkstra(get_neighbours, 10, 14)[0])
+        # vertexes on a line, each side settles about half of them
+        indptr, indices, weights = get_csr(np.arange(20), np.arange(1, 21), np.ones(20), 21)
+        dists, prevs, dists_backward = bidirectional_csr(indptr, indices, weights, 0, 20)
+        self.assertEqual(dists[20], 20.0)
+        self.assertEqual(get_path(prevs, 20), list(range(21)))
+        self.assertLessEqual(len(dists_backward), 12)
+
+    def test_mod_with_csr(self):
+        """ Test if the search over compressed sparse rows settles the same distances
+        """
+        indptr, indices, weights = get_csr(np.array([0, 1, 0, 2, 1]), np.array([1, 2, 2, 3, 3])
+                                           , np.array([1.0, 1.5, 4.0, 1.0, 5.0]), 5)
+        self.assertEqual(indptr.tolist(), [0, 2, 5, 8, 10, 10])
+        self.assertEqual(indices.tolist(), [1, 2, 0, 2, 3, 0, 1, 3, 1, 2])
+        dists, prevs = dijkstra_csr(indptr, indices, weights, 0)
+        self.assertEqual(dists, {0:0.0, 1:1.0, 2:2.5, 3:3.5})
+        self.assertEqual(get_path(prevs, 3), [0, 1, 2, 3])
+
+    def test_mod_with_stream(self):
+        """ Test if the graph and the result go through the binary streams
+        """
+        num_vertex, target, idx_src, idx_dst, weights = unpack_edges(
+            pack_edges(5, 3, np.array([0, 1, 0, 2, 1]), np.array([1, 2, 2, 3, 3])
+                       , np.array([1.0, 1.5, 4.0, 1.0, 5.0])))
+        self.assertEqual([num_vertex, target], [5, 3])
+        self.assertEqual(idx_dst.tolist(), [1, 2, 2, 3, 3])
+        dists, prevs = dijkstra_csr(*get_csr(idx_src, idx_dst, weights, num_vertex), 0)
+        result_dict = unpack_result(pack_result(get_path(prevs, target)
+                                                , [dists.get(num, math.inf)
+                                                   for num in range(num_vertex)]))
+        self.assertEqual(result_dict, get_result_dict(range(num_vertex), dists, prevs, target))
+
+
+def main():
+    """ unit test
+    """
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -13,6 +13,7 @@ import os
 import subprocess
 import sys
 import time
+import numpy as np
 
 DEBUG_FILE = './_debug.log'
 
@@ -42,6 +43,18 @@ def run_cmd_get_result(cmd):
 
     return ret
 
+def run_cmd_pipe(cmds, data):
+    """ Run a command with data piped to its stdin and return its stdout.
+    Args:
+        cmds: list of the program and its arguments
+        data: bytes written to the stdin
+    Returns:
+        The bytes of the stdout.
+    Raises:
+        Native exceptions.
+    """
+    return subprocess.run(cmds, input=data, stdout=subprocess.PIPE, check=True).stdout
+
 def check_if_contain_in_list(lst, item):
     """  Efficient `item in lst` for sorted lists
     Args:
@@ -214,6 +227,56 @@ def get_distance_in_earth(point1, point2, shiftlo, radius):
 
     return dist
 
+def _map_unique(values, func):
+    uniques, inverse = np.unique(values, return_inverse=True)
+    return np.array([func(val) for val in uniques.tolist()])[inverse]
+
+def get_cartesians_in_earth(points, shiftlo, radius):
+    """
+    Calculate the cartesian coordinates used by get_distance_in_earth,
+    for an array of points.
+    The trigonometric functions are evaluated by math once per distinct
+    latitude and longitude, so the distances between the coordinates are
+    the same as get_distance_in_earth.
+    Args:
+        points:         array of coordinates, [[lon, lat, dep], ...]
+        shiftlo:        the value to shift at longitude
+        radius:         the altitude, the average earth radius
+    Returns:
+        coors:          array of [xx, yy, zz]
+    Raises:
+        Native exceptions.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    r2d = 90.0 / math.asin(1.0)
+    sin_ts = _map_unique(points[:, 1]
+                         , lambda lat: math.sin((90.00 - _geog_to_geoc(lat)) / r2d))
+    cos_ts = _map_unique(points[:, 1]
+                         , lambda lat: math.cos((90.00 - _geog_to_geoc(lat)) / r2d))
+    cos_lo = _map_unique(points[:, 0], lambda lon: math.cos((lon-shiftlo) / r2d))
+    sin_lo = _map_unique(points[:, 0], lambda lon: math.sin((lon-shiftlo) / r2d))
+    return np.column_stack([(radius - points[:, 2]) * sin_ts * cos_lo
+                            , (radius - points[:, 2]) * sin_ts * sin_lo
+                            , (radius - points[:, 2]) * cos_ts])
+
+def get_distances_in_earth(coors1, coors2):
+    """
+    Calculate the distances between two arrays of cartesian coordinates
+    given by get_cartesians_in_earth.
+    Args:
+        coors1:         array of [xx, yy, zz] of the first points
+        coors2:         array of [xx, yy, zz] of the second points
+    Returns:
+        distances:      array of the distances in KM
+    Raises:
+        Native exceptions.
+    """
+    # float_power calls pow() like the float ** of get_distance_in_earth,
+    # while ** 2 of NumPy squares by multiplication, which may round differently
+    return np.sqrt(np.float_power(coors2[..., 0] - coors1[..., 0], 2)
+                   + np.float_power(coors2[..., 1] - coors1[..., 1], 2)
+                   + np.float_power(coors2[..., 2] - coors1[..., 2], 2))
+
 
 
 def get_time_string(seconds):
@@ -272,7 +335,7 @@ def simple_log(log_path, msg, print_console=False):
         Native exceptions.
     """
     if print_console:
-        print msg
+        print(msg)
 
     parent_dir = os.path.dirname(log_path)
     if not os.path.exists(parent_dir):
@@ -433,7 +496,7 @@ def write_dict_json(in_dict, json_filepath, to_console=False):
         writefile.write(dict_json)
 
     if to_console:
-        print dict_json
+        print(dict_json)
 
     return dict_json
 
@@ -495,7 +558,7 @@ def main():
     ]
 
     #exp_vals = [1.49577, 0.752815, 0.752072]
-    print '---> check with Geo program '
+    print('---> check with Geo program ')
     #for idx, pair in enumerate(test_point_pairs):
     for pair in test_point_pairs:
         dist = get_distance_in_earth(pair[0], pair[1], radius)
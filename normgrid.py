@@ -2,7 +2,13 @@
 
 """ The stuffs related to shortest path.
 """
-from decimal import Decimal, ROUND_HALF_UP, getcontext
+import math
+import unittest
+from decimal import Decimal, ROUND_HALF_UP, localcontext
+import numpy as np
+
+_POW10 = np.array([float(10 ** k) for k in range(23)])
+_POW10_INT = np.array([10 ** k for k in range(11)], dtype=np.int64)
 
 class NormGridSingleton(type):
     """ Singleton class of NormGrid
@@ -21,6 +27,80 @@ class NormGrid(metaclass=NormGridSingleton):
     def __init__(self):
         self._grid_gap = [0.01, 0.01, 1]
         self._div = 4
+        self._rounding = 'decimal'
+    def _myround_lattice(self, val, div, gap):
+        """ Round to the grid like Decimal(repr(val)) with ROUND_HALF_UP, by integer lattice
+        The magnitude takes the lattice number n when it lies in
+        [fl((2n-1)/(2*unit)), fl((2n+1)/(2*unit))), fl() being the float nearest to the
+        decimal half point, so the float estimate is corrected by one step at most.
+        """
+        unit = int(div / gap)
+        mag = abs(val)
+        num = int(mag * unit + 0.5)
+        if mag < (2 * num - 1) / (2 * unit):
+            num -= 1
+        elif mag >= (2 * num + 1) / (2 * unit):
+            num += 1
+        return math.copysign(num / unit, val)
+    def _round_prec(self, numer, denom):
+        """ Round numer / denom to 12 significant digits (half even) as the Decimal context
+        Returns:
+            (num, scale): the rounded value is num / 10**scale
+        """
+        if numer == 0:
+            return 0, 0
+        mag = abs(numer)
+        scale = 11 - math.floor(math.log10(mag / denom))
+        while True:
+            den = denom if scale >= 0 else denom * 10**-scale
+            quot, rem = divmod(mag * 10**scale if scale >= 0 else mag, den)
+            if quot < 10**11:
+                scale += 1
+            elif quot >= 10**12:
+                scale -= 1
+            else:
+                break
+        if 2 * rem > den or (2 * rem == den and quot % 2 == 1):
+            quot += 1
+        return (quot if numer > 0 else -quot), scale
+    def _diff_prec(self, val, offset):
+        """ float(Decimal(val) - Decimal(offset)) under 12 digits precision by integers
+        """
+        numer, denom = val.as_integer_ratio()
+        num, scale = self._round_prec(numer - offset * denom, denom)
+        return num / 10**scale if scale >= 0 else float(num * 10**-scale)
+    def _recover_lattice(self, idx_loc, stage):
+        """ Same as the Decimal arithmetic of recover_norm_loc, by integer lattice
+        The lattice value is taken directly whenever the Decimal arithmetic lands on it,
+        the other cases are replayed exactly by integers.
+        """
+        num_lon = self.get_num_lon_index(stage)
+        num_lat = self.get_num_lat_index(stage)
+        units = [int(self.get_div(stage) / gap) for gap in self._grid_gap]
+        idx_lon = idx_loc % (num_lon * num_lat) % num_lon
+        if abs(idx_lon - 180 * units[0]) * 10 >= units[0]:
+            lon = (idx_lon - 180 * units[0]) / units[0]
+        else:
+            lon = self._diff_prec(idx_lon * self._grid_gap[0] / self.get_div(stage), 180)
+        idx_rest = idx_loc - int((lon + 180) * self.get_div(stage) / self._grid_gap[0])
+        idx_lat = idx_rest % (num_lon * num_lat)
+        if idx_lat % num_lon == 0:
+            lat = (idx_lat // num_lon - 90 * units[1]) / units[1]
+        else:
+            numer, denom = (idx_lat * self._grid_gap[1]).as_integer_ratio()
+            num, scale = self._round_prec(numer, denom * self.get_div(stage) * num_lon)
+            if scale >= 0:
+                num, scale = self._round_prec(num - 90 * 10**scale, 10**scale)
+            else:
+                num, scale = self._round_prec(num * 10**-scale - 90, 1)
+            lat = num / 10**scale if scale >= 0 else float(num * 10**-scale)
+        idx_rest = idx_rest - int((lat + 90) * self.get_div(stage) / self._grid_gap[1] * num_lon)
+        if idx_rest % (num_lon * num_lat) == 0:
+            dep = (idx_rest // (num_lon * num_lat) - 10 * units[2]) / units[2]
+        else:
+            dep = self._diff_prec(idx_rest * self._grid_gap[2]
+                                  / (self.get_div(stage) * num_lon * num_lat), 10)
+        return [lon, lat, dep]
     def _myround_lon(self, lon, div):
         unit = int(div / self._grid_gap[0])
         return float((lon*unit).quantize(Decimal('1'), rounding=ROUND_HALF_UP)/unit)
@@ -30,6 +110,28 @@ class NormGrid(metaclass=NormGridSingleton):
     def _myround_dep(self, dep, div):
         unit = int(div / self._grid_gap[2])
         return float((dep*unit).quantize(Decimal('1'), rounding=ROUND_HALF_UP)/unit)
+    def set_rounding(self, rounding):
+        """ Select the rounding engine of normalization
+        Args:
+            rounding: 'decimal' for Decimal quantization, 'lattice' for integer lattice
+                      arithmetic with the same results
+        Returns:
+        Raises:
+            Native exceptions.
+        """
+        if rounding not in ('decimal', 'lattice'):
+            print("Error in rounding selection")
+        else:
+            self._rounding = rounding
+    def get_rounding(self):
+        """ Get the current rounding engine
+        Args:
+        Returns:
+            rounding: 'decimal' or 'lattice'
+        Raises:
+            Native exceptions.
+        """
+        return self._rounding
     def get_grid_gap(self, stage):
         """ Get the current value of grid gap
         Args:
@@ -94,6 +196,9 @@ class NormGrid(metaclass=NormGridSingleton):
             print("Out of range")
             return None
 
+        if self._rounding == 'lattice':
+            return [self._myround_lattice(loc[idx], self.get_div(stage), self._grid_gap[idx])
+                    for idx in range(3)]
         loc_norm = []
         loc_norm.append(self._myround_lon(Decimal(repr(loc[0])), self.get_div(stage)))
         loc_norm.append(self._myround_lat(Decimal(repr(loc[1])), self.get_div(stage)))
@@ -133,8 +238,13 @@ class NormGrid(metaclass=NormGridSingleton):
         Raises:
             Native exceptions.
         """
+        if self._rounding == 'lattice':
+            return self._recover_lattice(idx_loc, stage)
+        with localcontext() as ctx:
+            ctx.prec = 12
+            return self._recover_decimal(idx_loc, stage)
+    def _recover_decimal(self, idx_loc, stage):
         loc = []
-        getcontext().prec = 12
         num_lon = self.get_num_lon_index(stage)
         num_lat = self.get_num_lat_index(stage)
         lon = float(Decimal((idx_loc % (num_lon * num_lat)) % num_lon * self._grid_gap[0]
@@ -152,6 +262,332 @@ class NormGrid(metaclass=NormGridSingleton):
                     - Decimal(10))
         loc.append(dep)
         return loc
+    def get_lattice_coors(self, idx_locs, stage):
+        """ Get the lattice coordinates of an array of indexes
+        Args:
+            idx_locs: array of indexes
+            stage: stage number
+        Returns:
+            coors: array of [lon, lat, dep] grid numbers (int64), shape (n, 3)
+        Raises:
+            Native exceptions.
+        """
+        idx_locs = np.asarray(idx_locs, dtype=np.int64).reshape(-1)
+        num_lon = self.get_num_lon_index(stage)
+        num_lat = self.get_num_lat_index(stage)
+        return np.column_stack([idx_locs % num_lon, idx_locs // num_lon % num_lat
+                                , idx_locs // (num_lon * num_lat)])
+    def _myround_array(self, values, div, gap):
+        """ Round an array to the grid like Decimal(repr(x)) with ROUND_HALF_UP
+        The magnitude of x takes the lattice number n when it lies in
+        [fl((2n-1)/(2*unit)), fl((2n+1)/(2*unit))), fl() being the float nearest to the
+        decimal half point, so the float estimate is corrected by one step at most.
+        Args:
+            values: array of coordinates
+            div: divisor of the stage
+            gap: grid gap of the coordinate
+        Returns:
+            array: normalized coordinates
+        Raises:
+            Native exceptions.
+        """
+        unit = int(div / gap)
+        mag = np.abs(values)
+        num = np.floor(mag * unit + 0.5)
+        num -= mag < (2 * num - 1) / (2 * unit)
+        num += mag >= (2 * num + 1) / (2 * unit)
+        return np.copysign(num, values) / unit
+    def get_norm_locs(self, locs, stage):
+        """ Normalize an array of locations to grid points
+        Args:
+            locs: array of unnormalized points, shape (n, 3)
+            stage: stage number
+        Returns:
+            locs: array of normalized locations, shape (n, 3)
+        Raises:
+            Native exceptions.
+        """
+        locs = np.asarray(locs, dtype=np.float64).reshape(-1, 3)
+        if (np.any(np.abs(locs[:, 0]) > 180) or np.any(np.abs(locs[:, 1]) > 90)
+                or np.any(locs[:, 2] < -10)):
+            print("Out of range")
+            return None
+
+        locs_norm = np.empty_like(locs)
+        for axis in range(3):
+            locs_norm[:, axis] = self._myround_array(locs[:, axis], self.get_div(stage)
+                                                     , self._grid_gap[axis])
+        return locs_norm
+    def get_norm_indices(self, locs, stage):
+        """ Get indexes of normalized grid points in batch
+        Same result as get_norm_index() for every point
+        Args:
+            locs: array of unnormalized points, shape (n, 3)
+            stage: stage number
+        Returns:
+            indexes: array of normalized indexes (int64)
+        Raises:
+            Native exceptions.
+        """
+        locs_norm = self.get_norm_locs(locs, stage)
+        if locs_norm is None:
+            return None
+        num_lon = self.get_num_lon_index(stage)
+        num_lat = self.get_num_lat_index(stage)
+        return ((locs_norm[:, 2] + 10) * self.get_div(stage) / self._grid_gap[2] * num_lon * num_lat
+                + (locs_norm[:, 1] + 90) * self.get_div(stage) / self._grid_gap[1] * num_lon
+                + (locs_norm[:, 0] + 180) * self.get_div(stage) / self._grid_gap[0]
+               ).astype(np.int64)
+    def _round_prec_array(self, numer, den):
+        """ Round numer / den to 12 significant digits (half even) like the Decimal context
+        Args:
+            numer: array of exact float numerators
+            den: positive integer denominator
+        Returns:
+            (num, scale, exact): value is num / 10**scale, exact marks the rows
+            whose rounding is settled without a doubt
+        Raises:
+            Native exceptions.
+        """
+        mag = np.abs(numer / den)
+        nonzero = mag > 0
+        exp10 = np.floor(np.log10(np.where(nonzero, mag, 1.0))).astype(np.int64)
+        scale = np.clip(11 - exp10, 0, len(_POW10) - 1)
+        scaled = numer * _POW10[scale] / den
+        num = np.rint(scaled)
+        exact = ~nonzero | ((scale == 11 - exp10)
+                            & (np.abs(scaled) >= 1e11) & (np.abs(scaled) < 1e12)
+                            & (np.abs(scaled - np.floor(scaled) - 0.5) > 1e-3))
+        return num, scale, exact
+    def _diff_prec_array(self, values, offset):
+        """ Compute float(Decimal(x) - Decimal(offset)) under 12 digits precision
+        Args:
+            values: array of floats
+            offset: integer to subtract
+        Returns:
+            (diff, exact): result and the rows settled without a doubt
+        Raises:
+            Native exceptions.
+        """
+        diff = values - offset
+        back = diff - values
+        exact = (values - (diff - back)) + (-offset - back) == 0
+        num, scale, exact_round = self._round_prec_array(diff, 1)
+        return num / _POW10[scale], exact & exact_round
+    def recover_norm_locs(self, idx_locs, stage):
+        """ Get the normalized locations from an array of indexes
+        Same result as recover_norm_loc() for every index: its float and 12 digits Decimal
+        arithmetic is replayed by array operations, and the few rows which cannot be
+        settled that way (near a rounding tie, far south) are passed to recover_norm_loc().
+        Args:
+            idx_locs: array of indexes
+            stage: stage number
+        Returns:
+            locs: array of normalized locations, shape (n, 3)
+        Raises:
+            Native exceptions.
+        """
+        idx_locs = np.asarray(idx_locs, dtype=np.int64).reshape(-1)
+        num_lon = self.get_num_lon_index(stage)
+        num_lat = self.get_num_lat_index(stage)
+        locs = np.empty((len(idx_locs), 3))
+
+        locs[:, 0], exact = self._diff_prec_array(idx_locs % (num_lon * num_lat) % num_lon
+                                                  * self._grid_gap[0] / self.get_div(stage), 180)
+        idx_rest = idx_locs - ((locs[:, 0] + 180) * self.get_div(stage)
+                               / self._grid_gap[0]).astype(np.int64)
+        num, scale, exact_lat = self._round_prec_array(idx_rest % (num_lon * num_lat)
+                                                       * self._grid_gap[1]
+                                                       , self.get_div(stage) * num_lon)
+        exact &= exact_lat & (scale <= 10)
+        scale = np.minimum(scale, 10)
+        locs[:, 1] = (num.astype(np.int64) - 90 * _POW10_INT[scale]) / _POW10[scale]
+        idx_rest = idx_rest - ((locs[:, 1] + 90) * self.get_div(stage) / self._grid_gap[1]
+                               * num_lon).astype(np.int64)
+        locs[:, 2], exact_dep = self._diff_prec_array(idx_rest * self._grid_gap[2]
+                                                      / (self.get_div(stage) * num_lon * num_lat)
+                                                      , 10)
+        exact &= exact_dep
+
+        for row in np.flatnonzero(~exact):
+            locs[row] = self.recover_norm_loc(int(idx_locs[row]), stage)
+        return locs
+
+
+class LocalGrid(object):
+    """ Dense local indexes of the normalized grid points inside a bounding box
+    Global index = dep_idx * num_lon * num_lat + lat_idx * num_lon + lon_idx, and the
+    local id runs in the same order over the box, from 0 to get_size() - 1.
+    Public Methods:
+        get_size: number of grid points in the box
+        get_shape: number of grid points along lon, lat and dep
+        get_local_id / get_local_ids: global index to local id
+        get_global_id / get_global_ids: local id to global index
+    """
+    def __init__(self, loc_min, loc_max, stage, idx_bound=None):
+        """ Build from the lowermost and uppermost corners of the box
+        Args:
+            loc_min: lowermost coordinate of the box
+            loc_max: uppermost coordinate of the box
+            stage: stage number
+            idx_bound: [idx_min, idx_max], normalized indexes of the corners to use
+                       instead of loc_min and loc_max
+        """
+        norm = NormGrid()
+        self._stage = stage
+        self._num_lon = norm.get_num_lon_index(stage)
+        self._num_lat = norm.get_num_lat_index(stage)
+        if idx_bound is None:
+            idx_bound = [norm.get_norm_index(loc_min, stage), norm.get_norm_index(loc_max, stage)]
+        self._origin = self._split(idx_bound[0])
+        corner = self._split(idx_bound[1])
+        self._shape = [max(upper - lower + 1, 0) for lower, upper in zip(self._origin, corner)]
+
+    def _split(self, idx):
+        return [idx % self._num_lon, idx // self._num_lon % self._num_lat
+                , idx // (self._num_lon * self._num_lat)]
+
+    def get_stage(self):
+        """ Return the stage of the grid
+        Args:
+        Returns:
+            stage: stage number
+        Raises:
+            Native exceptions.
+        """
+        return self._stage
+
+    def get_shape(self):
+        """ Return the number of grid points along each axis
+        Args:
+        Returns:
+            list: [lon, lat, dep] numbers of grid points
+        Raises:
+            Native exceptions.
+        """
+        return list(self._shape)
+
+    def get_size(self):
+        """ Return the number of grid points in the box
+        Args:
+        Returns:
+            size: number of local ids
+        Raises:
+            Native exceptions.
+        """
+        return self._shape[0] * self._shape[1] * self._shape[2]
+
+    def get_local_id(self, idx):
+        """ Get the local id of a global index
+        Args:
+            idx: normalized global index
+        Returns:
+            local id, or None if the point is outside the box
+        Raises:
+            Native exceptions.
+        """
+        coor = [elem - origin for elem, origin in zip(self._split(idx), self._origin)]
+        for elem, num in zip(coor, self._shape):
+            if elem < 0 or elem >= num:
+                return None
+        return (coor[2] * self._shape[1] + coor[1]) * self._shape[0] + coor[0]
+
+    def get_global_id(self, local_id):
+        """ Get the global index of a local id
+        Args:
+            local_id: local id in the box
+        Returns:
+            normalized global index
+        Raises:
+            Native exceptions.
+        """
+        return ((local_id // (self._shape[0] * self._shape[1]) + self._origin[2])
+                * self._num_lon * self._num_lat
+                + (local_id // self._shape[0] % self._shape[1] + self._origin[1]) * self._num_lon
+                + local_id % self._shape[0] + self._origin[0])
+
+    def get_local_ids(self, indexes):
+        """ Get the local ids of an array of global indexes
+        Args:
+            indexes: array of normalized global indexes
+        Returns:
+            array: local ids (int64), -1 for the points outside the box
+        Raises:
+            Native exceptions.
+        """
+        indexes = np.asarray(indexes, dtype=np.int64)
+        coor_lon = indexes % self._num_lon - self._origin[0]
+        coor_lat = indexes // self._num_lon % self._num_lat - self._origin[1]
+        coor_dep = indexes // (self._num_lon * self._num_lat) - self._origin[2]
+        inside = ((coor_lon >= 0) & (coor_lon < self._shape[0]) & (coor_lat >= 0)
+                  & (coor_lat < self._shape[1]) & (coor_dep >= 0) & (coor_dep < self._shape[2]))
+        return np.where(inside, (coor_dep * self._shape[1] + coor_lat) * self._shape[0] + coor_lon
+                        , -1)
+
+    def get_global_ids(self, local_ids=None):
+        """ Get the global indexes of an array of local ids
+        Args:
+            local_ids: array of local ids, all the grid points of the box if None
+        Returns:
+            array: normalized global indexes (int64)
+        Raises:
+            Native exceptions.
+        """
+        if local_ids is None:
+            local_ids = np.arange(self.get_size(), dtype=np.int64)
+        local_ids = np.asarray(local_ids, dtype=np.int64)
+        return ((local_ids // (self._shape[0] * self._shape[1]) + self._origin[2])
+                * (self._num_lon * self._num_lat)
+                + (local_ids // self._shape[0] % self._shape[1] + self._origin[1]) * self._num_lon
+                + local_ids % self._shape[0] + self._origin[0])
+
+
+
+def get_curve_keys(coors, curve):
+    """ Get the positions of lattice points along a space filling curve
+    Points close in space get close keys, so sorting by the keys numbers the vertexes
+    of a box in a cache friendly order.
+    Args:
+        coors: array of non-negative lattice coordinates, shape (n, 3)
+        curve: 'morton' (Z-order) or 'hilbert'
+    Returns:
+        keys: array of curve positions (int64)
+    Raises:
+        Native exceptions.
+    """
+    coors = np.asarray(coors, dtype=np.int64).reshape(-1, 3)
+    bits = max(int(coors.max(initial=0)).bit_length(), 1)
+    axes = [coors[:, axis].copy() for axis in range(3)]
+    if curve == 'hilbert':
+        # Skilling's axes to transpose conversion, vectorized over the points
+        level = 1 << (bits - 1)
+        while level > 1:
+            low = level - 1
+            for axis in range(3):
+                flip = (axes[axis] & level) != 0
+                swap = np.where(flip, 0, (axes[0] ^ axes[axis]) & low)
+                axes[0] = np.where(flip, axes[0] ^ low, axes[0] ^ swap)
+                if axis > 0:
+                    axes[axis] = axes[axis] ^ swap
+            level >>= 1
+        for axis in range(1, 3):
+            axes[axis] ^= axes[axis - 1]
+        gray = np.zeros_like(axes[0])
+        level = 1 << (bits - 1)
+        while level > 1:
+            gray = np.where((axes[2] & level) != 0, gray ^ (level - 1), gray)
+            level >>= 1
+        for axis in range(3):
+            axes[axis] ^= gray
+    elif curve != 'morton':
+        print("Error in curve selection")
+        return None
+    keys = np.zeros(len(coors), dtype=np.int64)
+    for bit in range(bits - 1, -1, -1):
+        for axis in range(3):
+            keys = (keys << 1) | ((axes[axis] >> bit) & 1)
+    return keys
+
 
 def drange(start, end, jump):
     """ Get the float range for testing
@@ -168,6 +604,130 @@ def drange(start, end, jump):
         yield float(start)
         start += Decimal(jump)
 
+
+def _test_mod_recover_keys(norm, bounds, stage):
+    """ Return an index of every key of the recovery of the nodes of a box
+    Args:
+        norm: NormGrid with the 'decimal' rounding
+        bounds: [[lon_min, lon_max], [lat_min, lat_max], [dep_min, dep_max]] of the box
+        stage: stage number
+    Returns:
+        idx_locs: array of indexes
+    Raises:
+        Native exceptions.
+    """
+    num_lon = norm.get_num_lon_index(stage)
+    num_plane = num_lon * norm.get_num_lat_index(stage)
+    div = norm.get_div(stage)
+    gap = norm.get_grid_gap(1)
+    lower, upper = [norm.get_lattice_coors([norm.get_norm_index(loc, stage)], stage)[0]
+                    for loc in zip(*bounds)]
+    # every lon index, and one lon index of each rest it leaves
+    idx_locs = np.arange(lower[0], upper[0] + 1) + lower[1] * num_lon + lower[2] * num_plane
+    locs = norm.recover_norm_locs(idx_locs, stage)
+    rests = idx_locs - ((locs[:, 0] + 180) * div / gap[0]).astype(np.int64)
+    idx_lons = {rest:idx for rest, idx in zip((rests - idx_locs + idx_locs % num_lon).tolist()
+                                               , (idx_locs % num_lon).tolist())}
+    # every lat index with each lon rest, and one of each rest they leave
+    idx_lats = (np.arange(lower[1], upper[1] + 1)[:, None] * num_lon
+                + np.array(list(idx_lons.values()))[None, :]).ravel() + lower[2] * num_plane
+    locs = norm.recover_norm_locs(idx_lats, stage)
+    rests = (idx_lats - ((locs[:, 0] + 180) * div / gap[0]).astype(np.int64)
+             - ((locs[:, 1] + 90) * div / gap[1] * num_lon).astype(np.int64))
+    idx_rests = dict(zip((rests - lower[2] * num_plane).tolist()
+                         , (idx_lats - lower[2] * num_plane).tolist()))
+    # every dep index with each lat rest
+    idx_deps = (np.arange(lower[2], upper[2] + 1)[:, None] * num_plane
+                + np.array(list(idx_rests.values()))[None, :]).ravel()
+    return np.unique(np.concatenate([idx_locs, idx_lats, idx_deps]))
+
+class NormGridTest(unittest.TestCase):
+    """ Test with batch indexing against the single point methods
+    """
+    def test_mod_with_batch_index(self):
+        """ Test if batch indexes are the same as get_norm_index
+        """
+        norm = NormGrid()
+        locs = [[121.740700, 24.428, -0.113000], [121.860000, 24.79, 7.500000]
+                , [121.00125, 23.005, 0.5], [121.00375, 23.015, 1.125], [-120.005, -23.005, 0]
+                , [-180, -90, -10], [180, 90, 10], [121.004999, 23.0149999, 2.4999]]
+        for stage in [1, 2]:
+            indexes = norm.get_norm_indices(locs, stage)
+            self.assertEqual(indexes.tolist(), [norm.get_norm_index(loc, stage) for loc in locs])
+            self.assertEqual(norm.recover_norm_locs(indexes, stage).tolist()
+                             , [norm.recover_norm_loc(idx, stage) for idx in indexes.tolist()])
+
+    def test_mod_with_batch_recover(self):
+        """ Test if batch recovered locations are the same as recover_norm_loc
+        """
+        norm = NormGrid()
+        for stage in [1, 2]:
+            idx_start = norm.get_norm_index([120, 21, -3], stage)
+            idx_end = norm.get_norm_index([122, 26, 3], stage)
+            indexes = list(range(idx_start, idx_end, (idx_end - idx_start) // 20011))
+            self.assertEqual(norm.recover_norm_locs(indexes, stage).tolist()
+                             , [norm.recover_norm_loc(idx, stage) for idx in indexes])
+
+    def test_mod_with_local_grid(self):
+        """ Test if local ids are contiguous and map back to the global indexes
+        """
+        norm = NormGrid()
+        for stage in [1, 2]:
+            grid = LocalGrid([121.74, 24.42, -0.1], [121.86, 24.49, 7.4], stage)
+            indexes = []
+            for dep in range(0, 8):
+                for lat in range(0, 8):
+                    for lon in range(0, 13):
+                        indexes.append(norm.get_norm_index([121.74 + lon * 0.01, 24.42 + lat * 0.01
+                                                            , dep], stage))
+            indexes = sorted(set(indexes))
+            if stage == 1:
+                self.assertEqual(grid.get_size(), len(indexes))
+            local_ids = [grid.get_local_id(idx) for idx in indexes]
+            self.assertEqual(grid.get_local_ids(indexes).tolist(), local_ids)
+            self.assertEqual(grid.get_global_ids(local_ids).tolist(), indexes)
+            self.assertEqual([grid.get_global_id(elem) for elem in local_ids], indexes)
+            self.assertEqual(sorted(grid.get_local_ids(grid.get_global_ids()).tolist())
+                             , list(range(grid.get_size())))
+            outside = norm.get_norm_index([121.73, 24.45, 3], stage)
+            self.assertEqual(grid.get_local_id(outside), None)
+            self.assertEqual(grid.get_local_ids([outside]).tolist(), [-1])
+
+    def test_mod_with_lattice_rounding(self):
+        """ Test if integer lattice rounding is the same as Decimal rounding over Taiwan
+        Every node, tie and neighbouring float of the ties is normalized on each axis, the
+        normalization of an axis not depending on the others. A recovered location only
+        depends on the lon index, then on the rest of the index left by the lon part
+        modulo the lon-lat plane, then on the rest left by the lat part, so recovering an
+        index of every such key covers every node of the box at stages 1 and 2.
+        """
+        norm = NormGrid()
+        bounds = [[119, 123], [21, 26], [-10, 100]]
+        results = {}
+        for rounding in ['decimal', 'lattice']:
+            norm.set_rounding(rounding)
+            results[rounding] = []
+            for stage in [1, 2]:
+                for axis in range(3):
+                    unit = int(norm.get_div(stage) / norm.get_grid_gap(1)[axis])
+                    for num in range(bounds[axis][0] * unit * 2, bounds[axis][1] * unit * 2 + 1):
+                        loc = [121, 23.5, 0]
+                        for val in [num / (2 * unit), math.nextafter(num / (2 * unit), -math.inf)
+                                    , math.nextafter(num / (2 * unit), math.inf)]:
+                            loc[axis] = val
+                            results[rounding].append(norm.get_norm_loc(loc, stage))
+                            results[rounding].append(norm.get_norm_index(loc, stage))
+        self.assertTrue(results['decimal'] == results['lattice'])
+        for stage in [1, 2]:
+            idx_locs = _test_mod_recover_keys(norm, bounds, stage)
+            norm.set_rounding('lattice')
+            locs = [norm.recover_norm_loc(idx, stage) for idx in idx_locs.tolist()]
+            norm.set_rounding('decimal')
+            self.assertEqual(locs, [norm.recover_norm_loc(idx, stage)
+                                    for idx in idx_locs.tolist()])
+            self.assertEqual(norm.recover_norm_locs(idx_locs, stage).tolist(), locs)
+
+
 def main():
     """ unit test
     """
@@ -4,40 +4,175 @@
 """
 import unittest
 import json
+import math
+import multiprocessing
 import os.path
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
 import graphbuilder
+import graphcache
+import graphsearch
 import normgrid
+import traveltimefield
 import my_util
 
+# Default path of the dijk2 program
+_PATH_DIJK = './../dijkstra/dijk2'
+# Largest number of stage 1 grid points of a box searched at once by execute_batch
+_BATCH_MAX_VERTEX = 1 << 21
+# ShortestPath of the current worker process of execute_pool
+_WORKER = {}
+# Run the tests comparing settings as wall-clock benchmarks on the TAIGER cases, when the
+# environment variable SHORTEST_PATH_BENCHMARK is set, instead of on short pairs
+_TEST_BENCHMARK = bool(os.environ.get('SHORTEST_PATH_BENCHMARK'))
+# Station and source pairs of the TAIGER cases, and short pairs around two of their stations
+_TEST_PAIRS_TAIGER = [[[121.264500, 24.145, -3.395000], [121.037670, 24.79534, -0.055000]]
+                      , [[120.613800, 23.2455, -0.560000], [120.229900, 23.5106, -0.006000]]
+                      , [[120.899800, 23.883, -1.015000], [120.413140, 23.42513, -0.020000]]]
+_TEST_PAIRS_SHORT = [[[120.899800, 23.883, -1.015000], [120.799800, 23.983, 0.985000]]
+                     , [[120.613800, 23.2455, -0.560000], [120.713800, 23.1455, 3.440000]]
+                     , [[120.899800, 23.883, -1.015000], [120.849800, 23.833, 2.985000]]
+                     , [[120.613800, 23.2455, -0.560000], [120.563800, 23.2955, 1.440000]]]
+
+def _init_pool_worker(settings, dirpath):
+    """ Make the ShortestPath of a worker process of execute_pool
+    The velocity model and the NormGrid are loaded here once for all the pairs of the worker.
+    The worker writes the edge list of the dijk2 program to a file of its own, and builds
+    the graphs in its own process, a worker being unable to start processes.
+    Args:
+        settings: settings of the ShortestPath
+        dirpath: directory of the edge lists of the workers
+    Returns:
+    Raises:
+        Native exceptions.
+    """
+    short = ShortestPath(None if settings is None else dict(settings, num_workers=1))
+    handle, short._filepath_edges = tempfile.mkstemp(suffix='.txt', prefix='edges_'
+                                                     , dir=dirpath)
+    os.close(handle)
+    _WORKER['short'] = short
+
+def _run_pool_task(task):
+    """ Execute a pair of station and source in a worker process of execute_pool
+    Args:
+        task: [sta_loc, sou_loc, with_path]
+    Returns:
+        [travel time, stage 2 path or None]
+    Raises:
+        Native exceptions.
+    """
+    sta_loc, sou_loc, with_path = task
+    short = _WORKER['short']
+    travel_time = short.execute_dijk(sta_loc, sou_loc)
+    return [travel_time, list(short._path['2']) if with_path else None]
+
+
 class ShortestPath(object):
     """ Build the edge of the graph
     """
     def __init__(self, settings=None):
+        self._settings = settings
         self._graphbuild = graphbuilder.GraphBuilder(settings)
         self._norm = normgrid.NormGrid()
         self._result = {}
         self._idx_vertex = {}
         self._filepath_edges = '/mnt/ram-disk/edges.txt'
-        self._filepath_dijk = './../dijkstra/dijk2'
+        self._filepath_dijk = (_PATH_DIJK if settings is None
+                               else settings.get('path_dijk', _PATH_DIJK))
+        self._dijk_protocol = 'text' if settings is None else settings.get('dijk_protocol', 'text')
         self._path = {}
+        self._vertex_order = None if settings is None else settings.get('vertex_order')
+        self._graph_mode = 'explicit' if settings is None else settings.get('graph_mode'
+                                                                            , 'explicit')
+        self._engine = 'dijk2' if settings is None else settings.get('engine', 'dijk2')
+        self._search = 'dijkstra' if settings is None else settings.get('search', 'dijkstra')
+        self._pool_workers = 1 if settings is None else settings.get('pool_workers', 1)
+        self._batch_max_vertex = (_BATCH_MAX_VERTEX if settings is None
+                                  else settings.get('batch_max_vertex', _BATCH_MAX_VERTEX))
+        self._graph_cache = None
+        if settings is not None and settings.get('path_graph_cache') is not None:
+            self._graph_cache = graphcache.GraphCache(settings['path_graph_cache']
+                                                      , settings.get('graph_cache_size'))
 
-    def _run_dijk2(self, edges, sta_loc, sou_loc, stage):
+    def _order_vertex(self, idx_vertex, sta_loc, stage):
+        """ Number the vertexes along a space filling curve, station first
+        Args:
+            idx_vertex: list of vertex indexes
+            sta_loc: location of station
+            stage: designated stage
+        Returns:
+            idx_vertex: ordered list of vertex indexes
+        Raises:
+            Native exceptions.
+        """
+        coors = self._norm.get_lattice_coors(idx_vertex, stage)
+        keys = normgrid.get_curve_keys(coors - coors.min(axis=0), self._vertex_order)
+        idx_vertex = np.asarray(idx_vertex)[np.argsort(keys, kind='stable')].tolist()
+        idx_vertex.remove(self._norm.get_norm_index(sta_loc, stage))
+        idx_vertex.insert(0, self._norm.get_norm_index(sta_loc, stage))
+        return idx_vertex
+
+    def _number_vertex(self, edges, sta_loc, stage):
+        """ Number the vertexes of the edges, station first
+        Args:
+            edges: edge list of build_graph
+            sta_loc: location of station
+            stage: designated stage
+        Returns:
+            idx_vertex: list of vertex indexes, by vertex number
+        Raises:
+            Native exceptions.
+        """
         idx_vertex = []
         for edge in edges:
             edge_info = edge.get_info()
             idx_vertex.append(edge_info[0])
             idx_vertex.append(edge_info[1])
         idx_vertex = list(set(idx_vertex))
-        idx_vertex[idx_vertex.index(self._norm.get_norm_index(sta_loc, stage))] = idx_vertex[0]
-        idx_vertex[0] = self._norm.get_norm_index(sta_loc, stage)
+        if self._vertex_order is None:
+            idx_vertex[idx_vertex.index(self._norm.get_norm_index(sta_loc, stage))] = idx_vertex[0]
+            idx_vertex[0] = self._norm.get_norm_index(sta_loc, stage)
+        else:
+            idx_vertex = self._order_vertex(idx_vertex, sta_loc, stage)
+        return idx_vertex
+
+    def _get_edge_arrays(self, edges, num_vertex):
+        """ Return the edges as arrays of vertex numbers and weights
+        Args:
+            edges: edge list of build_graph
+            num_vertex: dictionary of vertex index versus vertex number
+        Returns:
+            idx_src, idx_dst: arrays of the numbers of the ends of the edges
+            weights: array of the edge weights
+        Raises:
+            Native exceptions.
+        """
+        edge_infos = [edge.get_info() for edge in edges]
+        return (np.array([num_vertex[edge_info[0]] for edge_info in edge_infos], dtype=np.int64)
+                , np.array([num_vertex[edge_info[1]] for edge_info in edge_infos], dtype=np.int64)
+                , np.array([edge_info[2] for edge_info in edge_infos]))
+
+    def _run_dijk2(self, edges, sta_loc, sou_loc, stage):
+        if self._dijk_protocol == 'binary':
+            if self._run_dijk2_binary(edges, sta_loc, sou_loc, stage):
+                return
+            print("Binary protocol not supported by %s, use the text edge list"
+                  % self._filepath_dijk)
+            self._dijk_protocol = 'text'
+        idx_vertex = self._number_vertex(edges, sta_loc, stage)
+        num_vertex = {idx:num for num, idx in enumerate(idx_vertex)}
         with open(self._filepath_edges, 'w') as the_file:
             line = (str(len(idx_vertex))+", "
-                    +str(idx_vertex.index(self._norm.get_norm_index(sou_loc, stage)))+"\n")
+                    +str(num_vertex[self._norm.get_norm_index(sou_loc, stage)])+"\n")
             the_file.write(line)
             for edge in edges:
                 edge_info = edge.get_info()
-                line = (str(idx_vertex.index(edge_info[0]))
-                        +", "+str(idx_vertex.index(edge_info[1]))
+                line = (str(num_vertex[edge_info[0]])
+                        +", "+str(num_vertex[edge_info[1]])
                         +", "+str(edge_info[2])+"\n")
                 the_file.write(line)
         cmd = '%s %s' % (self._filepath_dijk, self._filepath_edges)
@@ -48,6 +183,183 @@ class ShortestPath(object):
             self._result['2'] = result_dict
         self._idx_vertex[str(stage)] = idx_vertex
 
+    def _run_dijk2_binary(self, edges, sta_loc, sou_loc, stage):
+        """ Run the dijkstra program with the binary streams of graphsearch
+        The edges are piped to '<path_dijk> --binary' as int32 and float32 records, and the
+        result comes back from its stdout, with no edge file. Only dijkstub.py reads the
+        streams so far, the dijk2 program takes the text edge list only and fails here.
+        The weights and distances being float32, shortest_weight may be off the one of the
+        text edge list by up to about 1e-3 sec.
+        Args:
+            edges: edge list of build_graph
+            sta_loc: location of station
+            sou_loc: location of source
+            stage: designated stage
+        Returns:
+            True if the program gave a result, False if it failed
+        Raises:
+            Native exceptions.
+        """
+        idx_vertex = self._number_vertex(edges, sta_loc, stage)
+        num_vertex = {idx:num for num, idx in enumerate(idx_vertex)}
+        idx_src, idx_dst, weights = self._get_edge_arrays(edges, num_vertex)
+        data = graphsearch.pack_edges(len(idx_vertex)
+                                      , num_vertex[self._norm.get_norm_index(sou_loc, stage)]
+                                      , idx_src, idx_dst, weights)
+        try:
+            result = graphsearch.unpack_result(
+                my_util.run_cmd_pipe(shlex.split(self._filepath_dijk) + ['--binary'], data))
+        except (OSError, subprocess.CalledProcessError, ValueError) as err:
+            print("Error in binary protocol of %s: %s" % (self._filepath_dijk, err))
+            return False
+        self._result[str(stage)] = result
+        self._idx_vertex[str(stage)] = idx_vertex
+        return True
+
+    def _run_heap(self, edges, sta_loc, sou_loc, stage):
+        """ Search the graph in process with a binary heap instead of the dijk2 program
+        The vertexes are numbered as for dijk2 and all of them are settled, so the result
+        has the same shortest_weight, shortest_path and total_shortest_vertex_weight.
+        Args:
+            edges: edge list of build_graph
+            sta_loc: location of station
+            sou_loc: location of source
+            stage: designated stage
+        Returns:
+        Raises:
+            Native exceptions.
+        """
+        idx_vertex = self._number_vertex(edges, sta_loc, stage)
+        num_vertex = {idx:num for num, idx in enumerate(idx_vertex)}
+        indptr, indices, weights = graphsearch.get_csr(*self._get_edge_arrays(edges, num_vertex)
+                                                       , len(idx_vertex))
+        dists, prevs = graphsearch.dijkstra_csr(indptr, indices, weights, 0)
+        self._result[str(stage)] = graphsearch.get_result_dict(
+            range(len(idx_vertex)), dists, prevs
+            , num_vertex[self._norm.get_norm_index(sou_loc, stage)])
+        self._idx_vertex[str(stage)] = idx_vertex
+
+    def _run_bidirectional(self, edges, sta_loc, sou_loc, stage):
+        """ Search the graph in process from both the station and the source
+        The vertexes are numbered as for dijk2, but only the vertexes settled from the
+        station and the ones of the shortest path have a total_shortest_vertex_weight, the
+        others being inf.
+        Args:
+            edges: edge list of build_graph
+            sta_loc: location of station
+            sou_loc: location of source
+            stage: designated stage
+        Returns:
+        Raises:
+            Native exceptions.
+        """
+        idx_vertex = self._number_vertex(edges, sta_loc, stage)
+        num_vertex = {idx:num for num, idx in enumerate(idx_vertex)}
+        indptr, indices, weights = graphsearch.get_csr(*self._get_edge_arrays(edges, num_vertex)
+                                                       , len(idx_vertex))
+        num_sou = num_vertex[self._norm.get_norm_index(sou_loc, stage)]
+        dists, prevs, _ = graphsearch.bidirectional_csr(indptr, indices, weights, 0, num_sou)
+        self._result[str(stage)] = graphsearch.get_result_dict(range(len(idx_vertex)), dists
+                                                               , prevs, num_sou)
+        self._idx_vertex[str(stage)] = idx_vertex
+
+    def _run_implicit(self, graph, sta_loc, sou_loc, stage):
+        """ Search the implicit graph in process
+        The search stops at the source, so the vertexes are the settled ones, in settling
+        order from the station. With the setting 'search' of 'astar', the vertexes are
+        settled by travel time plus the bound of ImplicitGraph.get_heuristic. With the
+        setting 'search' of 'bidirectional', the search also goes from the source, and the
+        vertexes settled from the source only come last with a total_shortest_vertex_weight
+        of inf.
+        Args:
+            graph: ImplicitGraph
+            sta_loc: location of station
+            sou_loc: location of source
+            stage: designated stage
+        Returns:
+        Raises:
+            Native exceptions.
+        """
+        idx_sou = self._norm.get_norm_index(sou_loc, stage)
+        idx_sta = self._norm.get_norm_index(sta_loc, stage)
+        if self._search == 'bidirectional':
+            dists, prevs, dists_backward = graphsearch.bidirectional_dijkstra(graph.get_neighbours
+                                                                              , idx_sta, idx_sou)
+            idx_vertex = list(dists) + [idx for idx in dists_backward if idx not in dists]
+        else:
+            get_heuristics = graph.get_heuristic(idx_sou) if self._search == 'astar' else None
+            dists, prevs = graphsearch.dijkstra(graph.get_neighbours, idx_sta, idx_sou
+                                                , get_heuristics)
+            idx_vertex = list(dists)
+        self._result[str(stage)] = graphsearch.get_result_dict(idx_vertex, dists, prevs, idx_sou)
+        self._idx_vertex[str(stage)] = idx_vertex
+
+    def _run_mask(self, csr, sta_loc, sou_loc, stage):
+        """ Search the compressed sparse rows of build_graph_mask in process
+        The vertexes are numbered as for dijk2, station first, and all of them are settled.
+        Args:
+            csr: indptr, indices, weights and idx_vertex given by build_graph_mask
+            sta_loc: location of station
+            sou_loc: location of source
+            stage: designated stage
+        Returns:
+        Raises:
+            Native exceptions.
+        """
+        indptr, indices, weights, idx_vertex = csr
+        num_sta, num_sou = np.searchsorted(idx_vertex, [self._norm.get_norm_index(sta_loc, stage)
+                                                        , self._norm.get_norm_index(sou_loc, stage)
+                                                        ]).tolist()
+        dists, prevs = graphsearch.dijkstra_csr(indptr, indices, weights, num_sta)
+        order = list(range(len(idx_vertex)))
+        order[0], order[num_sta] = num_sta, 0
+        self._result[str(stage)] = graphsearch.get_result_dict(order, dists, prevs, num_sou)
+        self._idx_vertex[str(stage)] = idx_vertex[order].tolist()
+
+    def _build_graph(self, sta_loc, sou_loc, stage, path):
+        """ Build the graph, or load it from the graph cache
+        The graphs are cached in the directory of setting 'path_graph_cache' when set, up to
+        setting 'graph_cache_size' bytes.
+        Args:
+            sta_loc: location of station
+            sou_loc: location of source
+            stage: designated stage
+            path: stage 1 path, for stage 2
+        Returns:
+            edges: edge list of build_graph
+        Raises:
+            Native exceptions.
+        """
+        if self._graph_cache is None:
+            return self._graphbuild.build_graph(sta_loc, sou_loc, stage, path)
+        key = self._graphbuild.get_graph_key(sta_loc, sou_loc, stage, path)
+        edge_array = self._graph_cache.load(key)
+        if edge_array is not None:
+            return graphcache.get_edges(edge_array)
+        edges = self._graphbuild.build_graph(sta_loc, sou_loc, stage, path)
+        self._graph_cache.save(key, edges)
+        return edges
+
+    def _run_stage(self, sta_loc, sou_loc, stage):
+        path = self._path['1'] if stage == 2 else None
+        if self._graph_mode == 'implicit':
+            graph = self._graphbuild.build_graph_implicit(sta_loc, sou_loc, stage, path)
+            self._run_implicit(graph, sta_loc, sou_loc, stage)
+        elif self._graph_mode == 'mask' and stage == 2:
+            # the edges of build_graph_mask are a superset of the ones of build_graph, the
+            # voxels of different cubics being linked as well, so the time may be shorter
+            csr = self._graphbuild.build_graph_mask(sta_loc, sou_loc, stage, path)
+            self._run_mask(csr, sta_loc, sou_loc, stage)
+        else:
+            edges = self._build_graph(sta_loc, sou_loc, stage, path)
+            if self._engine == 'heap':
+                self._run_heap(edges, sta_loc, sou_loc, stage)
+            elif self._engine == 'bidirectional':
+                self._run_bidirectional(edges, sta_loc, sou_loc, stage)
+            else:
+                self._run_dijk2(edges, sta_loc, sou_loc, stage)
+        self._retrieve_norm_path(stage)
+
     def _retrieve_norm_path(self, stage):
         if stage == 1:
             result_dict = self._result['1']
@@ -61,7 +373,11 @@ class ShortestPath(object):
 
     def execute_dijk(self, sta_loc, sou_loc):
         """ Execute Dijkstra Program
-        Run the dijkstra program by station and source location
+        Run the dijkstra program by station and source location, or search the graph in
+        process with the setting 'engine' of 'heap' or 'bidirectional', or search the implicit
+        graph in process with the setting 'graph_mode' of 'implicit'. With the setting
+        'graph_mode' of 'mask', the stage 2 graph is built by build_graph_mask, without the
+        graph cache, and searched in process.
         Args:
             sta_loc: location of station
             sou_loc: location of source
@@ -74,14 +390,127 @@ class ShortestPath(object):
             , 'Error in station or source location type'
         assert sta_loc != sou_loc, 'Error in same station and source location'
 
-        edges = self._graphbuild.build_graph(sta_loc, sou_loc, 1)
-        self._run_dijk2(edges, sta_loc, sou_loc, 1)
-        self._retrieve_norm_path(1)
-        edges = self._graphbuild.build_graph(sta_loc, sou_loc, 2, self._path['1'])
-        self._run_dijk2(edges, sta_loc, sou_loc, 2)
-        self._retrieve_norm_path(2)
+        self._run_stage(sta_loc, sou_loc, 1)
+        if not self._path['1']:
+            return float(self._result['1']['shortest_weight'])
+        self._run_stage(sta_loc, sou_loc, 2)
         return float(self._result['2']['shortest_weight'])
 
+    def _get_batch_box(self, locs):
+        """ Return the stage 1 box of execute_batch enclosing some locations
+        Args:
+            locs: list of locations, station first
+        Returns:
+            [loc_min, loc_max, number of grid points of the box]
+        Raises:
+            Native exceptions.
+        """
+        extra_range = self._graphbuild._extra_range
+        loc_min = (np.array(locs).min(axis=0) - [extra_range[0], extra_range[1], 0]).tolist()
+        loc_max = (np.array(locs).max(axis=0) + extra_range).tolist()
+        return [loc_min, loc_max, normgrid.LocalGrid(loc_min, loc_max, 1).get_size()]
+
+    def _get_batch_boxes(self, pairs, idx_pairs):
+        """ Split the pairs of a station into boxes of at most setting 'batch_max_vertex'
+        stage 1 grid points (_BATCH_MAX_VERTEX by default)
+        The pairs are taken from the smallest box to the largest one, and a new box is
+        started when the next source would make the current one too large.
+        Args:
+            pairs: list of [sta_loc, sou_loc]
+            idx_pairs: indexes of the pairs of a station
+        Returns:
+            boxes: list of [loc_min, loc_max, indexes of the pairs], loc_min and loc_max being
+                   None for the pairs too large for a box
+        Raises:
+            Native exceptions.
+        """
+        sta_loc = pairs[idx_pairs[0]][0]
+        sizes = {idx:self._get_batch_box([sta_loc, pairs[idx][1]])[2] for idx in idx_pairs}
+        boxes = [[None, None, [idx for idx in idx_pairs
+                               if sizes[idx] > self._batch_max_vertex]]]
+        locs = None
+        for idx_pair in sorted([idx for idx in idx_pairs if sizes[idx] <= self._batch_max_vertex]
+                               , key=sizes.get):
+            if locs is not None:
+                box = self._get_batch_box(locs + [pairs[idx_pair][1]])
+                if box[2] <= self._batch_max_vertex:
+                    locs.append(pairs[idx_pair][1])
+                    boxes[-1] = box[:2] + [boxes[-1][2] + [idx_pair]]
+                    continue
+            locs = [sta_loc, pairs[idx_pair][1]]
+            boxes.append(self._get_batch_box(locs)[:2] + [[idx_pair]])
+        return [box for box in boxes if box[2]]
+
+    def execute_batch(self, pairs):
+        """ Execute the pairs of station and source by station
+        The pairs are grouped by the stage 1 normalized index of the station. For each
+        group, the stage 1 graph of the box enclosing the station and all the sources, with
+        the extra range, is searched once from the station (see get_travel_time_field), and
+        only stage 2 is run for each source along the stage 1 path in that box. The box
+        being larger than the one of execute_dijk, the stage 1 path may be shorter.
+        A group whose box is too large is split (see _get_batch_boxes), and a pair too large
+        alone is run by execute_dijk.
+        Args:
+            pairs: list of [sta_loc, sou_loc]
+        Returns:
+            generator of [index of the pair, travel time], in the order the pairs are done,
+            the travel time being None when the source is not reached
+        Raises:
+            Native exceptions.
+        """
+        groups = {}
+        for idx_pair, (sta_loc, sou_loc) in enumerate(pairs):
+            assert isinstance(sta_loc, list) and isinstance(sou_loc, list) \
+                , 'Error in station or source location type'
+            assert sta_loc != sou_loc, 'Error in same station and source location'
+            groups.setdefault(self._norm.get_norm_index(sta_loc, 1), []).append(idx_pair)
+        for idx_pairs_sta in groups.values():
+            for loc_min, loc_max, idx_pairs in self._get_batch_boxes(pairs, idx_pairs_sta):
+                if loc_min is None:
+                    for idx_pair in idx_pairs:
+                        travel_time = self.execute_dijk(*pairs[idx_pair])
+                        yield [idx_pair, None if math.isinf(travel_time) else travel_time]
+                    continue
+                field = self.get_travel_time_field(pairs[idx_pairs[0]][0], loc_min, loc_max, 1)
+                for idx_pair in idx_pairs:
+                    sta_loc, sou_loc = pairs[idx_pair]
+                    path = field.get_path(sou_loc)
+                    if path is None:
+                        print("Source %s not reached from station %s" % (sou_loc, sta_loc))
+                        yield [idx_pair, None]
+                        continue
+                    self._result.pop('1', None)
+                    self._idx_vertex.pop('1', None)
+                    self._path['1'] = path
+                    self._run_stage(sta_loc, sou_loc, 2)
+                    yield [idx_pair, float(self._result['2']['shortest_weight'])]
+
+    def execute_pool(self, pairs, with_path=False):
+        """ Execute the pairs of station and source in a pool of processes
+        Each of the setting 'pool_workers' processes (1 by default, in this process) makes
+        its own ShortestPath once, then takes the next pair whenever it is done with one,
+        so the workers stay busy whatever the time of each pair. The edge lists of the
+        workers are kept in a temporary directory next to the one of this ShortestPath, and
+        the graphs of a worker are built in the worker whatever the setting 'num_workers'.
+        Args:
+            pairs: list of [sta_loc, sou_loc]
+            with_path: also return the stage 2 path of each pair if True
+        Returns:
+            results: list of [travel time, stage 2 path or None], in the order of the pairs
+        Raises:
+            Native exceptions.
+        """
+        tasks = [[sta_loc, sou_loc, with_path] for sta_loc, sou_loc in pairs]
+        if self._pool_workers > 1 and len(tasks) > 1:
+            dirpath = os.path.dirname(self._filepath_edges)
+            with tempfile.TemporaryDirectory(dir=dirpath if os.path.isdir(dirpath) else None
+                                             ) as dirpath_pool:
+                with multiprocessing.Pool(min(self._pool_workers, len(tasks)), _init_pool_worker
+                                          , (self._settings, dirpath_pool)) as pool:
+                    return list(pool.imap(_run_pool_task, tasks, chunksize=1))
+        _WORKER['short'] = self
+        return list(map(_run_pool_task, tasks))
+
     def export_path(self, filepath):
         """ Export Stage 2 Path
         Args:
@@ -99,6 +528,47 @@ class ShortestPath(object):
                     data[0], data[1], data[2])
                 out_file.write('%s\n' % tmp)
 
+    def get_graph_cache_info(self):
+        """ Return the counters of the graph cache
+        Args:
+        Returns:
+            info: see GraphCache.get_info, None without setting 'path_graph_cache'
+        Raises:
+            Native exceptions.
+        """
+        if self._graph_cache is None:
+            return None
+        return self._graph_cache.get_info()
+
+    def get_travel_time_field(self, sta_loc, loc_min, loc_max, stage=1):
+        """ Return the travel time from a station to every grid point of a region
+        The region graph is searched once, so the sources of the region are looked up with
+        TravelTimeField.get_travel_times instead of running execute_dijk for each of them.
+        Args:
+            sta_loc: location of station, inside the region
+            loc_min: lowermost coordinate of the region
+            loc_max: uppermost coordinate of the region
+            stage: stage number of the grid
+        Returns:
+            field: TravelTimeField
+        Raises:
+            Native exceptions.
+        """
+        return traveltimefield.TravelTimeField(self._graphbuild, sta_loc, loc_min, loc_max
+                                               , stage)
+
+    def get_idx_vertex(self, stage):
+        """ Return the vertexes of a stage of the last pair, numbered as for the search
+        Args:
+            stage: designated stage
+        Returns:
+            idx_vertex: list of the normalized indexes of the vertexes, the position being the
+                        vertex number of the result
+        Raises:
+            Native exceptions.
+        """
+        return list(self._idx_vertex[str(stage)])
+
     def get_weight_list(self):
         """ Return the weight dictionary of every vertexes in graph
         Args:
@@ -121,6 +591,47 @@ class ShortestPath(object):
                         idx_weight[self._norm.get_norm_index(loc, 1)] = float(weight)
         return idx_weight
 
+    def close(self):
+        """ Stop the worker processes of the graph building (setting 'num_workers'), if started
+        Args:
+        Returns:
+        Raises:
+            Native exceptions.
+        """
+        self._graphbuild.close()
+
+def _test_mod_run_pairs(settings, name, pairs=None):
+    """ Run execute_dijk on station-source pairs, and print the time when benchmarking
+    Args:
+        settings: settings of the ShortestPath
+        name: name of the run in the printed time
+        pairs: list of [sta_loc, sou_loc], the TAIGER cases when benchmarking and the short
+               pairs otherwise if None
+    Returns:
+        results: list of [travel time, result by stage, vertex indexes by stage, stage 2
+                 path] by pair
+    Raises:
+        Native exceptions.
+    """
+    if pairs is None:
+        pairs = _TEST_PAIRS_TAIGER if _TEST_BENCHMARK else _TEST_PAIRS_SHORT
+    short = ShortestPath(settings)
+    results = []
+    elapsed = 0
+    for loc_sta, loc_sou in pairs:
+        time_start = time.time()
+        travel_time = short.execute_dijk(loc_sta, loc_sou)
+        elapsed += time.time() - time_start
+        results.append([travel_time, dict(short._result), dict(short._idx_vertex)
+                        , short._path.get('2')])
+    short.close()
+    if _TEST_BENCHMARK:
+        print('%s: time=%.3fs, vertexes=%d' % (name, elapsed
+                                               , sum(len(result[2]['1']) + len(result[2]['2'])
+                                                     for result in results)))
+    return results
+
+
 class ShortestPathTest(unittest.TestCase):
     """ Test with vertex and edge correctness in graph
     """
@@ -174,6 +685,74 @@ class ShortestPathTest(unittest.TestCase):
         weights = short.get_weight_list()
         self.assertEqual(weights.get(norm.get_norm_index(loc_sou, 1)), None)
 
+    def test_mod_with_graph_cache(self):
+        """ Test if the cached graphs give the same result
+        """
+        loc_sta = [120, 23, 0]
+        loc_sou = [120.01, 23.01, 1]
+        with tempfile.TemporaryDirectory() as dirpath:
+            settings = {'extra_range':[0, 0, 0], 'ranges':[0.01, 0.01, 1]
+                        , 'path_model':'./_input/MOD_H13_uniform', 'path_graph_cache':dirpath}
+            short = ShortestPath(settings)
+            result = short.execute_dijk(loc_sta, loc_sou)
+            info = short.get_graph_cache_info()
+            self.assertEqual([info['hit'], info['miss'], info['num_graph']], [0, 2, 2])
+            short = ShortestPath(settings)
+            self.assertEqual(short.execute_dijk(loc_sta, loc_sou), result)
+            info = short.get_graph_cache_info()
+            self.assertEqual([info['hit'], info['miss'], info['num_graph']], [2, 0, 2])
+
+    def test_mod_with_engine(self):
+        """ Test if the in-process search gives the results of the dijk2 program
+        """
+        results = {}
+        for engine in ['dijk2', 'heap']:
+            settings = {'extra_range':[0.01, 0.01, 2], 'ranges':[0.02, 0.02, 1]
+                        , 'path_model':None, 'engine':engine}
+            results[engine] = _test_mod_run_pairs(settings, 'engine=%s' % engine)
+        for result_dijk2, result_heap in zip(results['dijk2'], results['heap']):
+            self.assertEqual(result_heap[2], result_dijk2[2])
+            for stage in ['1', '2']:
+                self.assertEqual(result_heap[1][stage]['shortest_path']
+                                 , result_dijk2[1][stage]['shortest_path'])
+                self.assertAlmostEqual(float(result_heap[1][stage]['shortest_weight'])
+                                       , float(result_dijk2[1][stage]['shortest_weight'])
+                                       , places=4)
+                weights = np.array(result_heap[1][stage]['total_shortest_vertex_weight']
+                                   , dtype=float)
+                weights_dijk2 = np.array(result_dijk2[1][stage]['total_shortest_vertex_weight']
+                                         , dtype=float)
+                self.assertTrue(np.allclose(weights, weights_dijk2, rtol=1e-5))
+
+    def test_mod_with_dijk_protocol(self):
+        """ Test if the binary streams give the times of the text edge list with the stub
+        program
+        """
+        path_stub = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dijkstub.py')
+        results = {}
+        for protocol in ['text', 'binary']:
+            settings = {'extra_range':[0.01, 0.01, 2], 'ranges':[0.02, 0.02, 1]
+                        , 'path_model':None, 'dijk_protocol':protocol
+                        , 'path_dijk':'%s %s' % (sys.executable, path_stub)}
+            results[protocol] = _test_mod_run_pairs(settings, 'protocol=%s' % protocol)
+        for result_text, result_binary in zip(results['text'], results['binary']):
+            self.assertAlmostEqual(result_binary[0], result_text[0], places=3)
+
+    @unittest.skipUnless(os.path.isfile(_PATH_DIJK) and os.path.isfile('./_input/MOD_H13')
+                         , 'dijk2 program or velocity model missing')
+    def test_mod_with_binary_fallback(self):
+        """ Test if the dijk2 program, without the binary streams, falls back to the text
+        edge list
+        """
+        loc_sta = [120.899800, 23.883, -1.015000]
+        loc_sou = [120.413140, 23.42513, -0.020000]
+        times = {}
+        for protocol in ['text', 'binary']:
+            settings = {'extra_range':[0.01, 0.01, 2], 'ranges':[0.02, 0.02, 1]
+                        , 'path_model':None, 'dijk_protocol':protocol}
+            times[protocol] = ShortestPath(settings).execute_dijk(loc_sta, loc_sou)
+        self.assertEqual(times['binary'], times['text'])
+
     def test_mod_with_real_case(self):
         """ Test with TAIGER cases
         """
@@ -200,6 +779,165 @@ class ShortestPathTest(unittest.TestCase):
         self.assertEqual(0, 0)
 
 
+    @unittest.skipUnless(os.path.isfile(_PATH_DIJK) and os.path.isfile('./_input/MOD_H13')
+                         , 'dijk2 program or velocity model missing')
+    def test_mod_with_vertex_order(self):
+        """ Test if the vertex numbering orders give the same times
+        When benchmarking, the mean id distance between the two ends of an edge is reported
+        as a proxy of the memory locality of dijk2, the cache misses themselves are not
+        measured.
+        """
+        times = {}
+        for order in [None, 'morton', 'hilbert']:
+            settings = {'extra_range':[0.01, 0.01, 2], 'ranges':[0.02, 0.02, 1]
+                        , 'path_model':None, 'vertex_order':order}
+            if _TEST_BENCHMARK:
+                settings.update({'extra_range':[0.02, 0.02, 20], 'ranges':[0.05, 0.05, 2]})
+            results = _test_mod_run_pairs(settings, 'order=%s' % order)
+            times[order] = [result[0] for result in results]
+            if _TEST_BENCHMARK:
+                graphbuild = graphbuilder.GraphBuilder(settings)
+                span = 0
+                for (loc_sta, loc_sou), result in zip(_TEST_PAIRS_TAIGER, results):
+                    idx_vertex = {idx:num for num, idx in enumerate(result[2]['1'])}
+                    edges = graphbuild.build_graph(loc_sta, loc_sou, 1)
+                    span += (sum(abs(idx_vertex[edge.get_info()[0]]
+                                     - idx_vertex[edge.get_info()[1]]) for edge in edges)
+                             / len(edges))
+                print('order=%s, mean edge span=%.1f' % (order, span / len(results)))
+        self.assertEqual(times['morton'], times[None])
+        self.assertEqual(times['hilbert'], times[None])
+
+    def test_mod_with_graph_mode(self):
+        """ Test if the implicit graph gives the times of the explicit graph
+        """
+        results = {}
+        for mode in ['explicit', 'implicit']:
+            settings = {'extra_range':[0.01, 0.01, 2], 'ranges':[0.02, 0.02, 1]
+                        , 'path_model':None, 'graph_mode':mode}
+            results[mode] = _test_mod_run_pairs(settings, 'mode=%s' % mode)
+        for result_explicit, result_implicit in zip(results['explicit'], results['implicit']):
+            self.assertAlmostEqual(result_implicit[0], result_explicit[0], places=4)
+
+    def test_mod_with_mask_mode(self):
+        """ Test if the stage 2 graph of build_graph_mask has the vertexes of the explicit graph
+        and a travel time as short or shorter
+        """
+        results = {}
+        for mode in ['explicit', 'mask']:
+            settings = {'extra_range':[0.01, 0.01, 2], 'ranges':[0.02, 0.02, 1]
+                        , 'path_model':None, 'graph_mode':mode, 'engine':'heap'}
+            results[mode] = _test_mod_run_pairs(settings, 'mode=%s' % mode)
+        pairs = _TEST_PAIRS_TAIGER if _TEST_BENCHMARK else _TEST_PAIRS_SHORT
+        for (loc_sta, _), result_explicit, result_mask in zip(pairs, results['explicit']
+                                                              , results['mask']):
+            time_explicit = float(result_explicit[1]['2']['shortest_weight'])
+            time_mask = float(result_mask[1]['2']['shortest_weight'])
+            self.assertLessEqual(time_mask, time_explicit * (1 + 1e-5))
+            self.assertEqual(sorted(result_mask[2]['2']), sorted(result_explicit[2]['2']))
+            self.assertEqual(result_mask[2]['2'][0]
+                             , normgrid.NormGrid().get_norm_index(loc_sta, 2))
+            self.assertEqual(result_mask[3][-1], result_explicit[3][-1])
+
+    def test_mod_with_astar(self):
+        """ Test if the A* search gives the times of Dijkstra on the implicit graph
+        """
+        results = {}
+        for search in ['dijkstra', 'astar']:
+            settings = {'extra_range':[0.01, 0.01, 2], 'ranges':[0.02, 0.02, 1]
+                        , 'path_model':None, 'graph_mode':'implicit', 'search':search}
+            results[search] = [[result[1][stage]['shortest_weight'] for stage in ['1', '2']]
+                               for result in _test_mod_run_pairs(settings, 'search=%s' % search)]
+        self.assertEqual(results['astar'], results['dijkstra'])
+
+    def test_mod_with_bidirectional(self):
+        """ Test if the search from both ends gives the times of Dijkstra over station-source
+        separations
+        """
+        loc_sta = [120.899800, 23.883, -1.015000]
+        separations = [[0.05, 0.0, 1.0], [0.1, -0.1, 2.0], [0.2, -0.2, 3.0], [0.4, -0.3, 5.0]]
+        pairs = [[loc_sta, [loc_sta[0] - separation[0], loc_sta[1] + separation[1]
+                            , loc_sta[2] + separation[2]]]
+                 for separation in (separations if _TEST_BENCHMARK else separations[:2])]
+        results = {}
+        for search in ['dijkstra', 'bidirectional']:
+            settings = {'extra_range':[0.01, 0.01, 2], 'ranges':[0.02, 0.02, 1]
+                        , 'path_model':None, 'graph_mode':'implicit', 'search':search}
+            results[search] = [[result[1][stage]['shortest_weight'] for stage in ['1', '2']]
+                               for result in _test_mod_run_pairs(settings, 'search=%s' % search
+                                                                 , pairs)]
+        self.assertEqual(results['bidirectional'], results['dijkstra'])
+        settings = {'extra_range':[0.01, 0.01, 2], 'ranges':[0.02, 0.02, 1], 'path_model':None}
+        results = {}
+        for engine in ['heap', 'bidirectional']:
+            results[engine] = _test_mod_run_pairs(dict(settings, engine=engine)
+                                                  , 'engine=%s' % engine, _TEST_PAIRS_SHORT[:1])
+        for stage in ['1', '2']:
+            for key in ['shortest_path', 'shortest_weight']:
+                self.assertEqual(results['bidirectional'][0][1][stage][key]
+                                 , results['heap'][0][1][stage][key])
+
+    def test_mod_with_batch(self):
+        """ Test if the batch of pairs grouped by station gives the times of execute_dijk per
+        pair, or shorter ones
+        """
+        pairs = ((_TEST_PAIRS_TAIGER[1:] if _TEST_BENCHMARK else []) + _TEST_PAIRS_SHORT)
+        settings = {'extra_range':[0.01, 0.01, 2], 'ranges':[0.02, 0.02, 1]
+                    , 'path_model':None, 'graph_mode':'implicit'}
+        results = [result[0] for result in _test_mod_run_pairs(settings, 'execute_dijk', pairs)]
+        short = ShortestPath(settings)
+        time_start = time.time()
+        results_batch = {}
+        for idx_pair, result in short.execute_batch(pairs):
+            self.assertNotIn(idx_pair, results_batch)
+            results_batch[idx_pair] = result
+        if _TEST_BENCHMARK:
+            print('execute_batch: time=%.3fs' % (time.time() - time_start))
+        self.assertEqual(sorted(results_batch), list(range(len(pairs))))
+        for idx_pair, result in enumerate(results):
+            self.assertLessEqual(results_batch[idx_pair], result * (1 + 1e-5))
+            self.assertAlmostEqual(results_batch[idx_pair] / result, 1, places=2)
+        # boxes of one pair each, and execute_dijk for the pairs too large for any box
+        sizes = [short._get_batch_box(pair)[2] for pair in pairs]
+        for max_vertex in [max(sizes), min(sizes) - 1]:
+            short = ShortestPath(dict(settings, batch_max_vertex=max_vertex))
+            results_batch = dict(short.execute_batch(pairs))
+            self.assertEqual(sorted(results_batch), list(range(len(pairs))))
+            for idx_pair, result in enumerate(results):
+                self.assertLessEqual(results_batch[idx_pair], result * (1 + 1e-5))
+                self.assertAlmostEqual(results_batch[idx_pair] / result, 1, places=2)
+        self.assertEqual([results_batch[idx_pair] for idx_pair in range(len(pairs))], results)
+
+    def test_mod_with_pool(self):
+        """ Test if the pool of processes gives the results of execute_dijk per pair
+        """
+        settings = {'extra_range':[0.01, 0.01, 2], 'ranges':[0.02, 0.02, 1]
+                    , 'path_model':None, 'graph_mode':'implicit'}
+        results = [[result[0], result[3]] for result in _test_mod_run_pairs(
+            settings, 'execute_dijk', _TEST_PAIRS_SHORT)]
+        for pool_workers in ([1, 2, 4] if _TEST_BENCHMARK else [2]):
+            short = ShortestPath(dict(settings, pool_workers=pool_workers))
+            time_start = time.time()
+            self.assertEqual(short.execute_pool(_TEST_PAIRS_SHORT, True), results)
+            if _TEST_BENCHMARK:
+                print('execute_pool: workers=%d, time=%.3fs' % (pool_workers
+                                                                , time.time() - time_start))
+        self.assertEqual(short.execute_pool(_TEST_PAIRS_SHORT)
+                         , [[travel_time, None] for travel_time, _ in results])
+
+    def test_mod_with_pool_dijk2(self):
+        """ Test if the workers of the explicit graph and the dijkstra program, each building
+        the graphs with several processes, give the results of execute_dijk
+        """
+        path_stub = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dijkstub.py')
+        settings = {'extra_range':[0.01, 0.01, 2], 'ranges':[0.02, 0.02, 1], 'path_model':None
+                    , 'path_dijk':'%s %s' % (sys.executable, path_stub), 'num_workers':2}
+        results = [[result[0], result[3]] for result in _test_mod_run_pairs(
+            settings, 'execute_dijk', _TEST_PAIRS_SHORT)]
+        short = ShortestPath(dict(settings, pool_workers=2))
+        self.assertEqual(short.execute_pool(_TEST_PAIRS_SHORT, True), results)
+        short.close()
+
 def main():
     """ unit test
     """
@@ -0,0 +1,206 @@
+#!/usr/bin/python
+
+""" The stuffs related to the precomputed slowness of the normalized grid.
+"""
+import os
+import tempfile
+import time
+import unittest
+import numpy as np
+import normgrid
+import geomodel
+
+# Number of grid points interpolated at once while sampling a region
+_CHUNK_SIZE = 1 << 20
+
+def get_slowness_key(idx_bound, stage, checksum, rounding='decimal'):
+    """ Return the key of the slowness of a region
+    Args:
+        idx_bound: [idx_min, idx_max], normalized indexes of the corners of the region
+        stage: stage number
+        checksum: checksum of the velocity model
+        rounding: rounding of the normalized grid used to recover the grid points
+    Returns:
+        key: string naming the region, stage, rounding and model
+    Raises:
+        Native exceptions.
+    """
+    return '%d_%d_%d_%s_%s' % (stage, idx_bound[0], idx_bound[1], rounding, checksum[:16])
+
+
+class SlownessGrid(object):
+    """ Slowness (1/velocity) of a velocity model at every normalized grid point of a region
+    The values are kept by LocalGrid id in one array, saved as <dirpath>/slowness_<key>.npy
+    and memory mapped by the later instances of the same region, stage and model.
+    Public Methods:
+        get_key: get the key of the region, stage and model
+        get_grid: get the LocalGrid of the region
+        get_slownesses: get the slowness of an array of global indexes
+        get_info: get the size, format and building time
+    """
+    def __init__(self, geo_model, loc_min, loc_max, stage, dirpath=None, idx_bound=None):
+        """ Load the slowness of the region, or sample the model at every grid point
+        Args:
+            geo_model: GeoModel to sample
+            loc_min: lowermost coordinate of the region
+            loc_max: uppermost coordinate of the region
+            stage: stage number
+            dirpath: directory of the saved slowness, kept in memory only if None
+            idx_bound: [idx_min, idx_max], normalized indexes of the corners to use
+                       instead of loc_min and loc_max
+        """
+        self._norm = normgrid.NormGrid()
+        if idx_bound is None:
+            idx_bound = [self._norm.get_norm_index(loc_min, stage)
+                         , self._norm.get_norm_index(loc_max, stage)]
+        self._stage = stage
+        self._grid = normgrid.LocalGrid(None, None, stage, idx_bound)
+        self._key = get_slowness_key(idx_bound, stage, geo_model.get_checksum()
+                                     , self._norm.get_rounding())
+        self._info = {}
+        time_start = time.time()
+        filepath = None
+        if dirpath is not None:
+            filepath = os.path.join(dirpath, 'slowness_%s.npy' % self._key)
+        if filepath is not None and os.path.isfile(filepath):
+            self._slowness = np.load(filepath, mmap_mode='r')
+            self._info['format'] = 'binary'
+        else:
+            self._slowness = self._sample(geo_model, filepath)
+        self._info['build_time'] = time.time() - time_start
+
+    def _sample(self, geo_model, filepath):
+        size = self._grid.get_size()
+        filepath_tmp = None
+        if filepath is None:
+            slowness = np.empty(size)
+        else:
+            filepath_tmp = '%s.%d.tmp' % (filepath, os.getpid())
+            try:
+                slowness = np.lib.format.open_memmap(filepath_tmp, mode='w+', dtype=np.float64
+                                                     , shape=(size,))
+            except OSError:
+                print("Cannot write slowness %s" % filepath)
+                filepath_tmp = None
+                slowness = np.empty(size)
+        for start in range(0, size, _CHUNK_SIZE):
+            idx_locs = self._grid.get_global_ids(np.arange(start, min(start + _CHUNK_SIZE, size)))
+            locs = self._norm.recover_norm_locs(idx_locs, self._stage)
+            slowness[start:start + len(idx_locs)] = 1 / geo_model.get_speeds(locs)
+        if filepath_tmp is None:
+            self._info['format'] = 'memory'
+            return slowness
+        slowness.flush()
+        del slowness
+        os.replace(filepath_tmp, filepath)
+        self._info['format'] = 'computed'
+        return np.load(filepath, mmap_mode='r')
+
+    def get_key(self):
+        """ Return the key of the region, stage and model
+        Args:
+        Returns:
+            key: string naming the region, stage, rounding and model
+        Raises:
+            Native exceptions.
+        """
+        return self._key
+
+    def get_grid(self):
+        """ Return the LocalGrid of the region
+        Args:
+        Returns:
+            grid: LocalGrid
+        Raises:
+            Native exceptions.
+        """
+        return self._grid
+
+    def get_slownesses(self, idx_locs):
+        """ Return the slowness of an array of global indexes
+        Args:
+            idx_locs: array of normalized global indexes
+        Returns:
+            slowness: array of slowness (sec/km), NaN for the points outside the region
+        Raises:
+            Native exceptions.
+        """
+        local_ids = self._grid.get_local_ids(idx_locs)
+        inside = local_ids >= 0
+        slowness = np.full(len(local_ids), np.nan)
+        slowness[inside] = self._slowness[local_ids[inside]]
+        return slowness
+
+    def get_info(self):
+        """ Return the size, format and building time
+        Args:
+        Returns:
+            info: dictionary of size, nbytes, format ('memory', 'computed' or 'binary' when
+                  loaded from a previous run) and build_time (sec)
+        Raises:
+            Native exceptions.
+        """
+        info = dict(self._info)
+        info['size'] = self._grid.get_size()
+        info['nbytes'] = self._slowness.nbytes
+        return info
+
+
+class SlownessGridTest(unittest.TestCase):
+    """ Test with slowness lookup against the model interpolation
+    """
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._filepath = os.path.join(self._dir.name, 'MOD_TEST')
+        geomodel._test_mod_write_model(self._filepath
+                                       , [[119.0, 120.0, 120.5, 122.0], [22.0, 23.0, 24.5]
+                                          , [-10.0, 0.0, 4.0, 30.0]]
+                                       , lambda lon, lat, dep: 3 + (lon - 119) * 0.3 + dep * 0.04)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_mod_with_slowness(self):
+        """ Test if the slowness is the inverse of the interpolated speed at every grid point
+        """
+        norm = normgrid.NormGrid()
+        geo_model = geomodel.GeoModel(self._filepath)
+        for stage in [1, 2]:
+            slowness_grid = SlownessGrid(geo_model, [120.12, 23.2, 1.3], [120.17, 23.24, 4], stage)
+            idx_locs = slowness_grid.get_grid().get_global_ids()
+            self.assertEqual(slowness_grid.get_slownesses(idx_locs).tolist()
+                             , [1 / geo_model.get_speed(norm.recover_norm_loc(idx, stage))
+                                for idx in idx_locs.tolist()])
+            outside = norm.get_norm_index([120.11, 23.2, 2], stage)
+            self.assertTrue(np.isnan(slowness_grid.get_slownesses([outside])[0]))
+
+    def test_mod_with_saved_slowness(self):
+        """ Test if the saved slowness is reused only for the same region, stage and model
+        """
+        geo_model = geomodel.GeoModel(self._filepath)
+        region = [[120.12, 23.2, 1.3], [120.17, 23.24, 4]]
+        slowness_grid = SlownessGrid(geo_model, region[0], region[1], 1, self._dir.name)
+        self.assertEqual(slowness_grid.get_info()['format'], 'computed')
+        slowness_saved = SlownessGrid(geo_model, region[0], region[1], 1, self._dir.name)
+        self.assertEqual(slowness_saved.get_info()['format'], 'binary')
+        idx_locs = slowness_grid.get_grid().get_global_ids()
+        self.assertEqual(slowness_saved.get_slownesses(idx_locs).tolist()
+                         , slowness_grid.get_slownesses(idx_locs).tolist())
+        self.assertEqual(SlownessGrid(geo_model, region[0], region[1], 2, self._dir.name)
+                         .get_info()['format'], 'computed')
+        self.assertEqual(SlownessGrid(geo_model, region[0], [120.18, 23.24, 4], 1, self._dir.name)
+                         .get_info()['format'], 'computed')
+        geomodel._test_mod_write_model(self._filepath, [[119.0, 122.0], [22.0, 24.5], [-10.0, 30.0]]
+                                       , lambda lon, lat, dep: 5)
+        self.assertEqual(SlownessGrid(geomodel.GeoModel(self._filepath), region[0], region[1], 1
+                                      , self._dir.name).get_info()['format'], 'computed')
+
+
+def main():
+    """ unit test
+    """
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/python
+
+""" The stuffs related to the travel time field of a station over a region.
+"""
+import math
+import time
+import unittest
+import numpy as np
+import normgrid
+import graphbuilder
+import graphsearch
+
+class TravelTimeField(object):
+    """ Travel time from a station to every normalized grid point of a region
+    The graph of the region is searched once from the station, and the times are kept by
+    LocalGrid id in one array, so the time of any source of the region is a lookup.
+    Public Methods:
+        get_grid: get the LocalGrid of the region
+        get_times: get the times of every grid point
+        get_travel_times: get the times of the grid points of some locations
+        get_path: get the shortest path from the station to the grid point of a location
+        get_info: get the size and the building and search times
+    """
+    def __init__(self, graphbuild, sta_loc, loc_min, loc_max, stage=1):
+        """ Build the graph of the region and search it from the station
+        Args:
+            graphbuild: GraphBuilder
+            sta_loc: location of station, inside the region
+            loc_min: lowermost coordinate of the region
+            loc_max: uppermost coordinate of the region
+            stage: stage number of the grid
+        """
+        self._norm = normgrid.NormGrid()
+        self._stage = stage
+        self._info = {}
+        time_start = time.time()
+        self._grid, idx_src, idx_dst, weights = graphbuild.build_graph_region(loc_min, loc_max
+                                                                              , stage)
+        self._info['num_edge'] = len(weights)
+        self._info['build_time'] = time.time() - time_start
+        time_start = time.time()
+        self._times = np.full(self._grid.get_size(), math.inf)
+        self._prevs = {}
+        idx_sta = self._grid.get_local_id(self._norm.get_norm_index(sta_loc, stage))
+        if idx_sta is None:
+            print("Station %s out of the region" % sta_loc)
+        else:
+            csr = graphsearch.get_csr(idx_src, idx_dst, weights, self._grid.get_size())
+            dists, self._prevs = graphsearch.dijkstra_csr(*csr, idx_sta)
+            self._times[list(dists)] = list(dists.values())
+        self._info['search_time'] = time.time() - time_start
+
+    def get_grid(self):
+        """ Return the LocalGrid of the region
+        Args:
+        Returns:
+            grid: LocalGrid
+        Raises:
+            Native exceptions.
+        """
+        return self._grid
+
+    def get_times(self):
+        """ Return the times of every grid point of the region
+        Args:
+        Returns:
+            times: array of travel times (sec) by local id, inf for the unreached points
+        Raises:
+            Native exceptions.
+        """
+        return self._times
+
+    def get_travel_times(self, locs):
+        """ Return the times of the grid points of some locations
+        Args:
+            locs: list of locations, [[lon, lat, dep], ...]
+        Returns:
+            times: array of travel times (sec), NaN for the locations outside the region
+        Raises:
+            Native exceptions.
+        """
+        local_ids = self._grid.get_local_ids([self._norm.get_norm_index(loc, self._stage)
+                                              for loc in locs])
+        inside = local_ids >= 0
+        times = np.full(len(local_ids), np.nan)
+        times[inside] = self._times[local_ids[inside]]
+        return times
+
+    def get_path(self, loc):
+        """ Return the shortest path from the station to the grid point of a location
+        Args:
+            loc: location, [lon, lat, dep]
+        Returns:
+            path: list of the locations of the grid points from the station, None if the
+                  location is not reached
+        Raises:
+            Native exceptions.
+        """
+        local_id = self._grid.get_local_id(self._norm.get_norm_index(loc, self._stage))
+        if local_id not in self._prevs:
+            return None
+        idx_locs = self._grid.get_global_ids(graphsearch.get_path(self._prevs, local_id))
+        return [self._norm.recover_norm_loc(idx, self._stage) for idx in idx_locs.tolist()]
+
+    def get_info(self):
+        """ Return the size and the building and search times
+        Args:
+        Returns:
+            info: dictionary of size, num_edge, build_time (sec) and search_time (sec)
+        Raises:
+            Native exceptions.
+        """
+        info = dict(self._info)
+        info['size'] = self._grid.get_size()
+        return info
+
+
+class TravelTimeFieldTest(unittest.TestCase):
+    """ Test with the field against the search of the graph of build_graph
+    """
+    def test_mod_with_field(self):
+        """ Test if the field has the distances of the graph of a station and a source
+        """
+        settings = {'extra_range':[0, 0, 0], 'ranges':[0.01, 0.01, 1], 'path_model':None}
+        graphbuild = graphbuilder.GraphBuilder(settings)
+        norm = normgrid.NormGrid()
+        loc_sta = [121.740700, 24.428, -0.113000]
+        loc_sou = [121.790000, 24.47, 3.500000]
+        time_start = time.time()
+        field = TravelTimeField(graphbuild, loc_sta, loc_sta, loc_sou)
+        print('field: time=%.3fs, %s' % (time.time() - time_start, field.get_info()))
+        idx_src, idx_dst, weights = [], [], []
+        for edge in graphbuild.build_graph(loc_sta, loc_sou, 1):
+            idx_src.append(edge.get_info()[0])
+            idx_dst.append(edge.get_info()[1])
+            weights.append(edge.get_info()[2])
+        idx_vertex = sorted(set(idx_src + idx_dst))
+        num_vertex = {idx:num for num, idx in enumerate(idx_vertex)}
+        dists, _ = graphsearch.dijkstra_csr(*graphsearch.get_csr(
+            np.array([num_vertex[idx] for idx in idx_src])
+            , np.array([num_vertex[idx] for idx in idx_dst]), np.array(weights)
+            , len(idx_vertex)), num_vertex[norm.get_norm_index(loc_sta, 1)])
+        times = field.get_times()[field.get_grid().get_local_ids(idx_vertex)]
+        self.assertTrue(np.allclose(times, [dists[num] for num in range(len(idx_vertex))]
+                                    , rtol=1e-12))
+        self.assertEqual(field.get_travel_times([loc_sta])[0], 0.0)
+        self.assertAlmostEqual(field.get_travel_times([loc_sou])[0]
+                               , dists[num_vertex[norm.get_norm_index(loc_sou, 1)]])
+        self.assertTrue(np.isnan(field.get_travel_times([[121.9, 24.428, 0]])[0]))
+        path = field.get_path(loc_sou)
+        self.assertEqual(path[0], norm.recover_norm_loc(norm.get_norm_index(loc_sta, 1), 1))
+        self.assertEqual(path[-1], norm.recover_norm_loc(norm.get_norm_index(loc_sou, 1), 1))
+        self.assertIsNone(field.get_path([121.9, 24.428, 0]))
+
+
+def main():
+    """ unit test
+    """
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()